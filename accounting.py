@@ -0,0 +1,179 @@
+from __future__ import annotations
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from tracelog import tracelog_info, tracelog_warn
+from utils import utils_cached_tokens
+
+ACCOUNTING_VERSION = 1
+
+_accounting_cfg: Dict[str, Any] = {"token_budget": 0, "time_budget_s": 0.0, "price_prompt": 0.0, "price_completion": 0.0,
+                                   "summary_path": ""}
+_accounting_lock = threading.Lock()
+_accounting_run: Dict[str, Any] = {"task": "", "model_id": "", "started": 0.0, "t0": 0.0, "steps": [], "exceeded": None}
+
+
+def accounting_configure(token_budget: int = 0, time_budget_s: float = 0.0, price_prompt: float = 0.0,
+                         price_completion: float = 0.0, summary_path: str = "") -> None:
+    """Per-task budgets (0: none) on prompt+completion tokens and wall-clock seconds,
+    prices per million prompt/completion tokens for the cost estimate, and the file the
+    run summary is written to ("" writes none)."""
+    _accounting_cfg.update({"token_budget": max(0, token_budget), "time_budget_s": max(0.0, time_budget_s),
+                            "price_prompt": max(0.0, price_prompt), "price_completion": max(0.0, price_completion),
+                            "summary_path": summary_path})
+
+
+def accounting_begin(task: str, model_id: str = "") -> None:
+    with _accounting_lock:
+        _accounting_run.update({"task": task, "model_id": model_id, "started": time.time(), "t0": time.perf_counter(),
+                                "steps": [], "exceeded": None})
+
+
+def _accounting_server_timing(resp: Dict[str, Any]) -> Dict[str, Any]:
+    # llama.cpp reports timings.{prompt_n,prompt_ms,predicted_n,predicted_ms}; LM Studio's
+    # REST API reports stats.{time_to_first_token,generation_time} in seconds. A streamed
+    # reply without either still has the client-side time to first token.
+    timings = resp.get("timings") or {}
+    if timings.get("prompt_ms") is not None or timings.get("predicted_ms") is not None:
+        return {"prefill_ms": timings.get("prompt_ms"), "decode_ms": timings.get("predicted_ms"),
+                "prefill_tokens": timings.get("prompt_n"), "timing": "server"}
+    stats = resp.get("stats") or {}
+    if stats.get("time_to_first_token") is not None or stats.get("generation_time") is not None:
+        ttft, gen = stats.get("time_to_first_token"), stats.get("generation_time")
+        return {"prefill_ms": None if ttft is None else ttft * 1000.0, "decode_ms": None if gen is None else gen * 1000.0,
+                "prefill_tokens": None, "timing": "server"}
+    stream = resp.get("stream_stats") or {}
+    if stream.get("ttft_s") is not None:
+        return {"prefill_ms": stream["ttft_s"] * 1000.0, "decode_ms": (stream["total_s"] - stream["ttft_s"]) * 1000.0,
+                "prefill_tokens": None, "timing": "client"}
+    return {"prefill_ms": None, "decode_ms": None, "prefill_tokens": None, "timing": None}
+
+
+def accounting_model(resp: Optional[Dict[str, Any]], request_s: float, source: str = "model") -> None:
+    """Open a step record from a model response (None when no model was asked, e.g. a trajectory cache hit)."""
+    usage = (resp or {}).get("usage") or {}
+    row: Dict[str, Any] = {"step": 0, "source": source, "tool": None, "prompt_tokens": usage.get("prompt_tokens"),
+                           "completion_tokens": usage.get("completion_tokens"),
+                           "cached_tokens": utils_cached_tokens(resp) if resp else None,
+                           "request_s": round(request_s, 4), "tool_s": 0.0}
+    row.update(_accounting_server_timing(resp or {}))
+    with _accounting_lock:
+        row["step"] = len(_accounting_run["steps"]) + 1
+        _accounting_run["steps"].append(row)
+    tracelog_info("accounting_step", row)
+
+
+def accounting_tool(name: str, tool_s: float) -> None:
+    with _accounting_lock:
+        if _accounting_run["steps"]:
+            _accounting_run["steps"][-1].update({"tool": name, "tool_s": round(tool_s, 4)})
+
+
+def _accounting_totals(steps: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def total(key: str) -> int:
+        return sum(int(r[key] or 0) for r in steps)
+    prompt, completion = total("prompt_tokens"), total("completion_tokens")
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "cached_tokens": total("cached_tokens"),
+            "total_tokens": prompt + completion}
+
+
+def accounting_time_left() -> Optional[float]:
+    """Seconds left in the time budget (never negative), or None without one. The agent
+    clamps each step's deadline and request timeout to it."""
+    budget = _accounting_cfg["time_budget_s"]
+    if not budget:
+        return None
+    with _accounting_lock:
+        elapsed = time.perf_counter() - _accounting_run["t0"]
+    return max(0.0, budget - elapsed)
+
+
+def accounting_over_budget() -> Optional[Dict[str, Any]]:
+    """The budget this run has used up, or None. Checked between steps, so the step that
+    crosses the token budget still completes; a step cannot outlast the time budget (see
+    accounting_time_left)."""
+    cfg = _accounting_cfg
+    with _accounting_lock:
+        if _accounting_run["exceeded"] is not None:
+            return _accounting_run["exceeded"]
+        used = _accounting_totals(_accounting_run["steps"])["total_tokens"]
+        elapsed = time.perf_counter() - _accounting_run["t0"]
+        reason = None
+        if cfg["token_budget"] and used >= cfg["token_budget"]:
+            reason = {"budget": "tokens", "limit": cfg["token_budget"], "used": used}
+        elif cfg["time_budget_s"] and elapsed >= cfg["time_budget_s"]:
+            reason = {"budget": "time_s", "limit": cfg["time_budget_s"], "used": round(elapsed, 3)}
+        if reason is None:
+            return None
+        reason["step"] = len(_accounting_run["steps"])
+        _accounting_run["exceeded"] = reason
+    tracelog_warn("budget_exceeded", reason)
+    return reason
+
+
+def accounting_stop_message(reason: Dict[str, Any]) -> str:
+    return f"STOPPED EARLY ({reason['budget']} budget after step {reason['step']}): used {reason['used']} of {reason['limit']}."
+
+
+def _accounting_prefill_tokens(row: Dict[str, Any]) -> Optional[int]:
+    # Tokens the server actually processed: the uncached part of the prompt.
+    if row["prefill_tokens"] is not None:
+        return int(row["prefill_tokens"])
+    if row["prompt_tokens"] is None:
+        return None
+    return int(row["prompt_tokens"]) - int(row["cached_tokens"] or 0)
+
+
+def accounting_summary(outcome: str = "", final: str = "") -> Dict[str, Any]:
+    """Per-task totals, timing split, throughput, cost and budget state, plus every step."""
+    cfg = _accounting_cfg
+    with _accounting_lock:
+        steps = [dict(r) for r in _accounting_run["steps"]]
+        run = dict(_accounting_run)
+    wall = time.perf_counter() - run["t0"] if run["t0"] else 0.0
+    totals = _accounting_totals(steps)
+    model = [r for r in steps if r["source"] != "trajcache"]
+    model_s = sum(r["request_s"] for r in model)
+    tool_s = sum(r["tool_s"] for r in steps)
+
+    def rate(tokens: List[Any], ms: List[Any]) -> Optional[float]:
+        pairs = [(t, m) for t, m in zip(tokens, ms) if t is not None and m]
+        return round(sum(t for t, _ in pairs) * 1000.0 / sum(m for _, m in pairs), 1) if pairs else None
+
+    throughput = {"prefill_tps": rate([_accounting_prefill_tokens(r) for r in model], [r["prefill_ms"] for r in model]),
+                  "decode_tps": rate([r["completion_tokens"] for r in model], [r["decode_ms"] for r in model]),
+                  "end_to_end_tps": round(totals["completion_tokens"] / model_s, 1) if model_s else None,
+                  "timing": next((r["timing"] for r in model if r["timing"]), None)}
+    cost = None
+    if cfg["price_prompt"] or cfg["price_completion"]:
+        cost = round((totals["prompt_tokens"] * cfg["price_prompt"] + totals["completion_tokens"] * cfg["price_completion"]) / 1e6, 6)
+    return {"version": ACCOUNTING_VERSION, "task": run["task"], "model_id": run["model_id"], "started": run["started"],
+            "outcome": outcome, "final": final, "steps": len(steps), "model_calls": len(model),
+            "totals": totals, "wall_s": round(wall, 3), "model_s": round(model_s, 3), "tool_s": round(tool_s, 3),
+            "other_s": round(max(0.0, wall - model_s - tool_s), 3), "throughput": throughput, "cost": cost,
+            "budgets": {"tokens": cfg["token_budget"] or None, "time_s": cfg["time_budget_s"] or None, "exceeded": run["exceeded"]},
+            "per_step": steps}
+
+
+def accounting_stats() -> Dict[str, Any]:
+    """The summary without the per-step rows, for a one-line report."""
+    out = accounting_summary()
+    for key in ("per_step", "final", "outcome"):
+        out.pop(key)
+    return out
+
+
+def accounting_end(outcome: str, final: str) -> None:
+    """Write the run summary (atomic replace), if a path is configured."""
+    path = _accounting_cfg["summary_path"]
+    if not path:
+        return
+    data = json.dumps(accounting_summary(outcome, final), indent=2)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + f".{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp, path)
@@ -1,9 +1,22 @@
 from __future__ import annotations
+import asyncio
 import json
 import time
-from typing import Any, Dict, List
-from scenarios import scenarios_execute_tool
-from utils import utils_post_json, utils_strip_think
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from accounting import (accounting_begin, accounting_end, accounting_model, accounting_over_budget, accounting_stop_message,
+                        accounting_time_left, accounting_tool)
+from body import StaticJSON
+from scenarios import scenarios_execute_tool, scenarios_record_usage, scenarios_unchanged_stats
+from profiler import profiler_span
+from progress import progress_begin, progress_enabled, progress_snapshot, progress_step, progress_stop_message
+from session import session_begin, session_end, session_model, session_tool
+from settle import settle_adaptive
+from streaming import streaming_post_json
+from tracelog import tracelog_error, tracelog_info, tracelog_warn
+from trajcache import (trajcache_commit, trajcache_count_model_call, trajcache_enabled, trajcache_flush, trajcache_lookup,
+                       trajcache_message, trajcache_note, trajcache_state, trajcache_verify)
+from utils import utils_post_json, utils_record_prompt_cache, utils_strip_think
 
 
 def trim_to_stateless(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -25,7 +38,78 @@ def trim_to_stateless(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return messages[:2] + messages[-3:]
 
 
-def run_agent(system_prompt: str, task_prompt: str, tools_schema: List[Dict[str, Any]], cfg: Dict[str, Any]) -> str:
+def _agent_canonical_assistant(msg: Dict[str, Any]) -> Dict[str, Any]:
+    """The assistant turn as it is sent back: fixed keys in a fixed order, server extras
+    (reasoning_content, refusal, null fields) dropped, arguments always a JSON string.
+
+    Keeps the history byte-identical however the server (or which of several routed
+    servers) shaped its reply, so the prompt renders to the same tokens every time.
+    """
+    content = msg.get("content")
+    out: Dict[str, Any] = {"role": "assistant", "content": content if isinstance(content, str) else ""}
+    tool_calls = []
+    for i, tc in enumerate(msg.get("tool_calls") or []):
+        fn = tc.get("function") or {}
+        args = fn.get("arguments")
+        if not isinstance(args, str):
+            args = json.dumps(args if args is not None else {}, ensure_ascii=True)
+        tool_calls.append({"id": tc.get("id") or f"call_{i}", "type": "function",
+                           "function": {"name": fn.get("name") or "", "arguments": args}})
+    if tool_calls:
+        out["tool_calls"] = tool_calls
+    return out
+
+
+def _agent_with_plan(arg_str: Any, plan: str) -> str:
+    # Tool arguments with the plan swapped for its compacted form (see plancompact.py).
+    args = dict(json.loads(arg_str) if isinstance(arg_str, str) else arg_str)
+    args["plan"] = plan
+    return json.dumps(args, ensure_ascii=True)
+
+
+def _agent_tool_ok(tool_msg: Dict[str, Any]) -> bool:
+    try:
+        return bool(json.loads(tool_msg.get("content") or "").get("ok"))
+    except (ValueError, AttributeError):
+        return False
+
+
+def _agent_log_unchanged(dump_cfg: Dict[str, Any]) -> None:
+    if dump_cfg["unchanged_mode"] != "off":
+        tracelog_info("unchanged_stats", scenarios_unchanged_stats())
+
+
+async def _agent_within(fut: Any, deadline: Optional[float], what: str) -> Any:
+    # Per-step deadline: whatever is left of the step's budget bounds each awaited phase.
+    if deadline is None:
+        return await fut
+    remaining = deadline - asyncio.get_running_loop().time()
+    try:
+        return await asyncio.wait_for(fut, max(0.0, remaining))
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"step deadline exceeded during {what}") from None
+
+
+def _agent_dump_submit(writer: ThreadPoolExecutor, failures: List[str]) -> Callable[..., Future]:
+    # writer.submit that logs a failed write as it happens and keeps it for the end of the run.
+    def done(fut: Future) -> None:
+        e = fut.exception()
+        if e is not None:
+            failures.append(f"{type(e).__name__}: {e}")
+            tracelog_warn("dump_write_failed", {"error": failures[-1]})
+    
+    def submit(fn: Callable[..., Any], *args: Any) -> Future:
+        fut = writer.submit(fn, *args)
+        fut.add_done_callback(done)
+        return fut
+    return submit
+
+
+async def run_agent_async(system_prompt: str, task_prompt: str, tools_schema: List[Dict[str, Any]], cfg: Dict[str, Any]) -> str:
+    """Agent loop on asyncio. Model I/O and tool execution (capture, encode) run in worker
+    threads, dump files are written by a FIFO background writer so the next request is
+    assembled and sent while they land, and each step runs under an optional deadline.
+    """
     endpoint = cfg["endpoint"]
     model_id = cfg["model_id"]
     timeout = cfg["timeout"]
@@ -33,44 +117,198 @@ def run_agent(system_prompt: str, task_prompt: str, tools_schema: List[Dict[str,
     max_tokens = cfg["max_tokens"]
     max_steps = cfg["max_steps"]
     step_delay = cfg["step_delay"]
+    step_deadline = cfg.get("step_deadline", 0.0)
+    stream = cfg.get("stream", False)
+    loop = asyncio.get_running_loop()
+    writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dump-writer")
+    dump_failures: List[str] = []
     dump_cfg = {"dump_dir": cfg["dump_dir"], "dump_prefix": cfg["dump_prefix"], "dump_idx": cfg["dump_start"],
-                "target_w": cfg["target_w"], "target_h": cfg["target_h"]}
+                "target_w": cfg["target_w"], "target_h": cfg["target_h"], "image_encoder": cfg.get("image_encoder"),
+                "observe_scale": cfg.get("observe_scale", 1.0), "zoom_max_w": cfg.get("zoom_max_w", cfg["target_w"]),
+                "zoom_max_h": cfg.get("zoom_max_h", cfg["target_h"]),
+                "unchanged_mode": cfg.get("unchanged_mode", "off"), "unchanged_threshold": cfg.get("unchanged_threshold", 0.0),
+                "last_seen": None, "observation": "", "dump_writer": _agent_dump_submit(writer, dump_failures)}
     
     messages: List[Dict[str, Any]] = [{"role": "system", "content": system_prompt}, {"role": "user", "content": task_prompt}]
+    # System prompt, task and tool schema are identical on every step: encode them once,
+    # so each request starts with the same bytes and the server's prompt cache can hit.
+    static_head = [StaticJSON(messages[0]), StaticJSON(messages[1])]
+    static_tools = StaticJSON(tools_schema)
+    cache_hints: Dict[str, Any] = {}
+    if cfg.get("cache_prompt"):
+        cache_hints["cache_prompt"] = True
+    if cfg.get("slot_id", -1) >= 0:
+        cache_hints["id_slot"] = cfg["slot_id"]
     last_content = ""
+    # The observation message currently in context and whether it carried a full frame,
+    # so each response's prompt tokens can be attributed for the unchanged-screen stats.
+    obs_msg: Optional[Dict[str, Any]] = None
+    obs_kind = ""
+    # Trajectory cache: the tool that ran last (part of the state key), and whether the
+    # previous cached action failed verification, in which case the model decides next.
+    prev_tool = ""
+    traj_bypass = False
+    session_begin(task_prompt, cfg)
+    progress_begin()
+    accounting_begin(task_prompt, model_id)
+    # How the run ended, for the run summary; anything that escapes the loop is an error.
+    outcome = "error"
     
-    for _ in range(max_steps):
-        resp = utils_post_json({"model": model_id, "messages": messages, "tools": tools_schema, "tool_choice": "auto",
-                                "temperature": temperature, "max_tokens": max_tokens}, endpoint, timeout)
-        msg = resp["choices"][0]["message"]
-        messages.append(msg)
-        
-        if isinstance(msg.get("content"), str):
-            last_content = msg["content"]
-        
-        tool_calls = msg.get("tool_calls") or []
-        if not tool_calls:
-            return utils_strip_think(last_content)
-        
-        if len(tool_calls) > 1:
-            for extra_tc in tool_calls[1:]:
-                messages.append({"role": "tool", "tool_call_id": extra_tc["id"], "name": extra_tc["function"]["name"],
-                                "content": json.dumps({"ok": False, "error": "too_many_tool_calls"})})
-            tool_calls = tool_calls[:1]
-        
-        tc = tool_calls[0]
-        name = tc["function"]["name"]
-        arg_str = tc["function"].get("arguments")
-        call_id = tc["id"]
+    try:
+        for step in range(max_steps):
+            over = accounting_over_budget()
+            if over is not None:
+                _agent_log_unchanged(dump_cfg)
+                outcome = "budget"
+                last_content = accounting_stop_message(over)
+                return last_content
+            deadline = loop.time() + step_deadline if step_deadline > 0 else None
+            # Nor does the step outlive the time budget.
+            left = accounting_time_left()
+            if left is not None and (deadline is None or loop.time() + left < deadline):
+                deadline = loop.time() + left
+            # The transport timeout never outlives the step, so an abandoned request thread ends with it.
+            req_timeout = timeout if deadline is None else max(1.0, min(timeout, deadline - loop.time()))
+            payload = {"model": model_id, "messages": static_head + messages[2:], "tools": static_tools, "tool_choice": "auto",
+                       "temperature": temperature, "max_tokens": max_tokens, **cache_hints}
+            # Streaming mode runs the first tool call as soon as its arguments are complete,
+            # overlapping the action with the remainder of the generation.
+            early: Dict[str, Tuple[Dict[str, Any], Optional[Dict[str, Any]], float]] = {}
+            traj_state: Optional[Dict[str, Any]] = None
+            traj_hit: Optional[Dict[str, Any]] = None
+            if trajcache_enabled():
+                traj_state = await _agent_within(loop.run_in_executor(None, trajcache_state, task_prompt, prev_tool), deadline, "trajcache")
+                if not traj_bypass:
+                    traj_hit = trajcache_lookup(traj_state)
+                traj_bypass = False
+            t_request = time.perf_counter()
+            if traj_hit is not None:
+                resp = {"choices": [{"message": trajcache_message(traj_hit, f"traj_{step + 1}")}]}
+            elif stream:
+                def dispatch(index: int, tc: Dict[str, Any]) -> None:
+                    if index == 0:
+                        with profiler_span("tool." + tc["function"]["name"], {"early": True}):
+                            t0 = time.perf_counter()
+                            tool_msg, user_msg = scenarios_execute_tool(tc["function"]["name"], tc["function"].get("arguments"), tc["id"], dump_cfg)
+                            early[tc["id"]] = tool_msg, user_msg, time.perf_counter() - t0
+                def post() -> Dict[str, Any]:
+                    with profiler_span("model_request", {"stream": True}):
+                        return session_model(payload, lambda: streaming_post_json(payload, endpoint, req_timeout, dispatch))
+                resp = await _agent_within(loop.run_in_executor(None, post), deadline, "model_request")
+                if "stream_stats" in resp:
+                    tracelog_info("stream_stats", resp["stream_stats"])
+            else:
+                def post() -> Dict[str, Any]:
+                    with profiler_span("model_request"):
+                        return session_model(payload, lambda: utils_post_json(payload, endpoint, req_timeout))
+                resp = await _agent_within(loop.run_in_executor(None, post), deadline, "model_request")
+            accounting_model(resp if traj_hit is None else None, time.perf_counter() - t_request,
+                             "trajcache" if traj_hit is not None else "model")
+            if traj_hit is None:
+                if obs_msg is not None and any(m is obs_msg for m in messages):
+                    scenarios_record_usage(obs_kind, resp.get("usage"))
+                utils_record_prompt_cache(resp)
+                if traj_state is not None:
+                    trajcache_count_model_call(task_prompt)
+            reply = resp["choices"][0]["message"]
+            msg = _agent_canonical_assistant(reply)
+            messages.append(msg)
+            
+            if isinstance(reply.get("content"), str):
+                last_content = reply["content"]
+            
+            tool_calls = msg.get("tool_calls") or []
+            if not tool_calls:
+                _agent_log_unchanged(dump_cfg)
+                trajcache_commit()
+                outcome = "answered"
+                return utils_strip_think(last_content)
+            
+            if len(tool_calls) > 1:
+                for extra_tc in tool_calls[1:]:
+                    messages.append({"role": "tool", "tool_call_id": extra_tc["id"], "name": extra_tc["function"]["name"],
+                                    "content": json.dumps({"ok": False, "error": "too_many_tool_calls"})})
+                tool_calls = tool_calls[:1]
+            
+            tc = tool_calls[0]
+            name = tc["function"]["name"]
+            arg_str = tc["function"].get("arguments")
+            call_id = tc["id"]
+            
+            if call_id in early:
+                tool_msg, user_msg, tool_s = early[call_id]
+            else:
+                def run_tool() -> Tuple[Dict[str, Any], Optional[Dict[str, Any]], float]:
+                    with profiler_span("tool." + name):
+                        t0 = time.perf_counter()
+                        tool_msg, user_msg = scenarios_execute_tool(name, arg_str, call_id, dump_cfg)
+                        return tool_msg, user_msg, time.perf_counter() - t0
+                tool_msg, user_msg, tool_s = await _agent_within(loop.run_in_executor(None, run_tool), deadline, "tool." + name)
+            compacted = dump_cfg.pop("compacted_plan", None)
+            if compacted is not None:
+                tc["function"]["arguments"] = _agent_with_plan(arg_str, compacted)
+            session_tool(name, arg_str, tool_msg, user_msg, tool_s)
+            accounting_tool(name, tool_s)
+            # The screen after the action, shared by the trajectory cache and the progress monitor.
+            post = None
+            tool_ok = _agent_tool_ok(tool_msg)
+            if progress_enabled() or (traj_state is not None and tool_ok):
+                post = await _agent_within(loop.run_in_executor(None, progress_snapshot), deadline, "snapshot")
+            if traj_state is not None:
+                if traj_hit is not None:
+                    traj_bypass = not trajcache_verify(traj_hit, post if tool_ok else None)
+                elif tool_ok:
+                    trajcache_note(traj_state, msg, post)
+            prev_tool = name
+            messages.append(tool_msg)
+            stall = progress_step(name, arg_str, post)
+            if stall is not None and stall["action"] == "abort":
+                _agent_log_unchanged(dump_cfg)
+                outcome = "stalled"
+                last_content = progress_stop_message(stall)
+                return last_content
+            if user_msg is not None:
+                if stall is not None:
+                    user_msg["content"] = [{"type": "text", "text": stall["note"]}] + user_msg["content"]
+                messages.append(user_msg)
+                obs_msg = user_msg
+                obs_kind = dump_cfg["observation"]
+            elif stall is not None:
+                messages.append({"role": "user", "content": stall["note"]})
+            
+            # Apply Memento Pattern: trim to stateless context
+            messages = trim_to_stateless(messages)
+            
+            # Adaptive settle already waited for the screen to react to the action and settle
+            if not settle_adaptive() and step_delay > 0:
+                with profiler_span("step_delay"):
+                    await asyncio.sleep(step_delay)
         
-        tool_msg, user_msg = scenarios_execute_tool(name, arg_str, call_id, dump_cfg)
-        messages.append(tool_msg)
-        if user_msg is not None:
-            messages.append(user_msg)
-        
-        # Apply Memento Pattern: trim to stateless context
-        messages = trim_to_stateless(messages)
-        
-        time.sleep(step_delay)
-    
-    return utils_strip_think(last_content)
+        _agent_log_unchanged(dump_cfg)
+        outcome = "max_steps"
+        return utils_strip_think(last_content)
+    except Exception as e:
+        # A step cut short because its deadline or request timeout ran into the time budget
+        # ends the run the same way as the check between steps.
+        over = accounting_over_budget()
+        if not (isinstance(e, TimeoutError) or isinstance(e.__cause__, TimeoutError)) or over is None or over["budget"] != "time_s":
+            raise
+        _agent_log_unchanged(dump_cfg)
+        outcome = "budget"
+        last_content = accounting_stop_message(over)
+        return last_content
+    finally:
+        # Every queued dump is on disk before the run returns (or raises).
+        await loop.run_in_executor(None, writer.shutdown)
+        if dump_failures:
+            tracelog_error("dump_writes_failed", {"count": len(dump_failures), "errors": dump_failures[:5]})
+        session_end(utils_strip_think(last_content))
+        trajcache_flush()
+        accounting_end("error" if dump_failures else outcome, utils_strip_think(last_content))
+        # Like the inline writes they replaced, lost dumps fail the run (unless it is failing already).
+        if dump_failures and outcome != "error":
+            raise OSError(f"{len(dump_failures)} dump write(s) failed; first: {dump_failures[0]}")
+
+
+def run_agent(system_prompt: str, task_prompt: str, tools_schema: List[Dict[str, Any]], cfg: Dict[str, Any]) -> str:
+    return asyncio.run(run_agent_async(system_prompt, task_prompt, tools_schema, cfg))
@@ -0,0 +1,112 @@
+from __future__ import annotations
+import argparse
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from body import ImageRef, body_build
+from transport import transport_post, transport_stats
+from utils import utils_log_copy, utils_truncate_base64_images
+
+
+class _BenchSinkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        remaining = int(self.headers["Content-Length"])
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 1 << 20)))
+        reply = b'{"choices":[{"message":{"role":"assistant","content":"ok"}}]}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+def _bench_payload(image: Any) -> Dict[str, Any]:
+    tools = [{"type": "function", "function": {"name": f"tool_{i}", "description": "d" * 400,
+                                                "parameters": {"type": "object", "properties": {}}}} for i in range(5)]
+    return {"model": "bench", "tools": tools, "tool_choice": "auto", "temperature": 0.5, "max_tokens": 2048,
+            "messages": [{"role": "system", "content": "s" * 6000}, {"role": "user", "content": "task"},
+                         {"role": "assistant", "content": "", "tool_calls": [{"id": "c", "type": "function",
+                          "function": {"name": "observe_screen", "arguments": json.dumps({"plan": "p" * 8000})}}]},
+                         {"role": "tool", "tool_call_id": "c", "name": "observe_screen", "content": "{\"ok\":true}"},
+                         {"role": "user", "content": [{"type": "text", "text": "CURRENT SCREEN:"},
+                                                      {"type": "image_url", "image_url": {"url": image}}]}]}
+
+
+def _bench_step_legacy(png: bytes, endpoint: str) -> None:
+    # Copies made by the pre-builder observe path: b64 str, data URL, logging deep copy, dumps, encode.
+    b64 = base64.b64encode(png).decode("ascii")
+    payload = _bench_payload("data:image/png;base64," + b64)
+    utils_truncate_base64_images(json.loads(json.dumps(payload)))
+    data = json.dumps(payload, ensure_ascii=True).encode("utf-8")
+    transport_post(endpoint, data, {"Content-Type": "application/json"}, 30)
+
+
+def _bench_step_stream(png: bytes, endpoint: str) -> None:
+    payload = _bench_payload(ImageRef(png))
+    utils_log_copy(payload)
+    transport_post(endpoint, body_build(payload), {"Content-Type": "application/json"}, 30)
+
+
+def _bench_run_mode(mode: str, steps: int, png_kb: int) -> Dict[str, Any]:
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _BenchSinkHandler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{srv.server_port}/v1/chat/completions"
+    step = _bench_step_legacy if mode == "legacy" else _bench_step_stream
+    rss_base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    times: List[float] = []
+    peaks: List[int] = []
+    tracemalloc.start()
+    for _ in range(steps):
+        png = os.urandom(png_kb * 1024)
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        t0 = time.perf_counter()
+        step(png, endpoint)
+        times.append((time.perf_counter() - t0) * 1000.0)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        del png
+    tracemalloc.stop()
+    srv.shutdown()
+    return {"mode": mode, "step_ms_mean": sum(times) / len(times), "step_ms_min": min(times),
+            "py_peak_kb": max(peaks) // 1024, "rss_peak_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "rss_growth_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_base_kb,
+            "bytes_sent": transport_stats()["bytes_sent"]}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Per-step memory/latency of building and sending image payloads")
+    ap.add_argument("--steps", type=int, default=10)
+    ap.add_argument("--png-kb", type=int, default=2500, help="size of the synthetic PNG per step")
+    ap.add_argument("--mode", choices=("legacy", "stream"), help="run one mode in-process (used by the driver)")
+    args = ap.parse_args()
+
+    if args.mode:
+        print(json.dumps(_bench_run_mode(args.mode, args.steps, args.png_kb)))
+        return
+    # Each mode runs in a fresh interpreter so ru_maxrss is not shared between them.
+    print(f"steps={args.steps} png={args.png_kb} KiB")
+    print(f"{'mode':<8} {'mean ms':>9} {'min ms':>9} {'py peak KiB':>12} {'RSS peak KiB':>13} {'RSS growth':>11}")
+    for mode in ("legacy", "stream"):
+        out = subprocess.run([sys.executable, __file__, "--mode", mode, "--steps", str(args.steps),
+                              "--png-kb", str(args.png_kb)], check=True, capture_output=True, text=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{mode:<8} {r['step_ms_mean']:>9.1f} {r['step_ms_min']:>9.1f} {r['py_peak_kb']:>12} "
+              f"{r['rss_peak_kb']:>13} {r['rss_growth_kb']:>11}")
+
+
+if __name__ == "__main__":
+    main()
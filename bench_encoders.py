@@ -0,0 +1,87 @@
+from __future__ import annotations
+import argparse
+import glob
+import os
+import random
+import time
+from typing import List, Tuple
+from encoders import ENCODERS_PROFILES, encoders_decode_png_rgb, encoders_encode, encoders_resolve
+
+
+def _bench_synthetic_frame(width: int, height: int, seed: int) -> bytes:
+    # Flat window panels with short high-contrast "text" runs, roughly what a desktop looks like.
+    rnd = random.Random(seed)
+    stride = width * 3
+    rgb = bytearray(bytes((240, 240, 240)) * (width * height))
+    for _ in range(12):
+        x0, y0 = rnd.randrange(width // 2), rnd.randrange(height // 2)
+        x1, y1 = min(width, x0 + rnd.randrange(80, width // 2)), min(height, y0 + rnd.randrange(60, height // 2))
+        color = bytes((rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+        row = color * (x1 - x0)
+        for y in range(y0, y1):
+            rgb[y * stride + x0 * 3:y * stride + x1 * 3] = row
+    for _ in range(height // 3):
+        y = rnd.randrange(height)
+        x = rnd.randrange(width - 200)
+        rgb[y * stride + x * 3:y * stride + (x + 200) * 3] = os.urandom(600)
+    return bytes(rgb)
+
+
+def _bench_load_corpus(pattern: str, limit: int) -> List[Tuple[str, bytes, int, int]]:
+    corpus = []
+    for path in sorted(glob.glob(pattern))[:limit]:
+        with open(path, "rb") as f:
+            try:
+                rgb, w, h = encoders_decode_png_rgb(f.read())
+            except ValueError as e:
+                print(f"skip {path}: {e}")
+                continue
+        corpus.append((os.path.basename(path), rgb, w, h))
+    return corpus
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Screenshot encoder latency/size benchmark")
+    ap.add_argument("--dir", default=os.environ.get("AGENT_DUMP_DIR", "dumps"), help="directory with dump PNGs")
+    ap.add_argument("--limit", type=int, default=10, help="max corpus files")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--synthetic", type=int, default=0, help="use N synthetic 1536x864 frames instead of / in addition to dumps")
+    ap.add_argument("--levels", default="1,3,6,9", help="extra zlib levels to sweep per filter")
+    ap.add_argument("--workers", default="1,0", help="deflate worker counts to sweep for each profile (0 = one per CPU)")
+    args = ap.parse_args()
+
+    corpus = _bench_load_corpus(os.path.join(args.dir, "*.png"), args.limit)
+    for i in range(args.synthetic):
+        corpus.append((f"synthetic_{i}", _bench_synthetic_frame(1536, 864, i), 1536, 864))
+    if not corpus:
+        raise SystemExit(f"no PNGs in {args.dir}; pass --synthetic N to benchmark generated frames")
+
+    configs = []
+    for wk in (int(v) for v in args.workers.split(",") if v.strip()):
+        for name in ENCODERS_PROFILES:
+            configs.append((name if wk == 1 else f"{name}/w{wk}", encoders_resolve(name, workers=wk)))
+    for filt in ("none", "sub", "up", "adaptive"):
+        for lvl in (int(v) for v in args.levels.split(",") if v.strip()):
+            configs.append((f"{filt}/{lvl}", encoders_resolve("png", filt, lvl)))
+
+    raw_total = sum(len(rgb) for _, rgb, _, _ in corpus)
+    print(f"corpus: {len(corpus)} frames, {raw_total} raw RGB bytes, repeat={args.repeat}, cpus={os.cpu_count()}")
+    print(f"{'config':<14} {'encode ms':>10} {'bytes':>12} {'ratio':>7}")
+    for label, profile in configs:
+        total_ms = 0.0
+        total_bytes = 0
+        for _, rgb, w, h in corpus:
+            best = None
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                png = encoders_encode(rgb, w, h, profile)
+                dt = (time.perf_counter() - t0) * 1000.0
+                best = dt if best is None or dt < best else best
+            total_ms += best
+            total_bytes += len(png)
+        n = len(corpus)
+        print(f"{label:<14} {total_ms / n:>10.1f} {total_bytes // n:>12} {total_bytes / raw_total:>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+from __future__ import annotations
+import argparse
+import os
+import time
+from typing import Callable, List
+from frames import frames_bgra_to_rgb, frames_has_numpy
+
+
+def _bench_legacy_loop(raw_bytes: bytes, width: int, height: int) -> bytearray:
+    # Per-pixel loop previously used by winapi_capture_screenshot_png; kept as the baseline.
+    rgb = bytearray(width * height * 3)
+    for i in range(width * height):
+        b = raw_bytes[i * 4 + 0]
+        g = raw_bytes[i * 4 + 1]
+        r = raw_bytes[i * 4 + 2]
+        rgb[i * 3 + 0] = r
+        rgb[i * 3 + 1] = g
+        rgb[i * 3 + 2] = b
+    return rgb
+
+
+def _bench_time(fn: Callable[[], object], repeat: int) -> List[float]:
+    out = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - t0) * 1000.0)
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="BGRA->RGB conversion microbenchmark on synthetic frames")
+    ap.add_argument("--width", type=int, default=1536)
+    ap.add_argument("--height", type=int, default=864)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--skip-legacy", action="store_true", help="skip the slow per-pixel baseline")
+    args = ap.parse_args()
+
+    w, h = args.width, args.height
+    bgra = bytearray(os.urandom(w * h * 4))
+    raw_bytes = bytes(bgra)
+    expected = frames_bgra_to_rgb(memoryview(bgra), w, h, use_numpy=False)
+
+    cases = [("slices", lambda: frames_bgra_to_rgb(memoryview(bgra), w, h, use_numpy=False))]
+    if frames_has_numpy():
+        cases.append(("numpy", lambda: frames_bgra_to_rgb(memoryview(bgra), w, h, use_numpy=True)))
+    if not args.skip_legacy:
+        cases.append(("legacy_loop", lambda: _bench_legacy_loop(raw_bytes, w, h)))
+
+    print(f"frame {w}x{h} ({w * h * 4} BGRA bytes), repeat={args.repeat}")
+    print(f"{'impl':<12} {'min ms':>10} {'mean ms':>10}")
+    for name, fn in cases:
+        if fn() != expected:
+            raise SystemExit(f"{name}: output mismatch")
+        times = _bench_time(fn, 1 if name == "legacy_loop" else args.repeat)
+        print(f"{name:<12} {min(times):>10.2f} {sum(times) / len(times):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+from __future__ import annotations
+import argparse
+import ctypes
+import time
+from typing import Callable, List
+from keyinput import (KEYEVENTF_KEYUP, KEYEVENTF_UNICODE, VK_RETURN, keyinput_compile_text, keyinput_configure,
+                      keyinput_pack)
+from simdesktop import SimDesktop
+
+
+# Portable replicas of the Win64 structs (wintypes.DWORD is 8 bytes on Linux), so the
+# per-character construction cost of the old winapi_type_text can be measured anywhere.
+class _KEYBDINPUT(ctypes.Structure):
+    _fields_ = [("wVk", ctypes.c_uint16), ("wScan", ctypes.c_uint16), ("dwFlags", ctypes.c_uint32),
+                ("time", ctypes.c_uint32), ("dwExtraInfo", ctypes.c_size_t)]
+
+
+class _MOUSEINPUT(ctypes.Structure):
+    _fields_ = [("dx", ctypes.c_int32), ("dy", ctypes.c_int32), ("mouseData", ctypes.c_uint32),
+                ("dwFlags", ctypes.c_uint32), ("time", ctypes.c_uint32), ("dwExtraInfo", ctypes.c_size_t)]
+
+
+class _INPUT_I(ctypes.Union):
+    _fields_ = [("mi", _MOUSEINPUT), ("ki", _KEYBDINPUT)]
+
+
+class _INPUT(ctypes.Structure):
+    _fields_ = [("type", ctypes.c_uint32), ("ii", _INPUT_I)]
+
+
+def _bench_legacy_build(text: str) -> List[ctypes.Array]:
+    # What the old loop built before each SendInput call (one 2-element array per character).
+    out = []
+    for ch in text:
+        code = ord(ch)
+        down = _INPUT(type=1, ii=_INPUT_I(ki=_KEYBDINPUT(wVk=0, wScan=code, dwFlags=KEYEVENTF_UNICODE, time=0, dwExtraInfo=0)))
+        up = _INPUT(type=1, ii=_INPUT_I(ki=_KEYBDINPUT(wVk=0, wScan=code, dwFlags=KEYEVENTF_UNICODE | KEYEVENTF_KEYUP, time=0, dwExtraInfo=0)))
+        out.append((_INPUT * 2)(down, up))
+    return out
+
+
+def _bench_batched_build(text: str) -> ctypes.Array:
+    events = keyinput_compile_text(text)
+    return (_INPUT * len(events)).from_buffer_copy(keyinput_pack(events))
+
+
+def _bench_check_stream() -> None:
+    # Exact event stream for a mixed string, as recorded by the simulated backend.
+    keyinput_configure(chunk=4, pace_s=0.0)
+    sim = SimDesktop()
+    sim.type_text("a\U0001F600\n")
+    got = [e.data["events"] for e in sim.events if e.kind == "input"]
+    u, ku = KEYEVENTF_UNICODE, KEYEVENTF_UNICODE | KEYEVENTF_KEYUP
+    expected = [[(0, 0x61, u), (0, 0x61, ku), (0, 0xD83D, u), (0, 0xD83D, ku)],
+                [(0, 0xDE00, u), (0, 0xDE00, ku), (VK_RETURN, 0, 0), (VK_RETURN, 0, KEYEVENTF_KEYUP)]]
+    if got != expected:
+        raise SystemExit(f"event stream mismatch:\n  got      {got}\n  expected {expected}")
+    arr = _bench_batched_build("a\U0001F600")
+    if ctypes.sizeof(_INPUT) != 40 or [(a.ii.ki.wScan, a.ii.ki.dwFlags) for a in arr] != [(e[1], e[2]) for e in (expected[0] + expected[1])[:6]]:
+        raise SystemExit("packed INPUT array does not match the ctypes layout")
+
+
+def _bench_time(fn: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000.0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="type_text input build cost: per-character INPUT structs vs one packed array")
+    ap.add_argument("--chars", type=int, default=200)
+    ap.add_argument("--repeat", type=int, default=50)
+    ap.add_argument("--chunk", type=int, default=128, help="events per SendInput call (AGENT_INPUT_CHUNK)")
+    ap.add_argument("--pace-ms", type=float, default=2.0, help="pause between chunks (AGENT_INPUT_PACE_MS)")
+    args = ap.parse_args()
+
+    _bench_check_stream()
+    samples = {
+        "ascii_url": ("https://example.com/search?q=" + "abcdefghij" * 40)[:args.chars],
+        "unicode": ("Zażółć gęślą jaźń – ünïcödé " * 20)[:args.chars],
+        "emoji": ("ok \U0001F600\U0001F680 " * 60)[:args.chars],
+    }
+    print(f"{'text':<10} {'chars':>5} {'events':>6} {'legacy ms':>10} {'batched ms':>11} {'calls old/new':>14} {'sleep ms old/new':>17}")
+    for name, text in samples.items():
+        n_events = len(keyinput_compile_text(text))
+        legacy = _bench_time(lambda: _bench_legacy_build(text), args.repeat)
+        batched = _bench_time(lambda: _bench_batched_build(text), args.repeat)
+        calls = -(-n_events // args.chunk) if args.chunk else 1
+        print(f"{name:<10} {len(text):>5} {n_events:>6} {legacy:>10.3f} {batched:>11.3f} {len(text):>6}/{calls:<7} "
+              f"{len(text) * 5.0:>8.0f}/{(calls - 1) * args.pace_ms:<8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+from __future__ import annotations
+import argparse
+import time
+from typing import Callable, Dict, Tuple
+from plancompact import plancompact_configure, plancompact_estimate_tokens, plancompact_plan
+
+_BENCH_NEXT = "click the red circle at (412, 300) and check that it is marked"
+
+
+def _bench_plan(style: str, turns: int) -> str:
+    # The five sections the plan tool asks for, with headings written the way models do.
+    head: Callable[[str], str] = {
+        "markdown": lambda t: f"**{t}**\n",
+        "plain": lambda t: f"{t}\n",
+        "inline": lambda t: f"**{t}:** ",
+    }[style]
+    history = "".join(f"- Turn {i + 1}: clicked circle {i + 1} at ({100 + i}, 200). Screen showed a mark.\n" for i in range(turns))
+    return (head("USER REQUEST") + "Mark all red circles in Paint.\n\n"
+            + head("WHAT HAPPENED SO FAR") + ("\n" if style == "inline" else "") + history + "\n"
+            + head("CURRENT SCREEN STATE") + "Paint canvas with red circles. " * 12 + "\n\n"
+            + head("LAST ACTION RESULT") + "Judgment: SUCCESS, the mark is visible.\n\n"
+            + head("NEXT ACTION") + _BENCH_NEXT)
+
+
+def _bench_check(turns: int, budgets: Tuple[int, ...]) -> None:
+    # The next step survives any budget, the end of the newest turn any budget with room for it
+    # (0 is none); a compacted plan is a fixed point.
+    newest = f"at ({99 + turns}, 200). Screen showed a mark."
+    for style in ("markdown", "plain", "inline"):
+        plan = _bench_plan(style, turns)
+        for budget in budgets:
+            plancompact_configure(True, keep_turns=6, budget_tokens=budget)
+            once = plancompact_plan(plan)
+            if not once.endswith(_BENCH_NEXT):
+                raise SystemExit(f"{style}/{budget}: NEXT ACTION lost:\n{once}")
+            if (not budget or budget >= 120) and newest not in once:
+                raise SystemExit(f"{style}/{budget}: newest turn lost:\n{once}")
+            twice = plancompact_plan(once)
+            if twice != once:
+                raise SystemExit(f"{style}/{budget}: second pass changed the plan:\n--- once\n{once}\n--- twice\n{twice}")
+        plancompact_configure(True, budget_tokens=120)
+        flat = plancompact_plan(" ".join(plan.split()))
+        if not flat.endswith(_BENCH_NEXT):
+            raise SystemExit(f"{style}: unsectioned plan lost its end:\n{flat}")
+
+
+def _bench_time(fn: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000.0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Plan compaction: tokens kept and time per plan for each heading style")
+    ap.add_argument("--turns", type=int, default=20)
+    ap.add_argument("--budget", type=int, default=400, help="token budget (AGENT_PLAN_BUDGET)")
+    ap.add_argument("--keep-turns", type=int, default=6, help="history turns kept verbatim (AGENT_PLAN_KEEP_TURNS)")
+    ap.add_argument("--repeat", type=int, default=50)
+    args = ap.parse_args()
+
+    _bench_check(args.turns, (0, 2000, 400, 200, 120, 80))
+    plancompact_configure(True, keep_turns=args.keep_turns, budget_tokens=args.budget)
+    print(f"{'style':<9} {'tokens in':>9} {'tokens out':>10} {'ms':>7}")
+    plans: Dict[str, str] = {style: _bench_plan(style, args.turns) for style in ("markdown", "plain", "inline")}
+    for style, plan in plans.items():
+        out = plancompact_plan(plan)
+        ms = _bench_time(lambda: plancompact_plan(plan), args.repeat)
+        print(f"{style:<9} {plancompact_estimate_tokens(plan):>9} {plancompact_estimate_tokens(out):>10} {ms:>7.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+from __future__ import annotations
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+from profiler import profiler_percentile
+from router import router_configure, router_stats
+from transport import transport_close_all
+from utils import utils_post_json
+
+
+class _BenchStubServer(ThreadingHTTPServer):
+    """Chat-completions stub with a base latency, an occasional stall and a failure rate."""
+
+    daemon_threads = True
+
+    def __init__(self, base_s: float, tail_p: float, tail_s: float, fail_p: float, seed: int) -> None:
+        super().__init__(("127.0.0.1", 0), _BenchStubHandler)
+        self.base_s, self.tail_p, self.tail_s, self.fail_p = base_s, tail_p, tail_s, fail_p
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.served = 0
+        self.url = f"http://127.0.0.1:{self.server_port}/v1/chat/completions"
+
+    def draw(self) -> Tuple[float, bool]:
+        with self.rng_lock:
+            delay = self.base_s * (0.8 + 0.4 * self.rng.random())
+            if self.rng.random() < self.tail_p:
+                delay += self.tail_s
+            return delay, self.rng.random() < self.fail_p
+
+
+class _BenchStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: _BenchStubServer
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers["Content-Length"]))
+        delay, fail = self.server.draw()
+        time.sleep(delay)
+        if fail:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.server.served += 1
+        reply = json.dumps({"choices": [{"message": {"role": "assistant", "content": f"ok from {self.server.server_port}"}}],
+                            "usage": {"prompt_tokens": 1000, "completion_tokens": 20}}).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+        except OSError:
+            pass  # the router cancelled this request
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+def _bench_parse_server(spec: str) -> Tuple[float, float, float, float]:
+    # base_ms[:tail_prob:tail_ms[:fail_prob]]
+    parts = [float(p) for p in spec.split(":")] + [0.0, 0.0, 0.0]
+    return parts[0] / 1000.0, parts[1], parts[2] / 1000.0, parts[3]
+
+
+def _bench_run(mode: str, servers: List[_BenchStubServer], requests: int, args: argparse.Namespace) -> Dict[str, Any]:
+    if mode == "single":
+        router_configure([])
+    else:
+        router_configure([s.url for s in servers], hedge=(mode == "hedged"), hedge_min_s=args.hedge_min_ms / 1000.0,
+                         hedge_cold_s=args.hedge_cold_ms / 1000.0, fail_threshold=2, cooldown_s=args.cooldown)
+    payload = {"model": "bench", "messages": [{"role": "user", "content": "x" * 2000}]}
+    times: List[float] = []
+    errors = 0
+    for _ in range(requests):
+        t0 = time.perf_counter()
+        try:
+            utils_post_json(payload, servers[0].url, 30)
+        except Exception:
+            errors += 1
+        times.append(time.perf_counter() - t0)
+    times.sort()
+    out = {"mode": mode, "p50_ms": profiler_percentile(times, 0.5) * 1000.0, "p95_ms": profiler_percentile(times, 0.95) * 1000.0,
+           "max_ms": times[-1] * 1000.0, "total_s": sum(times), "errors": errors, "router": router_stats()}
+    transport_close_all()
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Latency of single-endpoint vs routed vs hedged requests against stub servers")
+    ap.add_argument("--servers", default="40:0.08:1500,50:0.08:1500,60:0:0:0.3",
+                    help="comma-separated base_ms[:tail_prob:tail_ms[:fail_prob]] per stub server")
+    ap.add_argument("--requests", type=int, default=60)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--hedge-min-ms", type=float, default=100.0)
+    ap.add_argument("--hedge-cold-ms", type=float, default=1000.0)
+    ap.add_argument("--cooldown", type=float, default=5.0)
+    ap.add_argument("--modes", default="single,routed,hedged")
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+
+    results = []
+    for mode in args.modes.split(","):
+        # Fresh servers with the same seed per mode, so every mode sees the same latency draws.
+        servers = [_BenchStubServer(*_bench_parse_server(spec), seed=args.seed + i) for i, spec in enumerate(args.servers.split(","))]
+        for s in servers:
+            threading.Thread(target=s.serve_forever, daemon=True).start()
+        results.append(_bench_run(mode, servers, args.requests, args))
+        for s in servers:
+            s.shutdown()
+            s.server_close()
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"servers={args.servers} requests={args.requests}")
+    print(f"{'mode':<8} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'total s':>9} {'errors':>7}")
+    for r in results:
+        print(f"{r['mode']:<8} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['max_ms']:>9.1f} {r['total_s']:>9.2f} {r['errors']:>7}")
+        for url, st in r["router"].items():
+            print(f"  {url.split('/')[2]:<20} req={st['requests']} wins={st['wins']} hedges={st['hedges']} "
+                  f"cancelled={st['cancelled']} failures={st['failures']} unhealthy_marks={st['marked_unhealthy']} "
+                  f"ewma={st['ewma_ms']}ms")
+
+
+if __name__ == "__main__":
+    main()
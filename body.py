@@ -0,0 +1,121 @@
+from __future__ import annotations
+import binascii
+import hashlib
+import json
+import uuid
+from typing import Any, Dict, Iterator, List, Union
+
+# Raw bytes base64-encoded per chunk when streaming an image; a multiple of 3 so chunk
+# boundaries never need padding. 48 KiB in -> 64 KiB out.
+_BODY_B64_CHUNK = 48 * 1024
+
+
+class ImageRef:
+    """Encoded image kept as bytes inside a message; becomes a base64 data URL only on the wire."""
+
+    __slots__ = ("data", "mime", "_sha")
+
+    def __init__(self, data: bytes, mime: str = "image/png") -> None:
+        self.data = data
+        self.mime = mime
+        self._sha = ""
+
+    @property
+    def sha256(self) -> str:
+        if not self._sha:
+            self._sha = hashlib.sha256(self.data).hexdigest()
+        return self._sha
+
+    def prefix(self) -> bytes:
+        return f"data:{self.mime};base64,".encode("ascii")
+
+    def b64_len(self) -> int:
+        return 4 * ((len(self.data) + 2) // 3)
+
+    def data_url(self) -> str:
+        return self.prefix().decode("ascii") + binascii.b2a_base64(self.data, newline=False).decode("ascii")
+
+    def summary(self) -> str:
+        return f"data:{self.mime};base64,[b64 sha={self.sha256[:12]} len={self.b64_len()}]"
+
+    def __repr__(self) -> str:
+        return f"ImageRef({self.summary()})"
+
+
+class StaticJSON:
+    """A JSON value serialized once and spliced into every body that contains it.
+
+    Used for the parts of a request that never change during a run (system prompt,
+    task, tool schema), so they are neither re-encoded per step nor able to drift
+    byte-wise between steps.
+    """
+
+    __slots__ = ("value", "raw")
+
+    def __init__(self, value: Any) -> None:
+        self.value = value
+        self.raw = json.dumps(value, ensure_ascii=True).encode("ascii")
+
+    def __repr__(self) -> str:
+        return f"StaticJSON({len(self.raw)} bytes)"
+
+
+BodySegment = Union[bytes, ImageRef]
+
+
+class RequestBody:
+    """JSON request body whose image parts are base64-encoded chunk by chunk while sending.
+
+    Re-iterable, so a transport can resend it after a stale-connection retry. `length`
+    is exact and known up front, so no chunked transfer encoding is needed.
+    """
+
+    def __init__(self, segments: List[BodySegment]) -> None:
+        self.segments = segments
+        self.length = sum(len(s) if isinstance(s, bytes) else len(s.prefix()) + s.b64_len() + 2 for s in segments)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[bytes]:
+        for seg in self.segments:
+            if isinstance(seg, bytes):
+                yield seg
+                continue
+            yield b'"' + seg.prefix()
+            view = memoryview(seg.data)
+            for i in range(0, len(view), _BODY_B64_CHUNK):
+                yield binascii.b2a_base64(view[i:i + _BODY_B64_CHUNK], newline=False)
+            yield b'"'
+
+    def to_bytes(self) -> bytes:
+        return b"".join(self)
+
+
+def body_build(payload: Dict[str, Any]) -> RequestBody:
+    """Serialize `payload` to a RequestBody, leaving ImageRef values as raw image bytes.
+
+    The JSON envelope is produced by the C encoder with a unique placeholder string per
+    image, then split on those placeholders; no full-size base64 string is ever built.
+    StaticJSON values go through the same placeholders and are spliced in pre-encoded.
+    """
+    parts: List[Union[ImageRef, StaticJSON]] = []
+    nonce = uuid.uuid4().hex
+
+    def default(obj: Any) -> Any:
+        if isinstance(obj, (ImageRef, StaticJSON)):
+            parts.append(obj)
+            return f"__imageref_{nonce}_{len(parts) - 1}__"
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    text = json.dumps(payload, ensure_ascii=True, default=default).encode("ascii")
+    segments: List[BodySegment] = []
+    pos = 0
+    for i, part in enumerate(parts):
+        marker = f'"__imageref_{nonce}_{i}__"'.encode("ascii")
+        at = text.index(marker, pos)
+        segments.append(text[pos:at])
+        segments.append(part if isinstance(part, ImageRef) else part.raw)
+        pos = at + len(marker)
+    segments.append(text[pos:])
+    return RequestBody(segments)
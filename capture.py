@@ -0,0 +1,261 @@
+from __future__ import annotations
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+from desktop import desktop_get, desktop_set_capture_source
+from encoders import encoders_encode, encoders_resolve
+from frames import frames_bgra_to_rgb
+from profiler import profiler_span
+from tracelog import tracelog_warn
+
+T = TypeVar("T")
+
+
+class _SlotMeta:
+    __slots__ = ("seq", "t", "digest", "stable_since", "screen_w", "screen_h")
+
+    def __init__(self, seq: int, t: float, digest: bytes, stable_since: float, screen_w: int, screen_h: int) -> None:
+        self.seq = seq
+        self.t = t
+        self.digest = digest
+        self.stable_since = stable_since
+        self.screen_w = screen_w
+        self.screen_h = screen_h
+
+
+class CaptureService:
+    """Samples the screen at `fps` into a ring of preallocated BGRA slots on a background thread.
+
+    The sampler copies each frame into a free slot (never the newest one, never one a
+    reader has pinned), so steady-state capture allocates no frame buffers. Each slot
+    carries the time its content first appeared, which is what "stable for N ms" is
+    measured against.
+    """
+
+    def __init__(self, width: int, height: int, fps: float = 10.0, slots: int = 4) -> None:
+        self.width = width
+        self.height = height
+        self.interval = 1.0 / max(0.1, fps)
+        self.slots = [bytearray(width * height * 4) for _ in range(max(3, slots))]
+        self._meta: List[Optional[_SlotMeta]] = [None] * len(self.slots)
+        self._pins = [0] * len(self.slots)
+        self._newest = -1
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats: Dict[str, float] = {"frames": 0, "dropped": 0, "errors": 0, "served": 0, "fallbacks": 0,
+                                        "capture_s": 0.0, "wait_s": 0.0}
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    def start(self) -> "CaptureService":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="capture", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    def _free_slot(self) -> int:
+        n = len(self.slots)
+        for i in range(1, n + 1):
+            idx = (self._newest + i) % n
+            if idx != self._newest and not self._pins[idx]:
+                return idx
+        return -1
+
+    def _run(self) -> None:
+        backend = desktop_get()
+        next_t = time.perf_counter()
+        while not self._stop.is_set():
+            with self._cond:
+                idx = self._free_slot()
+            if idx < 0:
+                self.stats["dropped"] += 1
+            else:
+                buf = self.slots[idx]
+
+                def sink(bgra: memoryview) -> bytes:
+                    buf[:] = bgra
+                    return hashlib.blake2b(bgra, digest_size=16).digest()
+                t0 = time.perf_counter()
+                try:
+                    digest, screen_w, screen_h = backend.capture_bgra(self.width, self.height, sink)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    tracelog_warn("capture_error", {"error": str(e)})
+                    digest = b""
+                if digest:
+                    t = time.perf_counter()
+                    self.stats["capture_s"] += t - t0
+                    self.stats["frames"] += 1
+                    with self._cond:
+                        prev = self._meta[self._newest] if self._newest >= 0 else None
+                        stable_since = prev.stable_since if prev is not None and prev.digest == digest else t
+                        self._meta[idx] = _SlotMeta(self._seq, t, digest, stable_since, screen_w, screen_h)
+                        self._newest = idx
+                        self._seq += 1
+                        self._cond.notify_all()
+            next_t += self.interval
+            now = time.perf_counter()
+            if next_t < now:
+                next_t = now
+            self._stop.wait(next_t - now)
+
+    def _ready(self, after: float, min_stable_s: float) -> bool:
+        m = self._meta[self._newest] if self._newest >= 0 else None
+        return m is not None and m.t >= after and m.t - max(m.stable_since, after) >= min_stable_s
+
+    def latest_stable(self, sink: Callable[[memoryview], T], after: float = 0.0, min_stable_s: float = 0.15,
+                      timeout_s: float = 1.5) -> Optional[Tuple[T, int, int]]:
+        """Pass the newest frame to `sink` once it was sampled after `after` and has been unchanged
+        for `min_stable_s` since then.
+
+        Waits up to `timeout_s`; if the screen never settles, the newest post-`after` frame is
+        used. Returns None (caller captures live) when the sampler has nothing new enough.
+        """
+        t0 = time.perf_counter()
+        with self._cond:
+            deadline = t0 + timeout_s
+            while not self._ready(after, min_stable_s) and not self._stop.is_set():
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            idx = self._newest
+            m = self._meta[idx] if idx >= 0 else None
+            if m is None or m.t < after:
+                self.stats["fallbacks"] += 1
+                return None
+            self._pins[idx] += 1
+        self.stats["wait_s"] += time.perf_counter() - t0
+        try:
+            with memoryview(self.slots[idx]) as view:
+                result = sink(view)
+        finally:
+            with self._cond:
+                self._pins[idx] -= 1
+        self.stats["served"] += 1
+        return result, m.screen_w, m.screen_h
+
+    def newest(self, sink: Callable[[memoryview], T]) -> Optional[Tuple[T, int, float]]:
+        """Pass the newest frame to `sink` immediately: (sink result, seq, capture time), or None."""
+        with self._cond:
+            idx = self._newest
+            if idx < 0:
+                return None
+            m = self._meta[idx]
+            self._pins[idx] += 1
+        try:
+            with memoryview(self.slots[idx]) as view:
+                return sink(view), m.seq, m.t
+        finally:
+            with self._cond:
+                self._pins[idx] -= 1
+
+
+class CaptureRecorder:
+    """Low-fps debug recording fed from a CaptureService: every distinct frame, at most `fps`
+    per second, written as a fast PNG named by sequence number and milliseconds since start.
+    """
+
+    def __init__(self, service: CaptureService, out_dir: str, fps: float = 2.0) -> None:
+        self.service = service
+        self.out_dir = out_dir
+        self.interval = 1.0 / max(0.1, fps)
+        self.encoder = encoders_resolve("fast")
+        self.written = 0
+        self._last_seq = -1
+        self._last_digest = b""
+        self._t0 = time.perf_counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "CaptureRecorder":
+        os.makedirs(self.out_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="capture-record", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    def _run(self) -> None:
+        svc = self.service
+        while not self._stop.wait(self.interval):
+            def sink(bgra: memoryview) -> Tuple[bytes, Optional[bytearray]]:
+                digest = hashlib.blake2b(bgra, digest_size=16).digest()
+                if digest == self._last_digest:
+                    return digest, None
+                return digest, frames_bgra_to_rgb(bgra, svc.width, svc.height)
+            got = svc.newest(sink)
+            if got is None:
+                continue
+            (digest, rgb), seq, t = got
+            if rgb is None or seq == self._last_seq:
+                continue
+            self._last_seq = seq
+            self._last_digest = digest
+            with profiler_span("capture_record"):
+                png = encoders_encode(rgb, svc.width, svc.height, self.encoder)
+                fn = os.path.join(self.out_dir, f"rec_{seq:06d}_{int((t - self._t0) * 1000):08d}ms.png")
+                with open(fn, "wb") as f:
+                    f.write(png)
+            self.written += 1
+
+
+_capture_service: Optional[CaptureService] = None
+_capture_recorder: Optional[CaptureRecorder] = None
+
+
+def capture_start(width: int, height: int, fps: float, slots: int = 4, min_stable_s: float = 0.15, max_wait_s: float = 1.5,
+                  record_dir: str = "", record_fps: float = 0.0) -> CaptureService:
+    """Start the background sampler and route full-frame observations of this size through it."""
+    global _capture_service, _capture_recorder
+    capture_stop()
+    _capture_service = CaptureService(width, height, fps, slots).start()
+    desktop_set_capture_source(_capture_service, min_stable_s, max_wait_s)
+    if record_dir and record_fps > 0:
+        _capture_recorder = CaptureRecorder(_capture_service, record_dir, record_fps).start()
+    return _capture_service
+
+
+def capture_stop() -> None:
+    global _capture_service, _capture_recorder
+    desktop_set_capture_source(None)
+    if _capture_recorder is not None:
+        _capture_recorder.stop()
+        _capture_recorder = None
+    if _capture_service is not None:
+        _capture_service.stop()
+        _capture_service = None
+
+
+def capture_get() -> Optional[CaptureService]:
+    return _capture_service
+
+
+def capture_stats() -> Dict[str, Any]:
+    svc = _capture_service
+    if svc is None:
+        return {}
+    out: Dict[str, Any] = dict(svc.stats)
+    out["capture_ms_mean"] = round(out.pop("capture_s") * 1000.0 / max(1, out["frames"]), 2)
+    out["wait_ms_mean"] = round(out.pop("wait_s") * 1000.0 / max(1, out["served"]), 2)
+    if _capture_recorder is not None:
+        out["recorded"] = _capture_recorder.written
+    return out
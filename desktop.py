@@ -0,0 +1,259 @@
+from __future__ import annotations
+import hashlib
+import sys
+from abc import ABC, abstractmethod
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+from encoders import encoders_encode
+from frames import frames_bgra_to_rgb
+from framecache import FrameEntry, framecache_hash, framecache_thumb, framecache_key, framecache_lookup, framecache_store
+from profiler import profiler_span
+
+T = TypeVar("T")
+
+# Virtual-key codes for the key names accepted by press_key. The codes are Windows VK
+# values; other backends only use the table to validate names.
+DESKTOP_VK = {
+    "enter": 0x0D, "tab": 0x09, "escape": 0x1B, "esc": 0x1B, "windows": 0x5B, "win": 0x5B,
+    "ctrl": 0x11, "alt": 0x12, "shift": 0x10, "f4": 0x73, "c": 0x43, "v": 0x56,
+    "t": 0x54, "w": 0x57, "f": 0x46, "l": 0x4C,
+}
+
+
+def desktop_parse_key(key: str) -> List[int]:
+    """'ctrl+shift+esc' -> [VK_CONTROL, VK_SHIFT, VK_ESCAPE]; raises ValueError on unknown names."""
+    key = key.strip().lower()
+    if not key:
+        raise ValueError("empty key")
+    parts = [p.strip() for p in key.split("+") if p.strip()]
+    if not parts:
+        raise ValueError("empty key parts")
+    vks = []
+    for p in parts:
+        if p not in DESKTOP_VK:
+            raise ValueError(f"unsupported key: {p}")
+        vks.append(DESKTOP_VK[p])
+    return vks
+
+
+class DesktopBackend(ABC):
+    """Screen capture and input injection used by the tool layer.
+
+    capture_bgra calls `sink` with a flat memoryview of the top-down 32bpp BGRA frame scaled
+    to target_w x target_h. The view is only valid during the call, which lets a backend
+    hand out its native buffer (e.g. DIB bits) without a copy. `region` is an (x, y, w, h)
+    rectangle in screen pixels to capture instead of the whole screen.
+    """
+
+    name = "base"
+
+    def init(self) -> None:
+        pass
+
+    @abstractmethod
+    def screen_size(self) -> Tuple[int, int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def capture_bgra(self, target_w: int, target_h: int, sink: Callable[[memoryview], T],
+                     region: Optional[Tuple[int, int, int, int]] = None) -> Tuple[T, int, int]:
+        raise NotImplementedError
+
+    def probe(self, target_w: int, target_h: int) -> bytes:
+        """Cheap signature of the current screen, equal for equal frames; used for settle polling."""
+        return self.probe_bgra(target_w, target_h, lambda bgra: hashlib.blake2b(bgra, digest_size=16).digest())
+
+    def probe_bgra(self, target_w: int, target_h: int, sink: Callable[[memoryview], T]) -> T:
+        """Like capture_bgra for a small internal look at the screen that is not an observation."""
+        return self.capture_bgra(target_w, target_h, sink)[0]
+
+    @abstractmethod
+    def move_mouse(self, x: int, y: int) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def click(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def scroll_down(self, amount: int = 120) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def type_text(self, text: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def press_key(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class WinapiBackend(DesktopBackend):
+    name = "winapi"
+
+    def __init__(self) -> None:
+        import winapi
+        self._w = winapi
+
+    def init(self) -> None:
+        self._w.winapi_init_dpi()
+
+    def screen_size(self) -> Tuple[int, int]:
+        return self._w.winapi_get_screen_size()
+
+    def capture_bgra(self, target_w: int, target_h: int, sink: Callable[[memoryview], T],
+                     region: Optional[Tuple[int, int, int, int]] = None) -> Tuple[T, int, int]:
+        return self._w.winapi_capture_bgra(target_w, target_h, sink, region)
+
+    def move_mouse(self, x: int, y: int) -> None:
+        self._w.winapi_move_mouse_to_pixel(x, y)
+
+    def click(self) -> None:
+        self._w.winapi_click_mouse()
+
+    def scroll_down(self, amount: int = 120) -> None:
+        self._w.winapi_scroll_down(amount)
+
+    def type_text(self, text: str) -> None:
+        self._w.winapi_type_text(text)
+
+    def press_key(self, key: str) -> None:
+        self._w.winapi_press_key(key)
+
+
+_desktop_backend: Optional[DesktopBackend] = None
+# Optional background sampler (capture.CaptureService) that serves full-frame captures,
+# with (min_stable_s, max_wait_s); and when input was last injected, so a sampled frame
+# is only used if it was taken after the action it is supposed to show.
+_desktop_capture_source: Optional[Any] = None
+_desktop_capture_wait = (0.15, 1.5)
+_desktop_last_input = 0.0
+# Session hooks (see session.py): `replay` stands in for capture + encode entirely;
+# `observer` sees every frame desktop_capture_frame returns.
+_desktop_frame_replay: Optional[Callable[..., Tuple[FrameEntry, bool, int, int]]] = None
+_desktop_frame_observer: Optional[Callable[..., None]] = None
+
+
+def desktop_create(name: str = "auto", **kwargs: Any) -> DesktopBackend:
+    key = (name or "auto").strip().lower()
+    if key == "auto":
+        key = "winapi" if sys.platform == "win32" else "sim"
+    if key == "winapi":
+        return WinapiBackend()
+    if key == "sim":
+        from simdesktop import SimDesktop
+        return SimDesktop(**kwargs)
+    raise ValueError(f"unknown desktop backend: {name} (expected auto, winapi or sim)")
+
+
+def desktop_set(backend: DesktopBackend) -> DesktopBackend:
+    global _desktop_backend
+    _desktop_backend = backend
+    return backend
+
+
+def desktop_get() -> DesktopBackend:
+    global _desktop_backend
+    if _desktop_backend is None:
+        _desktop_backend = desktop_create("auto")
+    return _desktop_backend
+
+
+def desktop_set_capture_source(source: Optional[Any], min_stable_s: float = 0.15, max_wait_s: float = 1.5) -> None:
+    global _desktop_capture_source, _desktop_capture_wait
+    _desktop_capture_source = source
+    _desktop_capture_wait = (min_stable_s, max_wait_s)
+
+
+def desktop_set_frame_hooks(replay: Optional[Callable[..., Tuple[FrameEntry, bool, int, int]]] = None,
+                            observer: Optional[Callable[..., None]] = None) -> None:
+    global _desktop_frame_replay, _desktop_frame_observer
+    _desktop_frame_replay = replay
+    _desktop_frame_observer = observer
+
+
+def _desktop_mark_input() -> None:
+    global _desktop_last_input
+    _desktop_last_input = time.perf_counter()
+
+
+def desktop_capture_frame(target_w: int, target_h: int, encoder: Optional[Dict[str, Any]] = None,
+                          region: Optional[Tuple[int, int, int, int]] = None) -> Tuple[FrameEntry, bool, int, int]:
+    """Capture and encode a frame, reusing the cached encoding when the raw pixels are unchanged.
+
+    The frame is hashed inside the capture sink, so an unchanged screen skips the RGB
+    conversion and the PNG encode. `region` limits the capture to an (x, y, w, h) screen
+    rectangle. When a capture source of the same size is running, a full-frame request is
+    served from its newest stable frame instead of a fresh grab. Returns (entry, reused,
+    screen_w, screen_h).
+    """
+    def sink(bgra: memoryview) -> Tuple[Tuple[Any, ...], Tuple[int, ...], bytes, Optional[FrameEntry], Optional[bytearray]]:
+        with profiler_span("frame_hash"):
+            digest, tiles = framecache_hash(bgra, target_w, target_h)
+        key = framecache_key(digest, target_w, target_h, encoder)
+        hit = framecache_lookup(key)
+        if hit is not None:
+            return key, tiles, hit.thumb, hit, None
+        thumb = framecache_thumb(bgra, target_w, target_h)
+        with profiler_span("bgra_convert"):
+            return key, tiles, thumb, None, frames_bgra_to_rgb(bgra, target_w, target_h)
+    if _desktop_frame_replay is not None:
+        return _desktop_frame_replay(target_w, target_h, encoder, region)
+    got = None
+    src = _desktop_capture_source
+    if src is not None and region is None and src.size == (target_w, target_h):
+        with profiler_span("ring_wait"):
+            got = src.latest_stable(sink, _desktop_last_input, *_desktop_capture_wait)
+    if got is None:
+        with profiler_span("grab"):
+            got = desktop_get().capture_bgra(target_w, target_h, sink, region)
+    (key, tiles, thumb, hit, rgb), screen_w, screen_h = got
+    if hit is not None:
+        entry, reused = hit, True
+    else:
+        t0 = time.perf_counter()
+        with profiler_span("png_encode"):
+            png_bytes = encoders_encode(rgb, target_w, target_h, encoder)
+        entry = framecache_store(FrameEntry(key, tiles, thumb, png_bytes, target_w, target_h, time.perf_counter() - t0))
+        reused = False
+    if _desktop_frame_observer is not None:
+        _desktop_frame_observer(entry, reused, screen_w, screen_h, region)
+    return entry, reused, screen_w, screen_h
+
+
+def desktop_capture_screenshot_png(target_w: int, target_h: int, encoder: Optional[Dict[str, Any]] = None) -> Tuple[bytes, int, int]:
+    entry, _, screen_w, screen_h = desktop_capture_frame(target_w, target_h, encoder)
+    return entry.png, screen_w, screen_h
+
+
+def desktop_probe_bgra(target_w: int, target_h: int, sink: Callable[[memoryview], T]) -> T:
+    return desktop_get().probe_bgra(target_w, target_h, sink)
+
+
+def desktop_screen_size() -> Tuple[int, int]:
+    return desktop_get().screen_size()
+
+
+def desktop_move_mouse_to_pixel(x: int, y: int) -> None:
+    desktop_get().move_mouse(x, y)
+    _desktop_mark_input()
+
+
+def desktop_click_mouse() -> None:
+    desktop_get().click()
+    _desktop_mark_input()
+
+
+def desktop_scroll_down(amount: int = 120) -> None:
+    desktop_get().scroll_down(amount)
+    _desktop_mark_input()
+
+
+def desktop_type_text(text: str) -> None:
+    desktop_get().type_text(text)
+    _desktop_mark_input()
+
+
+def desktop_press_key(key: str) -> None:
+    desktop_get().press_key(key)
+    _desktop_mark_input()
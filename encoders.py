@@ -0,0 +1,306 @@
+from __future__ import annotations
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+_ENCODERS_FILTERS = ("none", "sub", "up", "adaptive")
+
+# Encoder profiles selectable through AGENT_IMAGE_ENCODER. "png" reproduces the
+# historical output (filter 0 on every row, zlib level 6).
+ENCODERS_PROFILES: Dict[str, Dict[str, Any]] = {
+    "png": {"filter": "none", "level": 6, "strategy": zlib.Z_DEFAULT_STRATEGY},
+    "fast": {"filter": "none", "level": 1, "strategy": zlib.Z_DEFAULT_STRATEGY},
+    "small": {"filter": "adaptive", "level": 9, "strategy": zlib.Z_DEFAULT_STRATEGY},
+}
+
+# |v| for a filtered byte read as signed, the usual "minimum sum of absolute
+# differences" heuristic for adaptive filter selection.
+_ENCODERS_ABS_TABLE = bytes(min(b, 256 - b) for b in range(256))
+
+# Parallel deflate: strips smaller than this are not worth a thread hand-off, and
+# each strip is primed with the previous 32 KiB of input (the deflate window).
+_ENCODERS_MIN_STRIP = 256 * 1024
+_ENCODERS_WINDOW = 32 * 1024
+_ENCODERS_ADLER_BASE = 65521
+
+_encoders_mask_cache: Dict[int, Tuple[int, int]] = {}
+_encoders_pool: Optional[ThreadPoolExecutor] = None
+_encoders_pool_size = 0
+_encoders_pool_lock = threading.Lock()
+
+
+def _encoders_masks(n: int) -> Tuple[int, int]:
+    masks = _encoders_mask_cache.get(n)
+    if masks is None:
+        masks = (int.from_bytes(b"\x80" * n, "big"), int.from_bytes(b"\x7f" * n, "big"))
+        _encoders_mask_cache.clear()
+        _encoders_mask_cache[n] = masks
+    return masks
+
+
+def _encoders_bytewise_sub(a: bytes, b: bytes) -> bytes:
+    """(a[i] - b[i]) mod 256 for every byte, computed as one SWAR big-int operation."""
+    n = len(a)
+    hi, lo = _encoders_masks(n)
+    x = int.from_bytes(a, "big")
+    y = int.from_bytes(b, "big")
+    return (((x | hi) - (y & lo)) ^ ((x ^ y ^ hi) & hi)).to_bytes(n, "big")
+
+
+def encoders_bytewise_add(a: bytes, b: bytes) -> bytes:
+    """(a[i] + b[i]) mod 256 for every byte; inverse of the Up/Sub filter difference."""
+    n = len(a)
+    hi, lo = _encoders_masks(n)
+    x = int.from_bytes(a, "big")
+    y = int.from_bytes(b, "big")
+    return (((x & lo) + (y & lo)) ^ ((x ^ y) & hi)).to_bytes(n, "big")
+
+
+def _encoders_filter_up(data: bytes, stride: int) -> bytes:
+    return _encoders_bytewise_sub(data, bytes(stride) + data[:-stride])
+
+
+def _encoders_filter_sub(data: bytes, stride: int, height: int, bpp: int) -> bytes:
+    left = bytearray(bytes(bpp) + data[:-bpp])
+    zeros = bytes(bpp)
+    for y in range(height):
+        left[y * stride:y * stride + bpp] = zeros
+    return _encoders_bytewise_sub(data, bytes(left))
+
+
+def encoders_filter_scanlines(rgb: Any, width: int, height: int, filter_type: str = "none", bpp: int = 3) -> bytes:
+    """Return the PNG scanline stream (filter byte + filtered row) for a packed 8-bit image."""
+    if filter_type not in _ENCODERS_FILTERS:
+        raise ValueError(f"unknown PNG filter: {filter_type}")
+    stride = width * bpp
+    data = bytes(rgb[:stride * height]) if not isinstance(rgb, bytes) else rgb[:stride * height]
+    row_len = stride + 1
+    out = bytearray(row_len * height)
+    if filter_type == "none":
+        for y in range(height):
+            out[y * row_len + 1:(y + 1) * row_len] = data[y * stride:(y + 1) * stride]
+        return bytes(out)
+    if filter_type == "up":
+        variants = [(2, _encoders_filter_up(data, stride))]
+    elif filter_type == "sub":
+        variants = [(1, _encoders_filter_sub(data, stride, height, bpp))]
+    else:
+        variants = [(0, data), (1, _encoders_filter_sub(data, stride, height, bpp)), (2, _encoders_filter_up(data, stride))]
+    for y in range(height):
+        o = y * stride
+        best_id, best_buf = variants[0]
+        if len(variants) > 1:
+            best_score = -1
+            for fid, buf in variants:
+                score = sum(buf[o:o + stride].translate(_ENCODERS_ABS_TABLE))
+                if best_score < 0 or score < best_score:
+                    best_id, best_buf, best_score = fid, buf, score
+        out[y * row_len] = best_id
+        out[y * row_len + 1:(y + 1) * row_len] = best_buf[o:o + stride]
+    return bytes(out)
+
+
+def encoders_png_chunk(tag: bytes, data: bytes) -> bytes:
+    chunk_head = tag + data
+    return struct.pack("!I", len(data)) + chunk_head + struct.pack("!I", zlib.crc32(chunk_head) & 0xFFFFFFFF)
+
+
+def encoders_png_container(idat: bytes, width: int, height: int) -> bytes:
+    png = bytearray(PNG_SIGNATURE)
+    png.extend(encoders_png_chunk(b"IHDR", struct.pack("!IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+    png.extend(encoders_png_chunk(b"IDAT", idat))
+    png.extend(encoders_png_chunk(b"IEND", b""))
+    return bytes(png)
+
+
+def _encoders_zlib_header(level: int) -> bytes:
+    flevel = 0 if level < 2 else (1 if level < 6 else (2 if level == 6 else 3))
+    cmf = 0x78
+    flg = flevel << 6
+    flg |= 31 - ((cmf << 8 | flg) % 31)
+    return bytes((cmf, flg))
+
+
+def _encoders_adler32_combine(adler1: int, adler2: int, len2: int) -> int:
+    """adler32(a + b) from adler32(a), adler32(b) and len(b), as in zlib's adler32_combine."""
+    base = _ENCODERS_ADLER_BASE
+    rem = len2 % base
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % base
+    sum1 = (sum1 + (adler2 & 0xFFFF) + base - 1) % base
+    sum2 = (sum2 + ((adler1 >> 16) & 0xFFFF) + ((adler2 >> 16) & 0xFFFF) + base - rem) % base
+    return sum1 | (sum2 << 16)
+
+
+def _encoders_get_pool(workers: int) -> ThreadPoolExecutor:
+    global _encoders_pool, _encoders_pool_size
+    with _encoders_pool_lock:
+        if _encoders_pool is None or _encoders_pool_size < workers:
+            # A larger pool replaces the shared one, but the old one is not shut down: another
+            # thread may still hold it and submit to it. Its idle threads exit with the process.
+            _encoders_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="png-deflate")
+            _encoders_pool_size = workers
+        return _encoders_pool
+
+
+def _encoders_deflate_strip(view: memoryview, start: int, end: int, level: int, strategy: int, last: bool) -> Tuple[bytes, int]:
+    if start > 0:
+        zdict = view[max(0, start - _ENCODERS_WINDOW):start].tobytes()
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, 8, strategy, zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, 8, strategy)
+    strip = view[start:end]
+    out = compressor.compress(strip) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return out, zlib.adler32(strip)
+
+
+def encoders_deflate_parallel(data: bytes, level: int = 6, strategy: int = zlib.Z_DEFAULT_STRATEGY, workers: int = 0) -> bytes:
+    """zlib-format stream compressed in strips on a thread pool, pigz style.
+
+    Every strip but the last ends on a sync-flush boundary, so the raw deflate strips
+    concatenate into one valid stream; the adler32 trailer is combined from per-strip
+    checksums. zlib releases the GIL while compressing, so strips run on separate cores.
+    """
+    n = len(data)
+    workers = workers if workers > 0 else (os.cpu_count() or 1)
+    strips = max(1, min(workers, n // _ENCODERS_MIN_STRIP))
+    if strips == 1:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 8, strategy)
+        return compressor.compress(data) + compressor.flush()
+    size = -(-n // strips)
+    bounds = [(i * size, min(n, (i + 1) * size)) for i in range(strips)]
+    view = memoryview(data)
+    pool = _encoders_get_pool(strips)
+    futures = [pool.submit(_encoders_deflate_strip, view, a, b, level, strategy, b == n) for a, b in bounds]
+    out = bytearray(_encoders_zlib_header(level))
+    adler = 1
+    for (a, b), fut in zip(bounds, futures):
+        chunk, strip_adler = fut.result()
+        out.extend(chunk)
+        adler = strip_adler if a == 0 else _encoders_adler32_combine(adler, strip_adler, b - a)
+    out.extend(adler.to_bytes(4, "big"))
+    return bytes(out)
+
+
+def encoders_encode_png(rgb: Any, width: int, height: int, filter_type: str = "none", level: int = 6,
+                        strategy: int = zlib.Z_DEFAULT_STRATEGY, workers: int = 1) -> bytes:
+    scanlines = encoders_filter_scanlines(rgb, width, height, filter_type)
+    if workers == 1:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 8, strategy)
+        idat = compressor.compress(scanlines) + compressor.flush()
+    else:
+        idat = encoders_deflate_parallel(scanlines, level, strategy, workers)
+    return encoders_png_container(idat, width, height)
+
+
+def encoders_resolve(name: str, filter_type: Optional[str] = None, level: Optional[int] = None,
+                     workers: Optional[int] = None) -> Dict[str, Any]:
+    """Look up a profile by name and apply optional filter/level/worker overrides.
+
+    workers: 1 compresses on the calling thread, 0 uses one strip per CPU, N > 1 caps the strips.
+    """
+    key = (name or "png").strip().lower()
+    if key not in ENCODERS_PROFILES:
+        raise ValueError(f"unknown image encoder: {name} (expected one of {', '.join(ENCODERS_PROFILES)})")
+    profile = dict(ENCODERS_PROFILES[key])
+    profile["name"] = key
+    if filter_type:
+        f = filter_type.strip().lower()
+        if f not in _ENCODERS_FILTERS:
+            raise ValueError(f"unknown PNG filter: {filter_type} (expected one of {', '.join(_ENCODERS_FILTERS)})")
+        profile["filter"] = f
+    if level is not None and level >= 0:
+        if level > 9:
+            raise ValueError(f"PNG level must be 0-9, got {level}")
+        profile["level"] = level
+    if workers is not None:
+        if workers < 0:
+            raise ValueError(f"PNG workers must be >= 0, got {workers}")
+        profile["workers"] = workers
+    return profile
+
+
+def encoders_encode(rgb: Any, width: int, height: int, profile: Optional[Dict[str, Any]] = None) -> bytes:
+    p = profile or ENCODERS_PROFILES["png"]
+    return encoders_encode_png(rgb, width, height, p["filter"], p["level"], p.get("strategy", zlib.Z_DEFAULT_STRATEGY),
+                               p.get("workers", 1))
+
+
+def encoders_iter_chunks(png: bytes) -> List[Tuple[bytes, bytes]]:
+    if png[:8] != PNG_SIGNATURE:
+        raise ValueError("not a PNG file")
+    chunks = []
+    pos = 8
+    while pos + 8 <= len(png):
+        length, tag = struct.unpack("!I4s", png[pos:pos + 8])
+        chunks.append((tag, png[pos + 8:pos + 8 + length]))
+        pos += 12 + length
+        if tag == b"IEND":
+            break
+    return chunks
+
+
+def _encoders_unfilter_row(fid: int, row: bytes, prev: bytes, bpp: int) -> bytes:
+    if fid == 0:
+        return row
+    if fid == 2:
+        return encoders_bytewise_add(row, prev)
+    out = bytearray(row)
+    n = len(out)
+    if fid == 1:
+        for i in range(bpp, n):
+            out[i] = (out[i] + out[i - bpp]) & 0xFF
+    elif fid == 3:
+        for i in range(n):
+            left = out[i - bpp] if i >= bpp else 0
+            out[i] = (out[i] + ((left + prev[i]) >> 1)) & 0xFF
+    elif fid == 4:
+        for i in range(n):
+            a = out[i - bpp] if i >= bpp else 0
+            b = prev[i]
+            c = prev[i - bpp] if i >= bpp else 0
+            p = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            pred = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+            out[i] = (out[i] + pred) & 0xFF
+    else:
+        raise ValueError(f"invalid PNG filter type: {fid}")
+    return bytes(out)
+
+
+def encoders_decode_png_rgb(png: bytes) -> Tuple[bytes, int, int]:
+    """Decode an 8-bit, non-interlaced RGB/RGBA PNG to packed RGB (alpha is dropped)."""
+    width = height = 0
+    color_type = -1
+    idat = bytearray()
+    for tag, data in encoders_iter_chunks(png):
+        if tag == b"IHDR":
+            width, height, depth, color_type, _, _, interlace = struct.unpack("!IIBBBBB", data)
+            if depth != 8 or color_type not in (2, 6) or interlace:
+                raise ValueError(f"unsupported PNG format: depth={depth} color_type={color_type} interlace={interlace}")
+        elif tag == b"IDAT":
+            idat.extend(data)
+    if color_type < 0:
+        raise ValueError("PNG has no IHDR chunk")
+    bpp = 3 if color_type == 2 else 4
+    stride = width * bpp
+    raw = zlib.decompress(bytes(idat))
+    rows = bytearray(stride * height)
+    prev = bytes(stride)
+    for y in range(height):
+        o = y * (stride + 1)
+        row = _encoders_unfilter_row(raw[o], raw[o + 1:o + 1 + stride], prev, bpp)
+        rows[y * stride:(y + 1) * stride] = row
+        prev = row
+    if bpp == 3:
+        return bytes(rows), width, height
+    rgb = bytearray(width * height * 3)
+    rgb[0::3] = rows[0::4]
+    rgb[1::3] = rows[1::4]
+    rgb[2::3] = rows[2::4]
+    return bytes(rgb), width, height
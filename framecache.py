@@ -0,0 +1,194 @@
+from __future__ import annotations
+import hashlib
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from body import ImageRef
+
+# Coarse grid for the per-tile signature. 16x9 tiles of a 1536x864 frame are 96x96 px;
+# a changed tile set locates what moved without a second pass over the frame.
+FRAMECACHE_TILE_COLS = 16
+FRAMECACHE_TILE_ROWS = 9
+
+# Perceptual thumbnail: the green channel (a cheap luma stand-in) of every 8th pixel in
+# both directions. Samples differing by more than the tolerance count as changed, which
+# ignores dithering and cursor-blink level noise.
+FRAMECACHE_THUMB_STEP = 8
+_FRAMECACHE_DIFF_TOL = 24
+
+_framecache_lock = threading.Lock()
+_framecache_cfg: Dict[str, Any] = {"enabled": True, "size": 4}
+_framecache_entries: "OrderedDict[Tuple[Any, ...], FrameEntry]" = OrderedDict()
+_framecache_stats: Dict[str, Any] = {"lookups": 0, "hits": 0, "bytes_saved": 0, "encode_s_saved": 0.0,
+                                     "links": 0, "refs": 0}
+
+
+class FrameEntry:
+    """One encoded frame: the PNG, its ImageRef for request bodies and the dump file holding it."""
+
+    __slots__ = ("key", "tiles", "thumb", "png", "image", "width", "height", "encode_s", "path")
+
+    def __init__(self, key: Tuple[Any, ...], tiles: Tuple[int, ...], thumb: bytes, png: bytes, width: int, height: int,
+                 encode_s: float) -> None:
+        self.key = key
+        self.tiles = tiles
+        self.thumb = thumb
+        self.png = png
+        self.image = ImageRef(png)
+        self.width = width
+        self.height = height
+        self.encode_s = encode_s
+        self.path = ""
+
+
+def framecache_configure(enabled: bool = True, size: int = 4) -> None:
+    with _framecache_lock:
+        _framecache_cfg["enabled"] = enabled
+        _framecache_cfg["size"] = max(1, size)
+        while len(_framecache_entries) > _framecache_cfg["size"]:
+            _framecache_entries.popitem(last=False)
+
+
+def framecache_enabled() -> bool:
+    return _framecache_cfg["enabled"]
+
+
+def framecache_reset() -> None:
+    with _framecache_lock:
+        _framecache_entries.clear()
+        for k in _framecache_stats:
+            _framecache_stats[k] = 0.0 if isinstance(_framecache_stats[k], float) else 0
+
+
+def framecache_stats() -> Dict[str, Any]:
+    with _framecache_lock:
+        out = dict(_framecache_stats)
+    out["hit_rate"] = out["hits"] / out["lookups"] if out["lookups"] else 0.0
+    return out
+
+
+def framecache_hash(bgra: memoryview, width: int, height: int) -> Tuple[bytes, Tuple[int, ...]]:
+    """(blake2b-128 of the whole frame, crc32 per coarse tile in row-major order)."""
+    full = hashlib.blake2b(bgra, digest_size=16).digest()
+    stride = width * 4
+    xs = [(width * i // FRAMECACHE_TILE_COLS) * 4 for i in range(FRAMECACHE_TILE_COLS + 1)]
+    tiles = []
+    for ty in range(FRAMECACHE_TILE_ROWS):
+        y0 = height * ty // FRAMECACHE_TILE_ROWS
+        y1 = height * (ty + 1) // FRAMECACHE_TILE_ROWS
+        crcs = [0] * FRAMECACHE_TILE_COLS
+        for y in range(y0, y1):
+            row = bgra[y * stride:(y + 1) * stride]
+            for tx in range(FRAMECACHE_TILE_COLS):
+                crcs[tx] = zlib.crc32(row[xs[tx]:xs[tx + 1]], crcs[tx])
+        tiles.extend(crcs)
+    return full, tuple(tiles)
+
+
+def framecache_thumb(bgra: memoryview, width: int, height: int) -> bytes:
+    step = FRAMECACHE_THUMB_STEP
+    stride = width * 4
+    return b"".join(bgra[y * stride + 1:(y + 1) * stride:4 * step].tobytes() for y in range(0, height, step))
+
+
+def _framecache_tile_box(a: Tuple[int, ...], b: Tuple[int, ...], width: int, height: int) -> Optional[Tuple[int, int, int, int]]:
+    # Changes too small for the thumbnail still show up in the tile signatures.
+    idx = [i for i, (p, q) in enumerate(zip(a, b)) if p != q]
+    if not idx:
+        return None
+    cols = [i % FRAMECACHE_TILE_COLS for i in idx]
+    rows = [i // FRAMECACHE_TILE_COLS for i in idx]
+    return (width * min(cols) // FRAMECACHE_TILE_COLS, height * min(rows) // FRAMECACHE_TILE_ROWS,
+            width * (max(cols) + 1) // FRAMECACHE_TILE_COLS, height * (max(rows) + 1) // FRAMECACHE_TILE_ROWS)
+
+
+def framecache_diff(a: FrameEntry, b: FrameEntry) -> Tuple[float, Optional[Tuple[int, int, int, int]]]:
+    """Fraction of thumbnail samples that differ between two frames, and the changed box.
+
+    The box is (x0, y0, x1, y1) in frame pixels, or None when nothing differs. A change
+    below the thumbnail's resolution reports 0.0 with the box of the changed tiles. Frames
+    of different sizes count as fully changed.
+    """
+    if (a.width, a.height) != (b.width, b.height) or len(a.thumb) != len(b.thumb):
+        return 1.0, (0, 0, b.width, b.height)
+    if a.key == b.key:
+        return 0.0, None
+    step = FRAMECACHE_THUMB_STEP
+    tw = (b.width + step - 1) // step
+    changed = 0
+    x0 = y0 = 1 << 30
+    x1 = y1 = -1
+    for i, (p, q) in enumerate(zip(a.thumb, b.thumb)):
+        if abs(p - q) > _FRAMECACHE_DIFF_TOL:
+            changed += 1
+            y, x = divmod(i, tw)
+            x0 = min(x0, x)
+            x1 = max(x1, x)
+            y0 = min(y0, y)
+            y1 = max(y1, y)
+    if not changed:
+        return 0.0, _framecache_tile_box(a.tiles, b.tiles, b.width, b.height)
+    box = (max(0, (x0 - 1) * step), max(0, (y0 - 1) * step), min(b.width, (x1 + 2) * step), min(b.height, (y1 + 2) * step))
+    return changed / len(b.thumb), box
+
+
+def framecache_key(digest: bytes, width: int, height: int, encoder: Optional[Dict[str, Any]]) -> Tuple[Any, ...]:
+    # The encoded bytes depend on the encoder settings too, not just the pixels.
+    return (digest, width, height, tuple(sorted((encoder or {}).items())))
+
+
+def framecache_lookup(key: Tuple[Any, ...]) -> Optional[FrameEntry]:
+    if not _framecache_cfg["enabled"]:
+        return None
+    with _framecache_lock:
+        _framecache_stats["lookups"] += 1
+        entry = _framecache_entries.get(key)
+        if entry is None:
+            return None
+        _framecache_entries.move_to_end(key)
+        _framecache_stats["hits"] += 1
+        _framecache_stats["bytes_saved"] += len(entry.png)
+        _framecache_stats["encode_s_saved"] += entry.encode_s
+        return entry
+
+
+def framecache_store(entry: FrameEntry) -> FrameEntry:
+    if not _framecache_cfg["enabled"]:
+        return entry
+    with _framecache_lock:
+        _framecache_entries[entry.key] = entry
+        _framecache_entries.move_to_end(entry.key)
+        while len(_framecache_entries) > _framecache_cfg["size"]:
+            _framecache_entries.popitem(last=False)
+    return entry
+
+
+def framecache_dump(entry: FrameEntry, path: str, reused: bool) -> str:
+    """Write `entry` to `path`; returns the path actually written.
+
+    A reused frame whose previous dump still exists becomes a hard link to it, or a small
+    `.ref` file naming it where links are unsupported, instead of a second copy.
+    """
+    if reused and entry.path and os.path.exists(entry.path):
+        try:
+            if os.path.lexists(path):
+                if os.path.samefile(entry.path, path):
+                    return path
+                os.remove(path)
+            os.link(entry.path, path)
+            with _framecache_lock:
+                _framecache_stats["links"] += 1
+            return path
+        except OSError:
+            ref = os.path.splitext(path)[0] + ".ref"
+            with open(ref, "w", encoding="utf-8") as f:
+                f.write(os.path.relpath(entry.path, os.path.dirname(ref) or ".") + "\n")
+            with _framecache_lock:
+                _framecache_stats["refs"] += 1
+            return ref
+    with open(path, "wb") as f:
+        f.write(entry.png)
+    entry.path = path
+    return path
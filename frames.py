@@ -0,0 +1,57 @@
+from __future__ import annotations
+from typing import Any, Optional
+
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+# Rows converted per band in the pure-Python path. Keeps the temporary copy of
+# the source band small (64 rows of 1536 px = 384 KiB) and cache friendly.
+_FRAMES_BAND_ROWS = 64
+
+
+def frames_has_numpy() -> bool:
+    return _np is not None
+
+
+def frames_as_memoryview(buf: Any) -> memoryview:
+    """Flat unsigned-byte view over any buffer (bytes, bytearray, ctypes array, memoryview)."""
+    mv = buf if isinstance(buf, memoryview) else memoryview(buf)
+    if mv.format != "B" or mv.ndim != 1:
+        mv = mv.cast("B")
+    return mv
+
+
+def frames_bgra_to_rgb(bgra: Any, width: int, height: int, use_numpy: Optional[bool] = None) -> bytearray:
+    """Convert a top-down 32bpp BGRA frame to packed 24bpp RGB.
+
+    `bgra` is read through a memoryview, so a ctypes array over DIB bits can be passed
+    directly without an intermediate `bytes()` copy. The caller must keep the source
+    memory alive until this returns.
+    """
+    npx = width * height
+    src = frames_as_memoryview(bgra)
+    if len(src) < npx * 4:
+        raise ValueError(f"BGRA buffer too small: {len(src)} < {npx * 4}")
+    rgb = bytearray(npx * 3)
+    if use_numpy is None:
+        use_numpy = _np is not None
+    if use_numpy:
+        if _np is None:
+            raise RuntimeError("numpy is not installed")
+        src_arr = _np.frombuffer(src, dtype=_np.uint8, count=npx * 4).reshape(height, width, 4)
+        dst_arr = _np.frombuffer(rgb, dtype=_np.uint8).reshape(height, width, 3)
+        dst_arr[...] = src_arr[..., 2::-1]
+        return rgb
+    src_stride = width * 4
+    dst_stride = width * 3
+    for y in range(0, height, _FRAMES_BAND_ROWS):
+        y_end = min(height, y + _FRAMES_BAND_ROWS)
+        band = src[y * src_stride:y_end * src_stride].tobytes()
+        o = y * dst_stride
+        e = y_end * dst_stride
+        rgb[o:e:3] = band[2::4]
+        rgb[o + 1:e:3] = band[1::4]
+        rgb[o + 2:e:3] = band[0::4]
+    return rgb
@@ -0,0 +1,94 @@
+from __future__ import annotations
+import struct
+import time
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+# One keyboard event as SendInput sees it: (wVk, wScan, dwFlags).
+KeyEvent = Tuple[int, int, int]
+
+INPUT_KEYBOARD = 1
+KEYEVENTF_KEYUP, KEYEVENTF_UNICODE = 0x0002, 0x0004
+VK_RETURN, VK_TAB = 0x0D, 0x09
+
+# Byte layout of INPUT{type, union{KEYBDINPUT ki}} on 64- and 32-bit Windows. Packing
+# with struct builds the whole SendInput array as one bytes object, which ctypes copies
+# in a single from_buffer_copy instead of constructing a Structure per event.
+KEYINPUT_LAYOUTS = {
+    8: (40, struct.Struct("<I4xHHII4xQ8x")),
+    4: (28, struct.Struct("<IHHIII8x")),
+}
+
+# Control characters typed as their keys rather than as UTF-16 units (most edit
+# controls ignore WM_CHAR 0x0A).
+_KEYINPUT_CONTROL_VK = {"\n": VK_RETURN, "\t": VK_TAB}
+
+_keyinput_cfg = {"chunk": 128, "pace_s": 0.002}
+
+
+def keyinput_configure(chunk: int = 128, pace_s: float = 0.002) -> None:
+    """chunk: events per SendInput call (0 = the whole string at once); pace_s: pause between chunks."""
+    _keyinput_cfg["chunk"] = max(0, chunk)
+    _keyinput_cfg["pace_s"] = max(0.0, pace_s)
+
+
+def keyinput_compile_text(text: str) -> List[KeyEvent]:
+    """Text -> down/up event pairs, one pair per UTF-16 code unit.
+
+    Characters outside the BMP become two KEYEVENTF_UNICODE pairs (high then low
+    surrogate), which Windows reassembles into one WM_CHAR sequence. "\\r\\n" and "\\n"
+    press Enter and "\\t" presses Tab.
+    """
+    text = text.replace("\r\n", "\n")
+    events: List[KeyEvent] = []
+    for ch in text:
+        vk = _KEYINPUT_CONTROL_VK.get(ch)
+        if vk is not None:
+            events.append((vk, 0, 0))
+            events.append((vk, 0, KEYEVENTF_KEYUP))
+            continue
+        units = ch.encode("utf-16-le")
+        for i in range(0, len(units), 2):
+            code = units[i] | (units[i + 1] << 8)
+            events.append((0, code, KEYEVENTF_UNICODE))
+            events.append((0, code, KEYEVENTF_UNICODE | KEYEVENTF_KEYUP))
+    return events
+
+
+def keyinput_compile_combo(vks: Sequence[int]) -> List[KeyEvent]:
+    """[ctrl, shift, esc] -> ctrl, shift, esc down, then up in reverse order."""
+    return [(vk, 0, 0) for vk in vks] + [(vk, 0, KEYEVENTF_KEYUP) for vk in reversed(vks)]
+
+
+def keyinput_pack(events: Sequence[KeyEvent], ptr_size: int = struct.calcsize("P")) -> bytes:
+    _, st = KEYINPUT_LAYOUTS[ptr_size]
+    pack = st.pack
+    return b"".join([pack(INPUT_KEYBOARD, vk, scan, flags, 0, 0) for vk, scan, flags in events])
+
+
+def keyinput_unpack(buf: bytes, ptr_size: int = struct.calcsize("P")) -> List[KeyEvent]:
+    _, st = KEYINPUT_LAYOUTS[ptr_size]
+    return [(vk, scan, flags) for _, vk, scan, flags, _, _ in st.iter_unpack(buf)]
+
+
+def keyinput_chunks(events: Sequence[KeyEvent], chunk: Optional[int] = None) -> Iterator[Sequence[KeyEvent]]:
+    # Chunks hold an even number of events so a down/up pair is never split.
+    size = _keyinput_cfg["chunk"] if chunk is None else chunk
+    if size <= 0 or size >= len(events):
+        yield events
+        return
+    size += size & 1
+    for i in range(0, len(events), size):
+        yield events[i:i + size]
+
+
+def keyinput_send(events: Sequence[KeyEvent], send: Callable[[bytes, int], None], chunk: Optional[int] = None,
+                  pace_s: Optional[float] = None) -> int:
+    """Pack `events` and hand them to `send(buf, count)` chunk by chunk; returns the number of calls."""
+    pause = _keyinput_cfg["pace_s"] if pace_s is None else pace_s
+    calls = 0
+    for part in keyinput_chunks(events, chunk):
+        if calls and pause:
+            time.sleep(pause)
+        send(keyinput_pack(part), len(part))
+        calls += 1
+    return calls
@@ -1,42 +1,177 @@
 from __future__ import annotations
 import os
 import sys
-from winapi import winapi_init_dpi
-from scenarios import TOOLS_SCHEMA, SYSTEM_PROMPT
+from desktop import desktop_create, desktop_set
+from scenarios import TOOLS_SCHEMA, SYSTEM_PROMPT, SCENARIOS_UNCHANGED_MODES, scenarios_unchanged_stats
 from agent import run_agent
-from utils import utils_get_env_str, utils_get_env_int, utils_get_env_float
+from accounting import accounting_configure, accounting_stats
+from capture import capture_start, capture_stats, capture_stop
+from encoders import encoders_resolve
+from framecache import framecache_configure, framecache_stats
+from keyinput import keyinput_configure
+from plancompact import plancompact_configure, plancompact_stats
+from profiler import profiler_enable, profiler_export_chrome, profiler_summary
+from progress import PROGRESS_MODES, progress_configure, progress_report
+from router import router_configure, router_stats
+from session import session_configure, session_replay_desktop, session_replay_header, session_stats
+from settle import SETTLE_MODES, settle_configure, settle_stats
+from tracelog import tracelog_configure
+from trajcache import trajcache_configure, trajcache_stats
+from transport import transport_configure, transport_stats
+from utils import utils_get_env_str, utils_get_env_int, utils_get_env_float, utils_get_env_bool, utils_prompt_cache_stats
 
 
 def main() -> None:
-    winapi_init_dpi()
-    task_prompt = input().strip()
+    # AGENT_RECORD_DIR records the run; AGENT_REPLAY_DIR re-runs a recording offline,
+    # with model replies and frames served from it (see session.py).
+    record_dir = utils_get_env_str("AGENT_RECORD_DIR", "")
+    replay_dir = utils_get_env_str("AGENT_REPLAY_DIR", "")
+    session_configure(record_dir, replay_dir, utils_get_env_bool("AGENT_REPLAY_STRICT", False))
+    recorded = session_replay_header() if replay_dir else {}
+    if replay_dir:
+        desktop_set(session_replay_desktop()).init()
+        task_prompt = recorded.get("task", "")
+    else:
+        desktop_set(desktop_create(utils_get_env_str("AGENT_BACKEND", "auto"))).init()
+        task_prompt = input().strip()
     if not task_prompt:
         sys.exit("Error: No task provided.")
+    recorded_w, recorded_h = recorded.get("target") or (1536, 864)
     
+    # LMSTUDIO_ENDPOINTS (comma-separated) spreads requests over several servers; see router.py.
+    endpoints = [e.strip() for e in utils_get_env_str("LMSTUDIO_ENDPOINTS", "").split(",") if e.strip()]
     cfg = {
-        "endpoint": utils_get_env_str("LMSTUDIO_ENDPOINT", "http://localhost:1234/v1/chat/completions"),
+        "endpoint": endpoints[0] if endpoints else utils_get_env_str("LMSTUDIO_ENDPOINT", "http://localhost:1234/v1/chat/completions"),
         "model_id": utils_get_env_str("LMSTUDIO_MODEL", "qwen3-vl-4b-instruct"),
         "timeout": utils_get_env_int("LMSTUDIO_TIMEOUT", 960),
         "temperature": utils_get_env_float("LMSTUDIO_TEMPERATURE", 0.5),
         "max_tokens": utils_get_env_int("LMSTUDIO_MAX_TOKENS", 2048),
-        "target_w": utils_get_env_int("AGENT_IMAGE_W", 1536),
-        "target_h": utils_get_env_int("AGENT_IMAGE_H", 864),
+        "stream": utils_get_env_bool("LMSTUDIO_STREAM", False),
+        "cache_prompt": utils_get_env_bool("LMSTUDIO_CACHE_PROMPT", False),
+        "slot_id": utils_get_env_int("LMSTUDIO_SLOT_ID", -1),
+        "target_w": utils_get_env_int("AGENT_IMAGE_W", recorded_w or 1536),
+        "target_h": utils_get_env_int("AGENT_IMAGE_H", recorded_h or 864),
+        "image_encoder": encoders_resolve(utils_get_env_str("AGENT_IMAGE_ENCODER", "png"),
+                                          utils_get_env_str("AGENT_PNG_FILTER", ""),
+                                          utils_get_env_int("AGENT_PNG_LEVEL", -1),
+                                          utils_get_env_int("AGENT_PNG_WORKERS", 1)),
+        "observe_scale": utils_get_env_float("AGENT_OBSERVE_SCALE", 1.0),
+        "zoom_max_w": utils_get_env_int("AGENT_ZOOM_MAX_W", 1536),
+        "zoom_max_h": utils_get_env_int("AGENT_ZOOM_MAX_H", 864),
+        "unchanged_mode": utils_get_env_str("AGENT_UNCHANGED_MODE", "off").lower(),
+        "unchanged_threshold": utils_get_env_float("AGENT_UNCHANGED_THRESHOLD", 0.0),
         "dump_dir": utils_get_env_str("AGENT_DUMP_DIR", "dumps"),
         "dump_prefix": utils_get_env_str("AGENT_DUMP_PREFIX", "screen_"),
         "dump_start": utils_get_env_int("AGENT_DUMP_START", 1),
-        "max_steps": utils_get_env_int("AGENT_MAX_STEPS", 15),
-        "step_delay": utils_get_env_float("AGENT_STEP_DELAY", 0.4),
+        "max_steps": utils_get_env_int("AGENT_MAX_STEPS", recorded.get("max_steps") or 15),
+        "step_delay": 0.0 if replay_dir else utils_get_env_float("AGENT_STEP_DELAY", 0.4),
+        "step_deadline": utils_get_env_float("AGENT_STEP_DEADLINE", 0.0),
     }
     
+    if cfg["unchanged_mode"] not in SCENARIOS_UNCHANGED_MODES:
+        sys.exit(f"Error: AGENT_UNCHANGED_MODE must be one of {', '.join(SCENARIOS_UNCHANGED_MODES)}.")
+    
     os.makedirs(cfg["dump_dir"], exist_ok=True)
+    tracelog_configure(utils_get_env_str("AGENT_LOG_LEVEL", "warn"),
+                       utils_get_env_str("AGENT_LOG_FILE", os.path.join(cfg["dump_dir"], "trace.jsonl")),
+                       utils_get_env_bool("AGENT_LOG_CONSOLE", False))
+    transport_configure(pool_size=utils_get_env_int("LMSTUDIO_POOL_SIZE", 2),
+                        connect_timeout=utils_get_env_float("LMSTUDIO_CONNECT_TIMEOUT", 10.0),
+                        read_timeout=utils_get_env_float("LMSTUDIO_READ_TIMEOUT", 0.0) or None)
+    router_configure(endpoints,
+                     hedge=utils_get_env_bool("LMSTUDIO_HEDGE", False),
+                     hedge_quantile=utils_get_env_float("LMSTUDIO_HEDGE_QUANTILE", 0.95),
+                     hedge_min_s=utils_get_env_float("LMSTUDIO_HEDGE_MIN_MS", 500.0) / 1000.0,
+                     hedge_cold_s=utils_get_env_float("LMSTUDIO_HEDGE_COLD_MS", 30000.0) / 1000.0,
+                     fail_threshold=utils_get_env_int("LMSTUDIO_FAIL_THRESHOLD", 2),
+                     cooldown_s=utils_get_env_float("LMSTUDIO_COOLDOWN", 30.0))
+    
+    settle_mode = utils_get_env_str("AGENT_SETTLE", "fixed").lower()
+    if settle_mode not in SETTLE_MODES:
+        sys.exit(f"Error: AGENT_SETTLE must be one of {', '.join(SETTLE_MODES)}.")
+    if replay_dir:
+        # Nothing moves on a recording; the constant replay probe settles on the first poll.
+        settle_configure("adaptive", samples=2, interval=0.0, min_s=0.0, max_s=0.5, react_s=0.0)
+    else:
+        settle_configure(settle_mode,
+                         samples=utils_get_env_int("AGENT_SETTLE_SAMPLES", 3),
+                         interval=utils_get_env_float("AGENT_SETTLE_INTERVAL", 0.025),
+                         min_s=utils_get_env_float("AGENT_SETTLE_MIN", 0.05),
+                         max_s=utils_get_env_float("AGENT_SETTLE_MAX", 3.0),
+                         react_s=utils_get_env_float("AGENT_SETTLE_REACT", 1.0))
+    keyinput_configure(utils_get_env_int("AGENT_INPUT_CHUNK", 128), utils_get_env_float("AGENT_INPUT_PACE_MS", 2.0) / 1000.0)
+    framecache_configure(utils_get_env_bool("AGENT_FRAME_CACHE", True), utils_get_env_int("AGENT_FRAME_CACHE_SIZE", 4))
+    plan_compact = utils_get_env_bool("AGENT_PLAN_COMPACT", False)
+    plancompact_configure(plan_compact,
+                          keep_turns=utils_get_env_int("AGENT_PLAN_KEEP_TURNS", 6),
+                          summary_chars=utils_get_env_int("AGENT_PLAN_SUMMARY_CHARS", 600),
+                          budget_tokens=utils_get_env_int("AGENT_PLAN_BUDGET", 2000))
+    traj_dir = utils_get_env_str("AGENT_TRAJ_CACHE_DIR", "")
+    trajcache_configure(traj_dir,
+                        max_entries=utils_get_env_int("AGENT_TRAJ_CACHE_MAX_ENTRIES", 2000),
+                        max_bytes=utils_get_env_int("AGENT_TRAJ_CACHE_MAX_MB", 32) << 20,
+                        tol=utils_get_env_int("AGENT_TRAJ_CACHE_TOL", 16),
+                        max_cells=utils_get_env_int("AGENT_TRAJ_CACHE_CELLS", 0))
+    # AGENT_PROGRESS=note|abort watches for stalls and loops; on recordings, use
+    # `python progress.py SESSION_DIR` instead (a replayed screen never changes).
+    progress_mode = "off" if replay_dir else utils_get_env_str("AGENT_PROGRESS", "off").lower()
+    if progress_mode not in PROGRESS_MODES:
+        sys.exit(f"Error: AGENT_PROGRESS must be one of {', '.join(PROGRESS_MODES)}.")
+    progress_configure(progress_mode,
+                       noop_limit=utils_get_env_int("AGENT_PROGRESS_NOOPS", 2),
+                       plan_repeats=utils_get_env_int("AGENT_PROGRESS_PLAN_REPEATS", 3),
+                       max_notes=utils_get_env_int("AGENT_PROGRESS_NOTES", 2))
+    
+    # Per-task budgets end the run between steps; the run summary is JSON (see accounting.py).
+    accounting_configure(token_budget=utils_get_env_int("AGENT_TOKEN_BUDGET", 0),
+                         time_budget_s=utils_get_env_float("AGENT_TIME_BUDGET", 0.0),
+                         price_prompt=utils_get_env_float("AGENT_PRICE_PROMPT", 0.0),
+                         price_completion=utils_get_env_float("AGENT_PRICE_COMPLETION", 0.0),
+                         summary_path=utils_get_env_str("AGENT_RUN_SUMMARY", os.path.join(cfg["dump_dir"], "run_summary.json")))
+    
+    capture_fps = 0.0 if replay_dir else utils_get_env_float("AGENT_CAPTURE_FPS", 0.0)
+    if capture_fps > 0:
+        capture_start(max(16, int(cfg["target_w"] * cfg["observe_scale"])), max(16, int(cfg["target_h"] * cfg["observe_scale"])),
+                      capture_fps, utils_get_env_int("AGENT_CAPTURE_SLOTS", 4),
+                      utils_get_env_float("AGENT_CAPTURE_STABLE_MS", 150.0) / 1000.0,
+                      utils_get_env_float("AGENT_CAPTURE_WAIT_MS", 1500.0) / 1000.0,
+                      utils_get_env_str("AGENT_CAPTURE_RECORD_DIR", ""),
+                      utils_get_env_float("AGENT_CAPTURE_RECORD_FPS", 2.0))
+    
+    profile_path = utils_get_env_str("AGENT_PROFILE", "")
+    profiler_enable(bool(profile_path))
     
     try:
         out = run_agent(SYSTEM_PROMPT, task_prompt, TOOLS_SCHEMA, cfg)
         if out:
             print(out)
+        print(f"TRANSPORT STATS: {transport_stats()}", file=sys.stderr)
+        print(f"ACCOUNTING STATS: {accounting_stats()}", file=sys.stderr)
+        if endpoints:
+            print(f"ROUTER STATS: {router_stats()}", file=sys.stderr)
+        print(f"PROMPT CACHE STATS: {utils_prompt_cache_stats()}", file=sys.stderr)
+        print(f"FRAME CACHE STATS: {framecache_stats()}", file=sys.stderr)
+        if plan_compact:
+            print(f"PLAN COMPACTION STATS: {plancompact_stats()}", file=sys.stderr)
+        print(f"SETTLE STATS ({settle_mode}): {settle_stats()}", file=sys.stderr)
+        if capture_fps > 0:
+            print(f"CAPTURE STATS: {capture_stats()}", file=sys.stderr)
+        if traj_dir:
+            print(f"TRAJ CACHE STATS: {trajcache_stats()}", file=sys.stderr)
+        if progress_mode != "off":
+            print(f"PROGRESS REPORT: {progress_report()}", file=sys.stderr)
+        if record_dir or replay_dir:
+            print(f"SESSION STATS: {session_stats()}", file=sys.stderr)
+        if cfg["unchanged_mode"] != "off":
+            print(f"UNCHANGED SCREEN STATS: {scenarios_unchanged_stats()}", file=sys.stderr)
     except Exception as e:
         print(f"\nException occurred: {e}", file=sys.stderr)
         raise
+    finally:
+        capture_stop()
+        if profile_path:
+            profiler_export_chrome(profile_path)
+            print(profiler_summary(), file=sys.stderr)
 
 
 if __name__ == "__main__":
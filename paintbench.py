@@ -0,0 +1,415 @@
+from __future__ import annotations
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from simdesktop import SimDesktop
+
+PAINTBENCH_CIRCLES = 5
+_PAINTBENCH_README = os.path.join(os.path.dirname(os.path.abspath(__file__)), "README.md")
+_PAINTBENCH_RED = (237, 28, 36)
+_PAINTBENCH_BLACK = (0, 0, 0)
+
+
+def paintbench_load_tasks(readme_path: str = _PAINTBENCH_README) -> Dict[int, str]:
+    """Task prompts are the fenced blocks under the '## BENCHMARK TASK N' headings of README.md."""
+    with open(readme_path, "r", encoding="utf-8") as f:
+        text = f.read()
+    tasks = {}
+    for m in re.finditer(r"## BENCHMARK TASK (\d+)[^\n]*\n+```\n(.*?)```", text, re.DOTALL):
+        tasks[int(m.group(1))] = m.group(2).strip()
+    return tasks
+
+
+class PaintCanvas(SimDesktop):
+    """Simulated Paint window: white canvas with red circles; a click stamps a black brush mark."""
+
+    def __init__(self, width: int = 1920, height: int = 1080, seed: int = 0, radius: int = 60, brush: int = 30) -> None:
+        self.radius = radius
+        self.brush = brush
+        self.canvas = (int(width * 0.10), int(height * 0.20), int(width * 0.90), int(height * 0.85))
+        self.circles = self._place_circles(random.Random(seed))
+        self.hits = [0] * len(self.circles)
+        self.clicks: List[Tuple[int, int, int]] = []
+        super().__init__(width, height)
+
+    def _place_circles(self, rnd: random.Random) -> List[Tuple[int, int]]:
+        x0, y0, x1, y1 = self.canvas
+        m = self.radius + 10
+        circles: List[Tuple[int, int]] = []
+        while len(circles) < PAINTBENCH_CIRCLES:
+            c = (rnd.randint(x0 + m, x1 - m), rnd.randint(y0 + m, y1 - m))
+            if all(math.hypot(c[0] - o[0], c[1] - o[1]) > 2 * self.radius + 40 for o in circles):
+                circles.append(c)
+        return circles
+
+    def render(self) -> None:
+        self.fill_rect(0, 0, self.width, self.height, (0, 99, 177))
+        self.fill_rect(0, self.height - 48, self.width, self.height, (32, 32, 32))
+        self.fill_rect(0, 0, self.width, self.canvas[1], (245, 246, 247))
+        self.fill_rect(0, self.canvas[1], self.width, self.height - 48, (201, 211, 226))
+        self.fill_rect(*self.canvas, (255, 255, 255))
+        for cx, cy in self.circles:
+            self.fill_circle(cx, cy, self.radius, _PAINTBENCH_RED)
+
+    def circle_at(self, x: int, y: int) -> int:
+        for i, (cx, cy) in enumerate(self.circles):
+            if math.hypot(x - cx, y - cy) <= self.radius:
+                return i
+        return -1
+
+    def on_click(self, x: int, y: int) -> None:
+        x0, y0, x1, y1 = self.canvas
+        idx = self.circle_at(x, y)
+        self.clicks.append((x, y, idx))
+        if idx >= 0:
+            self.hits[idx] += 1
+        if x0 <= x < x1 and y0 <= y < y1:
+            self.fill_circle(x, y, self.brush, _PAINTBENCH_BLACK)
+
+    def unmarked(self) -> List[int]:
+        return [i for i, h in enumerate(self.hits) if h == 0]
+
+
+class MockPaintModel:
+    """Scripted stand-in for the vision model that reads the canvas state directly.
+
+    It follows the observe/click protocol of the system prompt and injects the README's
+    failure modes at configurable rates: duplicate clicks, missed clicks, skipped
+    verification and premature completion. It can also get stuck clicking one blank spot
+    over and over, until a progress note (see progress.py) reaches it.
+    """
+
+    def __init__(self, canvas: PaintCanvas, seed: int, dup_rate: float = 0.0, miss_rate: float = 0.0,
+                 skip_verify_rate: float = 0.0, premature_rate: float = 0.0, plan_chars: int = 6000,
+                 stuck_rate: float = 0.0) -> None:
+        self.canvas = canvas
+        self.rnd = random.Random(seed)
+        self.dup_rate = dup_rate
+        self.miss_rate = miss_rate
+        self.skip_verify_rate = skip_verify_rate
+        self.premature_rate = premature_rate
+        self.plan_chars = plan_chars
+        self.stuck_rate = stuck_rate
+        self.stuck: Optional[Tuple[int, int]] = None
+        self.calls = 0
+        self.usage: List[Dict[str, Any]] = []
+        self.actions: List[str] = []
+        self._last_prompt = ""
+
+    def _norm(self, x: int, y: int) -> List[float]:
+        return [round(x * 1000.0 / (self.canvas.width - 1), 1), round(y * 1000.0 / (self.canvas.height - 1), 1)]
+
+    def _plan(self, next_action: str) -> str:
+        remaining = len(self.canvas.unmarked())
+        head = (f"**USER REQUEST**\nMark all {PAINTBENCH_CIRCLES} red circles.\n\n**WHAT HAPPENED SO FAR**\n"
+                + "".join(f"- Turn {i + 1}: {a}\n" for i, a in enumerate(self.actions))
+                + f"\n**CURRENT SCREEN STATE**\nPaint canvas. Remaining: {remaining}/{PAINTBENCH_CIRCLES}.\n\n"
+                + "**LAST ACTION RESULT**\nJudgment: SUCCESS\n\n")
+        filler = max(0, self.plan_chars - len(head) - len(next_action) - 20)
+        return head + ("Details. " * (filler // 9 + 1))[:filler] + f"\n\n**NEXT ACTION**\n{next_action}"
+
+    def _last_action(self, messages: List[Dict[str, Any]]) -> Tuple[Optional[str], str]:
+        for m in reversed(messages):
+            if m.get("role") == "assistant" and m.get("tool_calls"):
+                fn = m["tool_calls"][0]["function"]
+                return fn["name"], fn.get("arguments") or ""
+        return None, ""
+
+    def _noted(self, messages: List[Dict[str, Any]]) -> bool:
+        content = messages[-1].get("content") if messages[-1].get("role") == "user" else ""
+        if isinstance(content, list):
+            content = " ".join(p.get("text", "") for p in content if p.get("type") == "text")
+        return "PROGRESS CHECK" in (content or "")
+
+    def decide(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        last_name, last_args = self._last_action(messages)
+        if self.stuck is not None and self._noted(messages):
+            self.stuck = None
+        unmarked = self.canvas.unmarked()
+        if last_name == "observe_screen" and "GOAL ACHIEVED" in last_args:
+            return {"role": "assistant", "content": "Mission accomplished."}
+        premature = len(unmarked) == 1 and self.rnd.random() < self.premature_rate
+        if last_name == "click_element" and not (self.rnd.random() < self.skip_verify_rate and unmarked):
+            nxt = "GOAL ACHIEVED: all circles marked" if not unmarked or premature else "Click next red circle"
+            self.actions.append("Observed screen")
+            return self._tool("observe_screen", {"plan": self._plan(nxt)})
+        if last_name is None:
+            self.actions.append("Observed initial canvas")
+            return self._tool("observe_screen", {"plan": ""})
+        if not unmarked or premature:
+            self.actions.append("Verified all circles")
+            return self._tool("observe_screen", {"plan": self._plan("GOAL ACHIEVED: all circles marked")})
+        if self.stuck is None and self.stuck_rate and self.rnd.random() < self.stuck_rate:
+            x0, y0 = self.canvas.canvas[:2]
+            self.stuck = (x0 + 20, y0 + 20)
+        if self.stuck is not None:
+            self.actions.append(f"Clicked circle at {self._norm(*self.stuck)}")
+            return self._tool("click_element", {"label": "red circle", "box": self._norm(*self.stuck)})
+        marked = [i for i in range(len(self.canvas.circles)) if i not in unmarked]
+        if marked and self.rnd.random() < self.dup_rate:
+            cx, cy = self.canvas.circles[self.rnd.choice(marked)]
+        else:
+            cx, cy = self.canvas.circles[self.rnd.choice(unmarked)]
+        if self.rnd.random() < self.miss_rate:
+            cx += self.canvas.radius + self.canvas.brush + 15
+        self.actions.append(f"Clicked circle at {self._norm(cx, cy)}")
+        return self._tool("click_element", {"label": "red circle", "box": self._norm(cx, cy)})
+
+    def _tool(self, name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+        self.calls += 1
+        return {"role": "assistant", "content": "", "tool_calls": [
+            {"id": f"call_{self.calls}", "type": "function", "function": {"name": name, "arguments": json.dumps(args)}}]}
+
+    def respond(self, body: bytes) -> bytes:
+        req = json.loads(body)
+        msg = self.decide(req["messages"])
+        text_chars = 0
+        image_tokens = 0
+        for m in req["messages"]:
+            content = m.get("content")
+            if isinstance(content, str):
+                text_chars += len(content)
+            elif isinstance(content, list):
+                for part in content:
+                    if part.get("type") == "text":
+                        text_chars += len(part.get("text", ""))
+                    elif part.get("type") == "image_url":
+                        image_tokens += _paintbench_image_tokens(part["image_url"]["url"])
+            for tc in m.get("tool_calls") or []:
+                text_chars += len(tc["function"].get("arguments") or "")
+        text_chars += len(json.dumps(req.get("tools", [])))
+        completion = (len(msg.get("content") or "") + sum(len(tc["function"]["arguments"]) for tc in msg.get("tool_calls", []))) // 4
+        usage: Dict[str, Any] = {"prompt_tokens": text_chars // 4 + image_tokens, "completion_tokens": max(1, completion)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        # Stand-in for a llama.cpp slot cache: the tokens of the rendered prompt (tools,
+        # then messages as sent) that match the previous request from the start are cached.
+        rendered = json.dumps(req.get("tools", [])) + "".join(json.dumps(m) for m in req["messages"])
+        common = len(os.path.commonprefix([self._last_prompt, rendered]))
+        self._last_prompt = rendered
+        usage["prompt_tokens_details"] = {"cached_tokens": min(usage["prompt_tokens"], common // 4)}
+        self.usage.append(usage)
+        return json.dumps({"choices": [{"index": 0, "message": msg, "finish_reason": "stop"}], "usage": usage}).encode("utf-8")
+
+
+def _paintbench_image_tokens(url: str) -> int:
+    # Vision encoders of the Qwen-VL family spend one token per 28x28 patch; the size
+    # comes from the PNG IHDR at the start of the data URL.
+    head = base64.b64decode(url.split(",", 1)[1][:32])
+    w, h = struct.unpack(">II", head[16:24])
+    return -(-w // 28) * -(-h // 28)
+
+
+def _paintbench_serve(model: MockPaintModel) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            out = model.respond(body)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def paintbench_score(canvas: PaintCanvas, final_text: str) -> Dict[str, Any]:
+    """README metrics for one episode, computed from the canvas state and its input event log."""
+    actions = [e.kind for e in canvas.events if e.kind in ("capture", "click", "type", "key", "scroll")]
+    circle_clicks = sum(1 for c in canvas.clicks if c[2] >= 0)
+    verified = sum(1 for a, b in zip(actions, actions[1:]) if a == "click" and b == "capture")
+    finished = "mission accomplished" in (final_text or "").lower()
+    unmarked = len(canvas.unmarked())
+    return {"duplicate_clicks": sum(max(0, h - 1) for h in canvas.hits),
+            "missed_clicks": len(canvas.clicks) - circle_clicks,
+            "circles_marked": len(canvas.circles) - unmarked,
+            "completion_accuracy": int(circle_clicks == len(canvas.circles) and unmarked == 0),
+            "verification_cycles": verified,
+            "false_completion": int(finished and unmarked > 0),
+            "completed": int(finished and unmarked == 0),
+            "actions": len(actions)}
+
+
+def paintbench_episode(episode: int, opts: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one episode in this process: fresh canvas, fresh mock server (unless an endpoint is given), temp dump dir."""
+    from accounting import accounting_configure, accounting_stats
+    from agent import run_agent
+    from desktop import desktop_set
+    from encoders import encoders_resolve
+    from framecache import framecache_reset, framecache_stats
+    from plancompact import plancompact_configure, plancompact_reset, plancompact_stats
+    from progress import progress_configure, progress_report
+    from settle import settle_configure, settle_reset, settle_stats
+    from scenarios import SYSTEM_PROMPT, TOOLS_SCHEMA
+    from transport import transport_close_all, transport_stats
+    from trajcache import trajcache_configure, trajcache_reset, trajcache_stats
+    from utils import utils_prompt_cache_reset, utils_prompt_cache_stats
+
+    seed = opts["seed"] + (0 if opts["same_seed"] else episode)
+    canvas = PaintCanvas(seed=seed)
+    desktop_set(canvas)
+    framecache_reset()
+    settle_reset()
+    utils_prompt_cache_reset()
+    trajcache_reset()
+    trajcache_configure(opts["traj_cache"])
+    progress_configure(opts["progress"])
+    accounting_configure(token_budget=opts["token_budget"], time_budget_s=opts["time_budget"])
+    plancompact_reset()
+    plancompact_configure(opts["plan_budget"] > 0, keep_turns=opts["plan_keep_turns"], budget_tokens=opts["plan_budget"])
+    settle_configure(opts["settle"])
+    model = None
+    srv = None
+    endpoint = opts.get("endpoint")
+    if not endpoint:
+        model = MockPaintModel(canvas, seed, opts["dup_rate"], opts["miss_rate"], opts["skip_verify_rate"],
+                               opts["premature_rate"], opts["plan_chars"], opts["stuck_rate"])
+        srv = _paintbench_serve(model)
+        endpoint = f"http://127.0.0.1:{srv.server_port}/v1/chat/completions"
+    dump_dir = tempfile.mkdtemp(prefix="paintbench_")
+    cfg = {"endpoint": endpoint, "model_id": opts["model_id"], "timeout": opts["timeout"], "temperature": 0.0,
+           "max_tokens": 2048, "target_w": opts["target_w"], "target_h": opts["target_h"],
+           "image_encoder": encoders_resolve(opts["encoder"]), "dump_dir": dump_dir, "dump_prefix": "screen_",
+           "dump_start": 1, "max_steps": opts["max_steps"], "step_delay": opts["step_delay"],
+           "observe_scale": opts["observe_scale"], "unchanged_mode": opts["unchanged_mode"], "unchanged_threshold": opts["unchanged_threshold"]}
+    before = transport_stats()
+    error = None
+    final = ""
+    t0 = time.perf_counter()
+    try:
+        final = run_agent(SYSTEM_PROMPT, opts["task_text"], TOOLS_SCHEMA, cfg)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        wall = time.perf_counter() - t0
+        if srv is not None:
+            transport_close_all()
+            srv.shutdown()
+            srv.server_close()
+        shutil.rmtree(dump_dir, ignore_errors=True)
+    after = transport_stats()
+    steps = after["requests"] - before["requests"]
+    result = paintbench_score(canvas, final)
+    progress = progress_report()
+    accounting = accounting_stats()
+    result.update({"episode": episode, "seed": seed, "error": error, "steps": steps, "wall_s": wall,
+                   "wall_per_step_s": wall / max(1, steps),
+                   "bytes_per_request": (after["bytes_sent"] - before["bytes_sent"]) / max(1, steps),
+                   "frame_cache_hit_rate": framecache_stats()["hit_rate"],
+                   "prompt_cache_hit_rate": utils_prompt_cache_stats()["later"]["hit_rate"],
+                   "traj_hit_rate": trajcache_stats()["hit_rate"] if opts["traj_cache"] else None,
+                   "model_calls_saved": trajcache_stats()["model_calls_saved"] if opts["traj_cache"] else None,
+                   "plan_tokens_saved": plancompact_stats()["saved_per_plan"] if opts["plan_budget"] > 0 else None,
+                   "budget_stopped": accounting["budgets"]["exceeded"]["budget"] if accounting["budgets"]["exceeded"] else None,
+                   "progress_notes": progress["notes"],
+                   "progress_stopped": progress["stopped"]["kind"] if progress["stopped"] else None,
+                   "settle_ms": {k: v["mean_ms"] for k, v in settle_stats().items()}, "tokens_per_step": None})
+    if model is not None and model.usage:
+        result["tokens_per_step"] = sum(u["total_tokens"] for u in model.usage) / len(model.usage)
+    return result
+
+
+def _paintbench_aggregate(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    n = max(1, len(results))
+
+    def mean(key: str) -> Optional[float]:
+        vals = [r[key] for r in results if r.get(key) is not None]
+        return sum(vals) / len(vals) if vals else None
+
+    return {"episodes": len(results), "errors": sum(1 for r in results if r["error"]),
+            "completion_accuracy": sum(r["completion_accuracy"] for r in results) / n,
+            "completed": sum(r["completed"] for r in results) / n,
+            "false_completion": sum(r["false_completion"] for r in results) / n,
+            "duplicate_clicks": mean("duplicate_clicks"), "missed_clicks": mean("missed_clicks"),
+            "verification_cycles": mean("verification_cycles"), "steps": mean("steps"),
+            "wall_per_step_s": mean("wall_per_step_s"), "tokens_per_step": mean("tokens_per_step"),
+            "bytes_per_request": mean("bytes_per_request"), "frame_cache_hit_rate": mean("frame_cache_hit_rate"),
+            "prompt_cache_hit_rate": mean("prompt_cache_hit_rate"), "traj_hit_rate": mean("traj_hit_rate"),
+            "model_calls_saved": mean("model_calls_saved"), "plan_tokens_saved": mean("plan_tokens_saved"), "progress_notes": mean("progress_notes"),
+            "progress_stopped": sum(1 for r in results if r["progress_stopped"]) / n,
+            "budget_stopped": sum(1 for r in results if r["budget_stopped"]) / n}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Headless red-circles benchmark (README tasks) on a simulated Paint canvas")
+    ap.add_argument("--task", type=int, default=1, help="README benchmark task number")
+    ap.add_argument("--episodes", type=int, default=10)
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--same-seed", action="store_true", help="every episode uses --seed (a repeated flow, e.g. for --traj-cache)")
+    ap.add_argument("--traj-cache", default="", help="trajectory cache directory (see AGENT_TRAJ_CACHE_DIR)")
+    ap.add_argument("--progress", default="off", help="off, note or abort (see AGENT_PROGRESS)")
+    ap.add_argument("--plan-budget", type=int, default=0, help="compact plans to this many tokens; 0 leaves them as is (see AGENT_PLAN_BUDGET)")
+    ap.add_argument("--plan-keep-turns", type=int, default=6, help="history turns kept verbatim when compacting plans")
+    ap.add_argument("--token-budget", type=int, default=0, help="per-episode token budget (see AGENT_TOKEN_BUDGET)")
+    ap.add_argument("--time-budget", type=float, default=0.0, help="per-episode wall-clock budget in seconds (see AGENT_TIME_BUDGET)")
+    ap.add_argument("--endpoint", default="", help="drive a real or recorded model endpoint instead of the mock")
+    ap.add_argument("--model-id", default="mock-paint")
+    ap.add_argument("--timeout", type=int, default=60)
+    ap.add_argument("--max-steps", type=int, default=40)
+    ap.add_argument("--step-delay", type=float, default=0.0)
+    ap.add_argument("--target-w", type=int, default=1536)
+    ap.add_argument("--target-h", type=int, default=864)
+    ap.add_argument("--encoder", default="png")
+    ap.add_argument("--settle", default="fixed", help="fixed or adaptive (see AGENT_SETTLE)")
+    ap.add_argument("--observe-scale", type=float, default=1.0, help="observe_screen resolution relative to target (see AGENT_OBSERVE_SCALE)")
+    ap.add_argument("--unchanged-mode", default="off", help="off, text, ref or crop (see AGENT_UNCHANGED_MODE)")
+    ap.add_argument("--unchanged-threshold", type=float, default=0.0, help="percent of changed samples still treated as unchanged")
+    ap.add_argument("--dup-rate", type=float, default=0.0, help="mock: chance of re-clicking a marked circle")
+    ap.add_argument("--miss-rate", type=float, default=0.0, help="mock: chance of clicking beside the target")
+    ap.add_argument("--skip-verify-rate", type=float, default=0.0, help="mock: chance of clicking again without observing")
+    ap.add_argument("--premature-rate", type=float, default=0.0, help="mock: chance of declaring success one circle early")
+    ap.add_argument("--stuck-rate", type=float, default=0.0, help="mock: chance of getting stuck re-clicking one blank spot")
+    ap.add_argument("--plan-chars", type=int, default=6000, help="mock: size of each observe_screen plan")
+    ap.add_argument("--json", default="", help="write per-episode results and the aggregate to this file")
+    args = ap.parse_args()
+
+    tasks = paintbench_load_tasks()
+    if args.task not in tasks:
+        raise SystemExit(f"unknown task {args.task}; README defines {sorted(tasks)}")
+    opts = {k: v for k, v in vars(args).items() if k not in ("episodes", "jobs", "json", "task")}
+    opts["task_text"] = tasks[args.task]
+
+    t0 = time.perf_counter()
+    if args.jobs <= 1:
+        results = [paintbench_episode(i, opts) for i in range(args.episodes)]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as ex:
+            results = list(ex.map(paintbench_episode, range(args.episodes), [opts] * args.episodes))
+    total = time.perf_counter() - t0
+
+    print(f"{'ep':>4} {'seed':>6} {'steps':>5} {'dup':>4} {'miss':>4} {'verif':>5} {'acc':>4} {'false':>5} {'s/step':>7} {'B/req':>9}")
+    for r in results:
+        print(f"{r['episode']:>4} {r['seed']:>6} {r['steps']:>5} {r['duplicate_clicks']:>4} {r['missed_clicks']:>4} "
+              f"{r['verification_cycles']:>5} {r['completion_accuracy']:>4} {r['false_completion']:>5} "
+              f"{r['wall_per_step_s']:>7.3f} {r['bytes_per_request']:>9.0f}" + (f"  {r['error']}" if r["error"] else ""))
+    agg = _paintbench_aggregate(results)
+    agg["task"] = args.task
+    agg["total_s"] = total
+    print(json.dumps(agg, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"aggregate": agg, "episodes": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
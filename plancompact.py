@@ -0,0 +1,277 @@
+from __future__ import annotations
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from tracelog import tracelog_info
+
+# Plan sections (see SYSTEM_PROMPT) that are never shortened to meet the budget: the task
+# and the next step are what the next turn cannot reconstruct from the screenshot.
+_PLANCOMPACT_PROTECTED = ("USER REQUEST", "NEXT ACTION")
+_PLANCOMPACT_HISTORY = "WHAT HAPPENED SO FAR"
+# The section titles the plan tool asks for; these also count as headings when written plain
+# ("NEXT ACTION" or "NEXT ACTION: click ...") or with text after the colon.
+_PLANCOMPACT_SECTIONS = ("USER REQUEST", _PLANCOMPACT_HISTORY, "CURRENT SCREEN STATE", "LAST ACTION RESULT", "NEXT ACTION")
+_PLANCOMPACT_HEADING = re.compile(r"^\s*(?P<hash>#{1,4}\s+)?(?P<open>\*\*)?(?P<title>[^*:#]*[^*:#\s])\s*(?P<c1>:)?\s*"
+                                  r"(?P<close>\*\*)?\s*(?P<c2>:)?[ \t]*")
+_PLANCOMPACT_BULLET = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+_PLANCOMPACT_TURN = re.compile(r"^turn\s+(\d+)\s*[:.)-]\s*", re.IGNORECASE)
+_PLANCOMPACT_SUMMARY = re.compile(r"^- Earlier turns \((\d+)-(\d+)\): (.*)$")
+_PLANCOMPACT_TOKEN = re.compile(r"\w+|[^\w\s]")
+_PLANCOMPACT_PIECE_CHARS = 80
+_PLANCOMPACT_CUT = " [...]"
+
+_plancompact_cfg: Dict[str, Any] = {"enabled": False, "keep_turns": 6, "summary_chars": 600, "budget_tokens": 2000}
+_plancompact_lock = threading.Lock()
+_plancompact_stats: Dict[str, Any] = {"plans": 0, "compacted": 0, "tokens_in": 0, "tokens_out": 0, "turns_folded": 0,
+                                      "sections_dropped": 0, "over_budget": 0}
+
+
+def plancompact_configure(enabled: bool = False, keep_turns: int = 6, summary_chars: int = 600, budget_tokens: int = 2000) -> None:
+    """Compact observe_screen/zoom_region plans: the last `keep_turns` history entries stay
+    verbatim, older ones fold into one summary line of at most `summary_chars`, and the
+    plan is cut down to `budget_tokens` estimated tokens (0: no budget)."""
+    _plancompact_cfg.update({"enabled": bool(enabled), "keep_turns": max(1, keep_turns),
+                             "summary_chars": max(_PLANCOMPACT_PIECE_CHARS, summary_chars), "budget_tokens": max(0, budget_tokens)})
+
+
+def plancompact_enabled() -> bool:
+    return _plancompact_cfg["enabled"]
+
+
+def plancompact_estimate_tokens(text: str) -> int:
+    """Local stand-in for the model's tokenizer: a token per punctuation mark and per
+    started four characters of a word. BPE vocabularies land within about 20% on prose."""
+    return sum(-(-len(t) // 4) for t in _PLANCOMPACT_TOKEN.findall(text))
+
+
+def _plancompact_heading(line: str) -> Optional[Tuple[str, str, str]]:
+    # (title, heading text, text after the heading) or None. A heading alone on its line may be
+    # any **bold** or # title; one with text after its colon, or a plain one, must be a known section.
+    m = _PLANCOMPACT_HEADING.match(line)
+    if not m or bool(m.group("open")) != bool(m.group("close")):
+        return None
+    title = m.group("title").strip().upper()
+    rest = line[m.end():]
+    if rest.strip() and not (m.group("c1") or m.group("c2")):
+        return None
+    if (rest.strip() or not (m.group("hash") or m.group("open"))) and title not in _PLANCOMPACT_SECTIONS:
+        return None
+    return title, line[:m.end()], rest
+
+
+def _plancompact_parse(plan: str) -> Tuple[List[str], List[Tuple[str, str, List[str], bool]]]:
+    # Lines before the first heading, then (title, heading, body lines, inline) per section;
+    # an inline heading's text after the colon is the first body line, rendered on the heading line.
+    preamble: List[str] = []
+    sections: List[Tuple[str, str, List[str], bool]] = []
+    for line in plan.split("\n"):
+        h = _plancompact_heading(line)
+        if h:
+            title, heading, rest = h
+            sections.append((title, heading, [rest], True) if rest.strip() else (title, line, [], False))
+        elif sections:
+            sections[-1][2].append(line)
+        else:
+            preamble.append(line)
+    return preamble, sections
+
+
+def _plancompact_dedupe(sections: List[Tuple[str, str, List[str], bool]]) -> List[Tuple[str, str, List[str], bool]]:
+    # A repeated heading keeps its last (most recent) body; a body identical to one already kept goes
+    # (sections already cut down to the marker are not duplicates of each other).
+    last = {s[0]: i for i, s in enumerate(sections)}
+    out: List[Tuple[str, str, List[str], bool]] = []
+    bodies = set()
+    for i, section in enumerate(sections):
+        text = " ".join(" ".join(section[2]).split())
+        if last[section[0]] != i or (text and text in bodies):
+            continue
+        if text != _PLANCOMPACT_CUT.strip():
+            bodies.add(text)
+        out.append(section)
+    return out
+
+
+def _plancompact_entries(body: List[str]) -> Tuple[Optional[Tuple[int, int, List[str]]], List[List[str]], List[str]]:
+    # Split the history body into an existing summary line, one line group per turn, and trailing blank lines.
+    summary = None
+    entries: List[List[str]] = []
+    trailing: List[str] = []
+    for line in body:
+        m = _PLANCOMPACT_SUMMARY.match(line.strip())
+        if m:
+            summary = (int(m.group(1)), int(m.group(2)), m.group(3).split("; "))
+        elif _PLANCOMPACT_BULLET.match(line):
+            entries.append([line])
+        elif not line.strip():
+            trailing.append(line)
+        elif entries:
+            entries[-1].extend(trailing + [line])
+            trailing = []
+        else:
+            entries.append([line])
+        if line.strip():
+            trailing = []
+    return summary, entries, trailing
+
+
+def _plancompact_piece(entry: List[str], fallback: int) -> Tuple[int, str]:
+    text = _PLANCOMPACT_BULLET.sub("", " ".join(" ".join(entry).split()), count=1)
+    m = _PLANCOMPACT_TURN.match(text)
+    turn = int(m.group(1)) if m else fallback
+    text = text[m.end():] if m else text
+    text = re.split(r"(?<=[.;!?])\s", text, maxsplit=1)[0].rstrip(".;")
+    if len(text) > _PLANCOMPACT_PIECE_CHARS:
+        text = text[:_PLANCOMPACT_PIECE_CHARS - 3].rstrip() + "..."
+    return turn, f"T{turn} {text}"
+
+
+def _plancompact_history(body: List[str], keep: int, summary_chars: int) -> Tuple[List[str], int]:
+    summary, entries, trailing = _plancompact_entries(body)
+    folded = entries[:-keep] if len(entries) > keep else []
+    if not folded and summary is None:
+        return body, 0
+    first, last, pieces = summary if summary else (0, 0, [])
+    before = f"- Earlier turns ({first}-{last}): " + "; ".join(pieces)
+    for entry in folded:
+        turn, piece = _plancompact_piece(entry, last + 1)
+        first = first or turn
+        last = max(last, turn)
+        pieces.append(piece)
+    # Fixed size: the oldest pieces go first, leaving a marker that something was dropped. The
+    # newest piece stays unless the budget has pushed summary_chars below a single piece.
+    dropped = bool(pieces) and pieces[0] == "..."
+    pieces = [p for p in pieces if p != "..."]
+    floor = 1 if summary_chars >= _PLANCOMPACT_PIECE_CHARS else 0
+    while len(pieces) > floor and len("; ".join(pieces)) + 5 > summary_chars:
+        pieces.pop(0)
+        dropped = True
+    line = f"- Earlier turns ({first}-{last}): " + "; ".join((["..."] if dropped else []) + pieces)
+    if not folded and line == before:
+        return body, 0
+    return [line] + [ln for entry in entries[-keep:] for ln in entry] + trailing, len(folded)
+
+
+def _plancompact_fold(section: Tuple[str, str, List[str], bool], keep: int,
+                      summary_chars: int) -> Tuple[Tuple[str, str, List[str], bool], int]:
+    # The history section with old turns folded; a rewritten body starts below its heading.
+    title, heading, body, inline = section
+    new_body, folded = _plancompact_history(body, keep, summary_chars)
+    if new_body is body:
+        return section, 0
+    return (title, heading.rstrip(), new_body, False) if inline else (title, heading, new_body, False), folded
+
+
+def _plancompact_render(preamble: List[str], sections: List[Tuple[str, str, List[str], bool]]) -> str:
+    lines = list(preamble)
+    for _, heading, body, inline in sections:
+        if inline and body:
+            lines.append(heading + body[0])
+            lines.extend(body[1:])
+        else:
+            lines.append(heading)
+            lines.extend(body)
+    return "\n".join(lines).strip()
+
+
+def _plancompact_cut(body: List[str], chars: int, keep_tail: bool = False) -> List[str]:
+    # Cuts the end, or with keep_tail the middle: up to a third of the room for the start (whole
+    # lines when the text has several), the rest for the newest text at the end, from a word start.
+    text = "\n".join(body).strip()
+    if len(text) <= chars or text == _PLANCOMPACT_CUT.strip():
+        return body
+    room = max(0, chars - len(_PLANCOMPACT_CUT))
+    if not keep_tail:
+        return [(text[:room].rstrip() + _PLANCOMPACT_CUT).strip(), ""]
+    head = room // 3
+    if "\n" in text:
+        head = max(0, text.rfind("\n", 0, head + 1))
+    tail = text[len(text) - (room - head):]
+    if tail and not text[len(text) - len(tail) - 1].isspace():
+        tail = tail.split(None, 1)[1] if len(tail.split(None, 1)) > 1 else ""
+    return [(text[:head].rstrip() + _PLANCOMPACT_CUT + " " + tail.lstrip()).strip(), ""]
+
+
+def plancompact_plan(plan: str) -> str:
+    """The plan with old history folded, duplicate sections dropped and the token budget met.
+
+    Plans without recognizable sections are only cut to the budget, in the middle so the
+    next step at the end survives. Returns `plan` itself when nothing needed to change.
+    """
+    cfg = _plancompact_cfg
+    budget = cfg["budget_tokens"]
+    tokens_in = plancompact_estimate_tokens(plan)
+    preamble, sections = _plancompact_parse(plan)
+    deduped = _plancompact_dedupe(sections)
+    dropped = len(sections) - len(deduped)
+    keep = cfg["keep_turns"]
+    summary_chars = cfg["summary_chars"]
+    folded = 0
+    out = []
+    for section in deduped:
+        if section[0] == _PLANCOMPACT_HISTORY:
+            section, folded = _plancompact_fold(section, keep, summary_chars)
+        out.append(section)
+    result = _plancompact_render(preamble, out)
+    tokens = plancompact_estimate_tokens(result)
+    # Over budget: shorten the longest unprotected section in proportion to the excess.
+    # For the history that means keeping fewer turns verbatim, then a shorter summary, and
+    # only then cutting into the newest turn; a plan without sections is cut as a whole.
+    for _ in range(32):
+        if not budget or tokens <= budget:
+            break
+        excess = (tokens - budget) * len(result) // max(1, tokens)
+        idx = [i for i, s in enumerate(out)
+               if s[0] not in _PLANCOMPACT_PROTECTED and "\n".join(s[2]).strip() not in ("", _PLANCOMPACT_CUT.strip())]
+        if not out:
+            result = _plancompact_cut([result], len(result) - excess - len(_PLANCOMPACT_CUT), keep_tail=True)[0]
+        elif not idx:
+            break
+        else:
+            # Once the history is down to one turn and no summary, every other section goes first.
+            floor = keep <= 1 and summary_chars <= 0
+            i = max(idx, key=lambda i: (not (floor and out[i][0] == _PLANCOMPACT_HISTORY), len("\n".join(out[i][2]))))
+            title, heading, body, inline = out[i]
+            if title == _PLANCOMPACT_HISTORY and (keep > 1 or summary_chars > 0):
+                if keep > 1:
+                    keep -= 1
+                else:
+                    summary_chars = max(0, min(summary_chars, len(body[0]) if body else 0) - max(excess, 1))
+                out[i], folded = _plancompact_fold(deduped[i], keep, summary_chars)
+            else:
+                size = len("\n".join(body))
+                cut = _plancompact_cut(body, max(0, size - excess - len(_PLANCOMPACT_CUT)), keep_tail=title == _PLANCOMPACT_HISTORY)
+                if cut == body:
+                    break
+                out[i] = (title, heading, cut, inline)
+            result = _plancompact_render(preamble, out)
+        tokens = plancompact_estimate_tokens(result)
+    changed = result != plan.strip()
+    with _plancompact_lock:
+        st = _plancompact_stats
+        st["plans"] += 1
+        st["tokens_in"] += tokens_in
+        st["tokens_out"] += tokens if changed else tokens_in
+        st["compacted"] += int(changed)
+        st["turns_folded"] += folded
+        st["sections_dropped"] += dropped
+        st["over_budget"] += int(bool(budget) and tokens > budget)
+    if not changed:
+        return plan
+    tracelog_info("plan_compaction", {"tokens_in": tokens_in, "tokens_out": tokens, "saved": tokens_in - tokens,
+                                      "turns_folded": folded, "sections_dropped": dropped})
+    return result
+
+
+def plancompact_stats() -> Dict[str, Any]:
+    with _plancompact_lock:
+        st = dict(_plancompact_stats)
+    st["tokens_saved"] = st["tokens_in"] - st["tokens_out"]
+    st["saved_per_plan"] = st["tokens_saved"] / st["plans"] if st["plans"] else 0.0
+    return st
+
+
+def plancompact_reset() -> None:
+    with _plancompact_lock:
+        for k in _plancompact_stats:
+            _plancompact_stats[k] = 0
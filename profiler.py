@@ -0,0 +1,98 @@
+from __future__ import annotations
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# (name, start_ns, dur_ns, thread_id, args)
+_ProfilerEvent = Tuple[str, int, int, int, Optional[Dict[str, Any]]]
+
+_profiler_enabled = False
+_profiler_events: List[_ProfilerEvent] = []
+_profiler_t0 = time.perf_counter_ns()
+_PROFILER_NULL = nullcontext()
+
+
+def profiler_enable(enabled: bool = True) -> None:
+    global _profiler_enabled
+    _profiler_enabled = enabled
+
+
+def profiler_enabled() -> bool:
+    return _profiler_enabled
+
+
+def profiler_reset() -> None:
+    global _profiler_t0
+    _profiler_events.clear()
+    _profiler_t0 = time.perf_counter_ns()
+
+
+@contextmanager
+def _profiler_record(name: str, args: Optional[Dict[str, Any]]) -> Iterator[None]:
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        _profiler_events.append((name, start, time.perf_counter_ns() - start, threading.get_ident(), args))
+
+
+def profiler_span(name: str, args: Optional[Dict[str, Any]] = None) -> Any:
+    """Context manager timing one phase. Costs a single flag check when profiling is off."""
+    if not _profiler_enabled:
+        return _PROFILER_NULL
+    return _profiler_record(name, args)
+
+
+def profiler_sleep(name: str, seconds: float) -> None:
+    with profiler_span(name, {"requested_s": seconds} if _profiler_enabled else None):
+        time.sleep(seconds)
+
+
+def profiler_export_chrome(path: str) -> None:
+    """Write the recorded spans as Chrome trace JSON (chrome://tracing, ui.perfetto.dev)."""
+    pid = os.getpid()
+    tids: Dict[int, int] = {}
+    events: List[Dict[str, Any]] = []
+    for name, start, dur, tid, args in list(_profiler_events):
+        ev: Dict[str, Any] = {"name": name, "ph": "X", "pid": pid, "tid": tids.setdefault(tid, len(tids)),
+                              "ts": (start - _profiler_t0) / 1000.0, "dur": dur / 1000.0}
+        if args:
+            ev["args"] = args
+        events.append(ev)
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+def profiler_percentile(sorted_ms: List[float], q: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    k = (len(sorted_ms) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_ms) - 1)
+    return sorted_ms[lo] + (sorted_ms[hi] - sorted_ms[lo]) * (k - lo)
+
+
+def profiler_stats() -> Dict[str, Dict[str, float]]:
+    by_name: Dict[str, List[float]] = {}
+    for name, _, dur, _, _ in list(_profiler_events):
+        by_name.setdefault(name, []).append(dur / 1e6)
+    out = {}
+    for name, vals in by_name.items():
+        vals.sort()
+        out[name] = {"count": len(vals), "total_ms": sum(vals), "p50_ms": profiler_percentile(vals, 0.5),
+                     "p95_ms": profiler_percentile(vals, 0.95), "max_ms": vals[-1]}
+    return out
+
+
+def profiler_summary() -> str:
+    stats = profiler_stats()
+    lines = [f"{'phase':<24} {'count':>6} {'total ms':>11} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+    for name, s in sorted(stats.items(), key=lambda kv: -kv[1]["total_ms"]):
+        lines.append(f"{name:<24} {s['count']:>6} {s['total_ms']:>11.1f} {s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} {s['max_ms']:>9.1f}")
+    return "\n".join(lines)
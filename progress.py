@@ -0,0 +1,258 @@
+from __future__ import annotations
+import argparse
+import json
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from session import session_read_index
+from tracelog import tracelog_info, tracelog_warn
+from trajcache import trajcache_grid_match, trajcache_snapshot
+from utils import utils_box_center, utils_parse_args, utils_parse_box
+
+PROGRESS_MODES = ("off", "note", "abort")
+
+# Tools that act on the screen; observe_screen and zoom_region only look at it.
+_PROGRESS_ACTIONS = ("click_element", "type_text", "press_key", "scroll_at_position", "perform_actions")
+# Click and scroll targets within this many normalized units (of 1000) are the same spot.
+_PROGRESS_POINT_QUANTUM = 20
+# Live screen states are trajcache grids; a pointer that moved to a new spot changes a
+# few cells, which must not count as progress.
+_PROGRESS_TOL = 16
+_PROGRESS_CURSOR_CELLS = 4
+_PROGRESS_HISTORY = 8
+
+_progress_cfg: Dict[str, Any] = {"mode": "off", "noop_limit": 2, "plan_repeats": 3, "max_notes": 2}
+_progress_lock = threading.Lock()
+_progress_run: Dict[str, Any] = {"monitor": None, "notes": 0, "findings": [], "stopped": None}
+
+
+def _progress_point(box: Any) -> Optional[Tuple[int, int]]:
+    b, err = utils_parse_box(box)
+    if err or b is None:
+        return None
+    x, y = utils_box_center(*b)
+    return int(x // _PROGRESS_POINT_QUANTUM), int(y // _PROGRESS_POINT_QUANTUM)
+
+
+def progress_signature(name: str, args: Optional[Dict[str, Any]]) -> str:
+    """What an action does, with labels and plans left out and targets snapped to a coarse grid."""
+    args = args or {}
+    if name == "perform_actions":
+        steps = args.get("steps") if isinstance(args.get("steps"), list) else []
+        return name + "[" + ";".join(progress_signature(str(s.get("action", "")), s) for s in steps if isinstance(s, dict)) + "]"
+    if name in ("click_element", "scroll_at_position"):
+        return f"{name}@{_progress_point(args.get('box', [500, 500]))}"
+    if name == "type_text":
+        return f"{name}:{args.get('text', '')!r}"
+    if name == "press_key":
+        return f"{name}:{str(args.get('key', '')).strip().lower()}"
+    if name == "zoom_region":
+        return f"{name}@{args.get('box')}"
+    return name
+
+
+def _progress_plan(args: Optional[Dict[str, Any]]) -> str:
+    return " ".join(str((args or {}).get("plan", "")).split())
+
+
+class ProgressMonitor:
+    """Spots a run that has stopped making progress, from the actions taken and the screen after each.
+
+    Three patterns are reported: `noop_limit` consecutive actions that left the screen as
+    it was, an A-B-A oscillation (the same action twice around another one, landing on
+    the same screen both times), and `plan_repeats` identical observe_screen plans in a row.
+    `same(a, b)` compares two screen states; a state of None is unknown.
+    """
+
+    def __init__(self, same: Callable[[Any, Any], bool], noop_limit: int = 2, plan_repeats: int = 3) -> None:
+        self.same = same
+        self.noop_limit = noop_limit
+        self.plan_repeats = plan_repeats
+        self.step = 0
+        self.state: Any = None
+        self.noops: List[str] = []
+        self.actions: Deque[Tuple[str, Any]] = deque(maxlen=_PROGRESS_HISTORY)
+        self.plans: Deque[str] = deque(maxlen=max(1, plan_repeats))
+
+    def clear(self) -> None:
+        """Forget the patterns seen so far, e.g. after the model has been told about one."""
+        self.noops.clear()
+        self.actions.clear()
+        self.plans.clear()
+
+    def observe(self, name: str, args: Optional[Dict[str, Any]], state: Any) -> Optional[Dict[str, Any]]:
+        """Account for one step: the tool that ran, its arguments and the screen state after it."""
+        self.step += 1
+        before, self.state = self.state, state if state is not None else self.state
+        if name == "observe_screen":
+            plan = _progress_plan(args)
+            if plan:
+                self.plans.append(plan)
+                if self.plan_repeats > 0 and len(self.plans) >= self.plan_repeats and len(set(self.plans)) == 1:
+                    return self._finding("repeated_plan", f"the last {self.plan_repeats} observe_screen plans were identical")
+            return None
+        if name not in _PROGRESS_ACTIONS:
+            return None
+        sig = progress_signature(name, args)
+        if state is not None and before is not None and self.same(before, state):
+            self.noops.append(sig)
+            if self.noop_limit > 0 and len(self.noops) >= self.noop_limit:
+                actions = ", ".join(dict.fromkeys(self.noops))
+                return self._finding("no_op", f"the last {len(self.noops)} actions left the screen unchanged ({actions})")
+        elif state is not None:
+            self.noops.clear()
+        self.actions.append((sig, state))
+        if len(self.actions) >= 3:
+            (a1, s1), (b, _), (a2, s2) = list(self.actions)[-3:]
+            if a1 == a2 and a1 != b and s1 is not None and s2 is not None and self.same(s1, s2):
+                return self._finding("oscillation", f"alternating between {a1} and {b} keeps returning to the same screen")
+        return None
+
+    def _finding(self, kind: str, detail: str) -> Dict[str, Any]:
+        return {"kind": kind, "step": self.step, "detail": detail}
+
+
+def progress_configure(mode: str = "off", noop_limit: int = 2, plan_repeats: int = 3, max_notes: int = 2) -> None:
+    """Watch runs for stalls and loops.
+
+    Mode "note" tells the model about a stall in its next user message and stops the run
+    at the first stall after `max_notes` notes; "abort" stops it at the first stall.
+    """
+    if mode not in PROGRESS_MODES:
+        raise ValueError(f"progress mode must be one of {', '.join(PROGRESS_MODES)}")
+    _progress_cfg.update({"mode": mode, "noop_limit": max(0, noop_limit), "plan_repeats": max(0, plan_repeats),
+                          "max_notes": max(0, max_notes)})
+
+
+def progress_enabled() -> bool:
+    return _progress_cfg["mode"] != "off"
+
+
+def _progress_same_grid(a: bytes, b: bytes) -> bool:
+    return trajcache_grid_match(a, b, _PROGRESS_TOL, _PROGRESS_CURSOR_CELLS)
+
+
+def progress_begin() -> None:
+    with _progress_lock:
+        _progress_run.update({"monitor": ProgressMonitor(_progress_same_grid, _progress_cfg["noop_limit"], _progress_cfg["plan_repeats"]),
+                              "notes": 0, "findings": [], "stopped": None})
+
+
+def progress_snapshot() -> bytes:
+    """Screen state for progress_step; the same grid the trajectory cache keys on."""
+    return trajcache_snapshot()
+
+
+def progress_step(name: str, arg_str: Any, post_grid: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    """Feed one executed step to the run's monitor.
+
+    Returns None while the run progresses, else the finding with "action" set to "note"
+    (and the "note" text for the model) or "abort".
+    """
+    args, _ = utils_parse_args(arg_str)
+    with _progress_lock:
+        monitor = _progress_run["monitor"]
+        if monitor is None or not progress_enabled():
+            return None
+        finding = monitor.observe(name, args, post_grid)
+        if finding is None:
+            return None
+        monitor.clear()
+        _progress_run["findings"].append(finding)
+        if _progress_cfg["mode"] == "note" and _progress_run["notes"] < _progress_cfg["max_notes"]:
+            _progress_run["notes"] += 1
+            finding = dict(finding, action="note", note=_progress_note(finding))
+            tracelog_info("progress_note", finding)
+            return finding
+        finding = dict(finding, action="abort")
+        _progress_run["stopped"] = finding
+    tracelog_warn("progress_abort", finding)
+    return finding
+
+
+def _progress_note(finding: Dict[str, Any]) -> str:
+    advice = {"no_op": "Repeating them will not help: target a different element, use the keyboard instead, or re-read the screen.",
+              "oscillation": "You are going in circles: stop undoing your own actions and choose a different approach.",
+              "repeated_plan": "Your plan is not advancing: revise it based on what the screen actually shows."}
+    return f"PROGRESS CHECK: {finding['detail']}. {advice[finding['kind']]}"
+
+
+def progress_stop_message(finding: Dict[str, Any]) -> str:
+    return f"STOPPED EARLY ({finding['kind']} at step {finding['step']}): {finding['detail']}."
+
+
+def progress_report() -> Dict[str, Any]:
+    """The last run: findings, notes given and the finding that stopped it (None if none did)."""
+    with _progress_lock:
+        monitor = _progress_run["monitor"]
+        return {"mode": _progress_cfg["mode"], "steps": monitor.step if monitor is not None else 0,
+                "notes": _progress_run["notes"], "findings": list(_progress_run["findings"]), "stopped": _progress_run["stopped"]}
+
+
+def progress_analyze(path: str, noop_limit: int = 2, plan_repeats: int = 3) -> Dict[str, Any]:
+    """Where the abort policy would have stopped a recorded session, and the steps and time that saves.
+
+    Screen states are the digests of recorded observations: the state after an action is
+    the frame of the observe_screen right after it (unknown if another tool came first). Time saved is the recorded model and tool time of
+    the steps after the stop; settle and step delays are not in the recording.
+    """
+    events = session_read_index(path)
+    frames: Dict[int, str] = {}
+    tools: List[Dict[str, Any]] = []
+    step_s: Dict[int, float] = {}
+    end: Dict[str, Any] = {}
+    for ev in events[1:]:
+        kind = ev.get("kind")
+        if kind == "frame":
+            frames.setdefault(ev["step"], ev["digest"])
+        elif kind == "tool":
+            tools.append(ev)
+        elif kind == "end":
+            end = ev
+        if kind in ("model", "tool"):
+            step_s[ev["step"]] = step_s.get(ev["step"], 0.0) + ev.get("elapsed_s", 0.0)
+    steps = max(step_s) if step_s else 0
+    monitor = ProgressMonitor(lambda a, b: a == b, noop_limit, plan_repeats)
+    findings = []
+    for i, ev in enumerate(tools):
+        shown = tools[i + 1] if ev["name"] in _PROGRESS_ACTIONS and i + 1 < len(tools) else ev
+        state = frames.get(shown["step"]) if shown["name"] == "observe_screen" else None
+        args, _ = utils_parse_args(ev.get("arguments"))
+        finding = monitor.observe(ev["name"], args, state)
+        if finding is not None:
+            findings.append(dict(finding, step=ev["step"]))
+            monitor.clear()
+    stopped = findings[0] if findings else None
+    cut = stopped["step"] if stopped else steps
+    return {"session": path, "task": events[0].get("task", ""), "final": end.get("final", ""), "steps": steps,
+            "wall_s": round(sum(step_s.values()), 3), "stopped": stopped, "findings": findings,
+            "steps_saved": steps - cut, "wall_saved_s": round(sum(t for s, t in step_s.items() if s > cut), 3)}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Steps and wall-clock the stall/loop abort would have saved on recorded sessions")
+    ap.add_argument("sessions", nargs="+", help="session directories recorded with AGENT_RECORD_DIR")
+    ap.add_argument("--noop-limit", type=int, default=2)
+    ap.add_argument("--plan-repeats", type=int, default=3)
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+
+    reports = [progress_analyze(p, args.noop_limit, args.plan_repeats) for p in args.sessions]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+    print(f"{'session':<32} {'steps':>5} {'stop@':>5} {'saved':>5} {'wall s':>8} {'saved s':>8}  reason")
+    for r in reports:
+        stop = r["stopped"]
+        print(f"{r['session'][-32:]:<32} {r['steps']:>5} {stop['step'] if stop else '-':>5} {r['steps_saved']:>5} "
+              f"{r['wall_s']:>8.2f} {r['wall_saved_s']:>8.2f}  {stop['kind'] + ': ' + stop['detail'] if stop else ''}")
+    total_steps = sum(r["steps"] for r in reports)
+    saved_steps = sum(r["steps_saved"] for r in reports)
+    total_s = sum(r["wall_s"] for r in reports)
+    saved_s = sum(r["wall_saved_s"] for r in reports)
+    print(f"total: {saved_steps}/{total_steps} steps ({saved_steps / max(1, total_steps):.0%}), "
+          f"{saved_s:.2f}/{total_s:.2f} s ({saved_s / total_s if total_s else 0.0:.0%}) saved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+from __future__ import annotations
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+from profiler import profiler_percentile
+from tracelog import tracelog_info, tracelog_warn
+from transport import TransportCancel, TransportHTTPError
+
+T = TypeVar("T")
+
+# An attempt is `fn(url, cancel)`; the cancel token is None when nothing can race it.
+Attempt = Callable[[str, Optional[TransportCancel]], T]
+
+# Below this many samples an endpoint's p95 means little; hedging then waits hedge_cold_s.
+_ROUTER_MIN_SAMPLES = 5
+_ROUTER_WINDOW = 64
+
+_router_cfg: Dict[str, Any] = {"hedge": False, "hedge_quantile": 0.95, "hedge_min_s": 0.5, "hedge_cold_s": 30.0,
+                               "alpha": 0.3, "fail_threshold": 2, "cooldown_s": 30.0}
+_router_lock = threading.Lock()
+
+
+class RouterNoRetry(Exception):
+    """Raised by an attempt that failed after acting on partial output; the endpoint is
+    still charged with the failure, but the request is not repeated elsewhere."""
+
+
+class RouterEndpoint:
+    """Latency and health bookkeeping for one inference server."""
+
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.ewma_s: Optional[float] = None
+        self.in_flight = 0
+        self.latencies: Deque[float] = deque(maxlen=_ROUTER_WINDOW)
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.counts = {"requests": 0, "ok": 0, "failures": 0, "hedges": 0, "wins": 0, "cancelled": 0,
+                       "marked_unhealthy": 0}
+
+    def healthy(self, now: float) -> bool:
+        return self.unhealthy_until <= now
+
+    def score(self) -> Tuple[float, int]:
+        # Expected wait if queued behind what is already running there. An endpoint that
+        # has never answered scores 0, so every server gets tried once early on.
+        return (self.ewma_s or 0.0) * (self.in_flight + 1), self.in_flight
+
+
+_router_endpoints: List[RouterEndpoint] = []
+
+
+def router_configure(endpoints: List[str], hedge: bool = False, hedge_quantile: float = 0.95, hedge_min_s: float = 0.5,
+                     hedge_cold_s: float = 30.0, alpha: float = 0.3, fail_threshold: int = 2, cooldown_s: float = 30.0) -> None:
+    """Route model requests over `endpoints`; an empty list turns routing off.
+
+    With `hedge`, a request still running after the primary endpoint's `hedge_quantile`
+    latency (at least hedge_min_s; hedge_cold_s until enough samples exist) is duplicated
+    to the next best endpoint, and whichever answers first wins. `fail_threshold`
+    consecutive failures take an endpoint out of rotation for `cooldown_s`.
+    """
+    urls = list(dict.fromkeys(u.strip() for u in endpoints if u and u.strip()))
+    with _router_lock:
+        _router_cfg.update({"hedge": bool(hedge), "hedge_quantile": min(0.999, max(0.5, hedge_quantile)),
+                            "hedge_min_s": max(0.0, hedge_min_s), "hedge_cold_s": max(0.0, hedge_cold_s),
+                            "alpha": min(1.0, max(0.01, alpha)), "fail_threshold": max(1, fail_threshold),
+                            "cooldown_s": max(0.0, cooldown_s)})
+        _router_endpoints[:] = [RouterEndpoint(u) for u in urls]
+
+
+def router_endpoints() -> List[str]:
+    with _router_lock:
+        return [ep.url for ep in _router_endpoints]
+
+
+def _router_pick(exclude: List[RouterEndpoint], healthy_only: bool = False) -> Optional[RouterEndpoint]:
+    now = time.monotonic()
+    with _router_lock:
+        candidates = [ep for ep in _router_endpoints if ep not in exclude]
+        healthy = [ep for ep in candidates if ep.healthy(now)]
+        if healthy:
+            return min(healthy, key=RouterEndpoint.score)
+        if healthy_only:
+            return None
+        # Everything is cooling down: try the one that has been out the longest.
+        return min(candidates, key=lambda ep: ep.unhealthy_until) if candidates else None
+
+
+def _router_hedge_delay(ep: RouterEndpoint) -> float:
+    with _router_lock:
+        samples = sorted(ep.latencies)
+    if len(samples) < _ROUTER_MIN_SAMPLES:
+        return _router_cfg["hedge_cold_s"]
+    return max(_router_cfg["hedge_min_s"], profiler_percentile(samples, _router_cfg["hedge_quantile"]))
+
+
+def _router_fault(err: BaseException) -> bool:
+    # A 4xx means the request itself is bad; another server would reject it too.
+    cause = err.__cause__ if isinstance(err, RouterNoRetry) and err.__cause__ is not None else err
+    return not (isinstance(cause, TransportHTTPError) and cause.status < 500)
+
+
+def _router_retryable(err: BaseException) -> bool:
+    return _router_fault(err) and not isinstance(err, RouterNoRetry)
+
+
+def _router_attempt(ep: RouterEndpoint, fn: Attempt, cancel: Optional[TransportCancel]) -> Tuple[Any, Optional[BaseException]]:
+    with _router_lock:
+        ep.in_flight += 1
+        ep.counts["requests"] += 1
+    t0 = time.perf_counter()
+    result: Any = None
+    err: Optional[BaseException] = None
+    try:
+        result = fn(ep.url, cancel)
+    except Exception as e:
+        err = e
+    elapsed = time.perf_counter() - t0
+    with _router_lock:
+        ep.in_flight -= 1
+        if cancel is not None and cancel.cancelled:
+            ep.counts["cancelled"] += 1
+        elif err is None:
+            ep.counts["ok"] += 1
+            ep.consecutive_failures = 0
+            ep.unhealthy_until = 0.0
+            ep.latencies.append(elapsed)
+            a = _router_cfg["alpha"]
+            ep.ewma_s = elapsed if ep.ewma_s is None else a * elapsed + (1.0 - a) * ep.ewma_s
+        elif _router_fault(err):
+            ep.counts["failures"] += 1
+            ep.consecutive_failures += 1
+            if ep.consecutive_failures >= _router_cfg["fail_threshold"] and ep.healthy(time.monotonic()):
+                ep.unhealthy_until = time.monotonic() + _router_cfg["cooldown_s"]
+                ep.counts["marked_unhealthy"] += 1
+                tracelog_warn("router_unhealthy", {"endpoint": ep.url, "failures": ep.consecutive_failures,
+                                                   "error": str(err)})
+    return result, err
+
+
+def _router_failover(fn: Attempt, first: RouterEndpoint) -> Any:
+    tried = [first]
+    ep: Optional[RouterEndpoint] = first
+    while True:
+        result, err = _router_attempt(ep, fn, None)
+        if err is None:
+            with _router_lock:
+                ep.counts["wins"] += 1
+            return result
+        if not _router_retryable(err):
+            raise err
+        ep = _router_pick(tried)
+        if ep is None:
+            raise err
+        tracelog_info("router_failover", {"from": tried[-1].url, "to": ep.url, "error": str(err)})
+        tried.append(ep)
+
+
+def _router_hedged(fn: Attempt, first: RouterEndpoint) -> Any:
+    done: "queue.Queue[Tuple[RouterEndpoint, Any, Optional[BaseException]]]" = queue.Queue()
+    running: Dict[RouterEndpoint, TransportCancel] = {}
+    tried: List[RouterEndpoint] = []
+
+    def launch(ep: RouterEndpoint) -> None:
+        cancel = TransportCancel()
+        running[ep] = cancel
+        tried.append(ep)
+        threading.Thread(target=lambda: done.put((ep, *_router_attempt(ep, fn, cancel))),
+                         name="router-attempt", daemon=True).start()
+
+    hedge_at: Optional[float] = time.perf_counter() + _router_hedge_delay(first)
+    launch(first)
+    try:
+        while True:
+            wait = None if hedge_at is None else max(0.0, hedge_at - time.perf_counter())
+            try:
+                ep, result, err = done.get(timeout=wait)
+            except queue.Empty:
+                hedge_at = None
+                # Failover may retry a server that is cooling down; a hedge only adds load, so it does not.
+                backup = _router_pick(tried, healthy_only=True)
+                if backup is not None:
+                    with _router_lock:
+                        backup.counts["hedges"] += 1
+                    tracelog_info("router_hedge", {"primary": tried[0].url, "backup": backup.url})
+                    launch(backup)
+                continue
+            running.pop(ep)
+            if err is None:
+                with _router_lock:
+                    ep.counts["wins"] += 1
+                return result
+            if not _router_retryable(err):
+                raise err
+            if running:
+                continue
+            # Nothing left in the race: fail over to an untried endpoint, hedging no further.
+            hedge_at = None
+            nxt = _router_pick(tried)
+            if nxt is None:
+                raise err
+            tracelog_info("router_failover", {"from": ep.url, "to": nxt.url, "error": str(err)})
+            launch(nxt)
+    finally:
+        for cancel in running.values():
+            cancel.cancel()
+
+
+def router_call(fn: Attempt, default: str, hedge: bool = True) -> Any:
+    """Run `fn(url, cancel)` against the best endpoint, or `default` when routing is off.
+
+    Failed attempts (connection errors, 5xx) fail over to the next endpoint. Pass
+    hedge=False for requests with side effects while in flight, such as streamed
+    replies whose tool calls start executing before the reply ends.
+    """
+    first = _router_pick([])
+    if first is None:
+        return fn(default, None)
+    if hedge and _router_cfg["hedge"] and len(_router_endpoints) > 1:
+        return _router_hedged(fn, first)
+    return _router_failover(fn, first)
+
+
+def router_stats() -> Dict[str, Dict[str, Any]]:
+    now = time.monotonic()
+    out = {}
+    with _router_lock:
+        for ep in _router_endpoints:
+            samples = sorted(ep.latencies)
+            out[ep.url] = dict(ep.counts, healthy=ep.healthy(now), in_flight=ep.in_flight,
+                               ewma_ms=None if ep.ewma_s is None else round(ep.ewma_s * 1000.0, 1),
+                               p95_ms=round(profiler_percentile(samples, 0.95) * 1000.0, 1) if samples else None)
+    return out
+
+
+def router_reset() -> None:
+    with _router_lock:
+        _router_endpoints[:] = [RouterEndpoint(ep.url) for ep in _router_endpoints]
@@ -1,11 +1,15 @@
 from __future__ import annotations
-import base64
 import json
 import os
-import time
-from typing import Any, Dict, List, Optional, Tuple
-from winapi import winapi_capture_screenshot_png, winapi_norm_to_screen_px, winapi_move_mouse_to_pixel, winapi_click_mouse, winapi_type_text, winapi_press_key, winapi_scroll_down
-from utils import utils_ok_payload, utils_err_payload, utils_parse_args, utils_parse_box, utils_box_center
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from desktop import desktop_capture_frame, desktop_screen_size, desktop_move_mouse_to_pixel, desktop_click_mouse, desktop_type_text, desktop_press_key, desktop_scroll_down
+from body import ImageRef
+from encoders import encoders_decode_png_rgb, encoders_encode
+from framecache import FrameEntry, framecache_diff, framecache_dump
+from plancompact import plancompact_enabled, plancompact_plan
+from profiler import profiler_span
+from settle import settle_after, settle_probe
+from utils import utils_ok_payload, utils_err_payload, utils_parse_args, utils_parse_box, utils_box_center, utils_norm_to_screen_px, utils_norm_box_to_screen_rect, utils_screen_px_to_norm
 
 SYSTEM_PROMPT = """
 You are a desktop automation agent. You have no memory between turns.
@@ -22,13 +26,15 @@ HOW YOU OPERATE (every turn):
 1. Look at the screenshot carefully
 2. Read the plan from your previous self (if provided)
 3. Check if the last action worked: does the screen match what the plan expected?
-4. Take ONE action toward the goal (click, type, press key, scroll, or observe)
-5. Call observe_screen with a detailed plan for your next self
+4. Take ONE action toward the goal (click, type, press key, scroll, perform_actions, or observe)
+5. Call observe_screen with a detailed plan for your next self (or zoom_region if you need a close-up)
 
 ACTION RULES:
 - Execute only ONE action per turn
-- After every action, call observe_screen
-- Use observe_screen as your only way to send information forward
+- Exception: for a short routine sequence whose outcome you can predict (e.g. click a search box, type the query, press Enter), call perform_actions once with all the steps
+- After every action (or perform_actions call), call observe_screen
+- Use observe_screen (or zoom_region) as your only way to send information forward
+- If text or small UI elements are too small to read, call zoom_region with a box around them instead of observe_screen
 - Do not write plans or reports as text responses
 
 COORDINATES:
@@ -117,6 +123,35 @@ TOOLS_SCHEMA = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "zoom_region",
+            "description": (
+                "Captures only a region of the screen at full native resolution, for reading small text or UI details, "
+                "and transmits your plan to the next agent instance exactly like observe_screen. "
+                "Give the region as box=[x1,y1,x2,y2] in the normalized 0-1000 screen coordinate system. "
+                "Coordinates for click_element stay in full-screen 0-1000 units; the result explains how the zoomed image maps back."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "box": {
+                        "description": "Region to zoom into, in 0-1000 normalized screen coordinates. Format: [x1,y1,x2,y2]",
+                        "type": "array",
+                        "items": {"type": "number"},
+                        "minItems": 4,
+                        "maxItems": 4
+                    },
+                    "plan": {
+                        "type": "string",
+                        "description": "Your complete message to the next agent instance, structured as for observe_screen."
+                    }
+                },
+                "required": ["box", "plan"]
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -175,15 +210,15 @@ TOOLS_SCHEMA = [
             "description": (
                 "Types text into the currently focused input field. "
                 "PREREQUISITE: You must click the input field FIRST to focus it. "
-                "Only ASCII characters are supported. "
-                "This function types text only - it does not press Enter (use press_key for that)."
+                "Any Unicode text is supported. "
+                "Line breaks in the text press Enter; otherwise it types text only (use press_key for other keys)."
             ),
             "parameters": {
                 "type": "object",
                 "properties": {
                     "text": {
                         "type": "string",
-                        "description": "Text to type (ASCII characters only)"
+                        "description": "Text to type"
                     }
                 },
                 "required": ["text"]
@@ -258,10 +293,266 @@ TOOLS_SCHEMA = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "perform_actions",
+            "description": (
+                "Runs a short ordered list of actions in one turn, for routine sequences such as click a field, type text, press Enter. "
+                "Each step is an object with 'action' set to click_element, type_text, press_key or scroll_at_position, "
+                "plus that tool's own parameters (label/box, text, key, box). "
+                "The screen is allowed to settle after each step unless the step sets settle=false. "
+                "Execution stops at the first failing step; the result lists what happened to every step that ran. "
+                "After this call, always call observe_screen to verify the result."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "steps": {
+                        "type": "array",
+                        "minItems": 1,
+                        "maxItems": 10,
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "action": {
+                                    "type": "string",
+                                    "enum": ["click_element", "type_text", "press_key", "scroll_at_position"]
+                                },
+                                "label": {"type": "string", "description": "click_element: brief description of the target"},
+                                "box": {
+                                    "type": "array",
+                                    "items": {"type": "number"},
+                                    "description": "click_element/scroll_at_position: [x,y] or [x1,y1,x2,y2] in 0-1000 coordinates"
+                                },
+                                "text": {"type": "string", "description": "type_text: text to type"},
+                                "key": {"type": "string", "description": "press_key: key or combination, e.g. 'enter', 'ctrl+l'"},
+                                "settle": {"type": "boolean", "description": "Wait for the screen to settle after this step (default true)"}
+                            },
+                            "required": ["action"]
+                        }
+                    }
+                },
+                "required": ["steps"]
+            }
+        }
+    },
 ]
 
 _scenarios_screen_dimensions = {"width": 1920, "height": 1080}
 
+# "Screen unchanged" prompt mode (AGENT_UNCHANGED_MODE). When the new frame is within
+# AGENT_UNCHANGED_THRESHOLD percent of the last frame the model was shown (0 means
+# pixel-identical), the observation carries a short note instead of a fresh full image:
+#   text - note only
+#   ref  - note plus the previously sent image (byte-identical, so prefix caches can reuse it)
+#   crop - note plus a PNG crop of the changed region, if anything changed at all
+SCENARIOS_UNCHANGED_MODES = ("off", "text", "ref", "crop")
+
+# zoom_region never captures less than this many screen pixels a side.
+_SCENARIOS_ZOOM_MIN_PX = 64
+
+_scenarios_unchanged_stats: Dict[str, int] = {"observations": 0, "unchanged": 0, "crops": 0,
+                                              "full_requests": 0, "full_prompt_tokens": 0,
+                                              "note_requests": 0, "note_prompt_tokens": 0}
+
+
+def scenarios_record_usage(observation: str, usage: Optional[Dict[str, Any]]) -> None:
+    """Attribute a response's prompt tokens to the kind of observation its request carried ("full" or "note")."""
+    if observation not in ("full", "note") or not usage or usage.get("prompt_tokens") is None:
+        return
+    _scenarios_unchanged_stats[observation + "_requests"] += 1
+    _scenarios_unchanged_stats[observation + "_prompt_tokens"] += int(usage["prompt_tokens"])
+
+
+def scenarios_unchanged_stats() -> Dict[str, Any]:
+    out: Dict[str, Any] = dict(_scenarios_unchanged_stats)
+    full_avg = out["full_prompt_tokens"] / out["full_requests"] if out["full_requests"] else 0.0
+    out["prompt_tokens_saved"] = int(max(0.0, full_avg * out["note_requests"] - out["note_prompt_tokens"]))
+    return out
+
+
+def _scenarios_crop_part(frame: FrameEntry, box: Tuple[int, int, int, int], encoder: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    rgb, w, _ = encoders_decode_png_rgb(frame.png)
+    x0, y0, x1, y1 = box
+    stride = w * 3
+    crop = b"".join(rgb[y * stride + x0 * 3:y * stride + x1 * 3] for y in range(y0, y1))
+    return {"type": "image_url", "image_url": {"url": ImageRef(encoders_encode(crop, x1 - x0, y1 - y0, encoder))}}
+
+
+def _scenarios_unchanged_parts(frame: FrameEntry, dump_cfg: Dict[str, Any]) -> Optional[Tuple[List[Dict[str, Any]], float]]:
+    """Content parts standing in for the full image, or None when a full image must be sent."""
+    mode = dump_cfg.get("unchanged_mode") or "off"
+    last = dump_cfg.get("last_seen")
+    if mode == "off" or last is None:
+        return None
+    threshold = dump_cfg.get("unchanged_threshold", 0.0)
+    if threshold <= 0.0 and last.key != frame.key:
+        return None
+    diff, box = framecache_diff(last, frame)
+    if diff * 100.0 > threshold:
+        return None
+    note = f"Screen unchanged since last observation, diff={diff * 100.0:.1f}%."
+    parts: List[Dict[str, Any]] = []
+    if mode == "ref":
+        note += " The last screenshot is repeated below."
+        parts.append({"type": "image_url", "image_url": {"url": last.image}})
+    elif mode == "crop" and box is not None:
+        x0, y0, x1, y1 = box
+        note += (f" Only this region changed; crop below covers ({x0 * 1000 // frame.width}, {y0 * 1000 // frame.height})"
+                 f" to ({x1 * 1000 // frame.width}, {y1 * 1000 // frame.height}) in 0-1000 screen coordinates.")
+        with profiler_span("diff_crop"):
+            parts.append(_scenarios_crop_part(frame, box, dump_cfg.get("image_encoder")))
+        _scenarios_unchanged_stats["crops"] += 1
+    else:
+        note += " Rely on the previous plan's description of the screen."
+    return [{"type": "text", "text": note}] + parts, diff
+
+
+def _scenarios_dump_task(frame: FrameEntry, fn: str, reused: bool) -> str:
+    with profiler_span("dump_write"):
+        return framecache_dump(frame, fn, reused)
+
+
+def _scenarios_write_dump(frame: FrameEntry, fn: str, reused: bool, dump_cfg: Dict[str, Any]) -> str:
+    """Write the frame dump inline, or hand it to dump_cfg["dump_writer"] (a FIFO submit) and return at once.
+
+    Queued writes report the .png name even if the file later falls back to a .ref entry;
+    a queued write that fails is logged and fails the run at its end (see agent.py).
+    """
+    writer = dump_cfg.get("dump_writer")
+    if writer is None:
+        return _scenarios_dump_task(frame, fn, reused)
+    writer(_scenarios_dump_task, frame, fn, reused)
+    return fn
+
+
+def _scenarios_click(args: Dict[str, Any], settle: bool) -> str:
+    label = str(args.get("label", "")).strip()
+    box = args.get("box")
+    if not label:
+        return utils_err_payload("missing_label", "label required")
+    if box is None:
+        return utils_err_payload("missing_box", "box required")
+    bbox, box_err = utils_parse_box(box)
+    if box_err:
+        return box_err
+    x1, y1, x2, y2 = bbox
+    cx, cy = utils_box_center(x1, y1, x2, y2)
+    px, py = utils_norm_to_screen_px(cx, cy, _scenarios_screen_dimensions["width"], _scenarios_screen_dimensions["height"])
+    desktop_move_mouse_to_pixel(px, py)
+    settle_after("click_move", 0.08)
+    before = settle_probe() if settle else None
+    desktop_click_mouse()
+    if settle:
+        settle_after("click", 0.12, before)
+    return utils_ok_payload({"action": "click_executed"})
+
+
+def _scenarios_type(args: Dict[str, Any], settle: bool) -> str:
+    text = str(args.get("text", ""))
+    if not text:
+        return utils_err_payload("empty_text", "text empty")
+    before = settle_probe() if settle else None
+    with profiler_span("type_text", {"chars": len(text)}):
+        desktop_type_text(text)
+    if settle:
+        settle_after("type", 0.08, before)
+    return utils_ok_payload({"action": "text_typed"})
+
+
+def _scenarios_key(args: Dict[str, Any], settle: bool) -> str:
+    key = str(args.get("key", "")).strip().lower()
+    if not key:
+        return utils_err_payload("missing_key", "key required")
+    before = settle_probe() if settle else None
+    try:
+        desktop_press_key(key)
+    except ValueError as e:
+        return utils_err_payload("invalid_key", str(e))
+    if settle:
+        settle_after("key", 0.08, before)
+    return utils_ok_payload({"action": "key_pressed"})
+
+
+def _scenarios_scroll(args: Dict[str, Any], settle: bool) -> str:
+    box = args.get("box")
+    if box is not None:
+        bbox, box_err = utils_parse_box(box)
+        if box_err:
+            return box_err
+        cx, cy = utils_box_center(*bbox)
+    else:
+        cx, cy = 500.0, 500.0
+    px, py = utils_norm_to_screen_px(cx, cy, _scenarios_screen_dimensions["width"], _scenarios_screen_dimensions["height"])
+    desktop_move_mouse_to_pixel(px, py)
+    settle_after("scroll_move", 0.06)
+    before = settle_probe() if settle else None
+    desktop_scroll_down()
+    if settle:
+        settle_after("scroll", 0.08, before)
+    return utils_ok_payload({"action": "scrolled_down"})
+
+
+# Single-action tools. Each handler takes the parsed arguments and whether to wait for
+# the screen to settle afterwards, and returns the tool message content.
+_SCENARIOS_ACTIONS: Dict[str, Callable[[Dict[str, Any], bool], str]] = {
+    "click_element": _scenarios_click,
+    "type_text": _scenarios_type,
+    "press_key": _scenarios_key,
+    "scroll_at_position": _scenarios_scroll,
+}
+
+_SCENARIOS_MAX_STEPS = 10
+
+
+def _scenarios_settle_flag(value: Any) -> Optional[bool]:
+    # A real bool or "true"/"false" in any case; anything else is None (invalid).
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    return None
+
+
+def _scenarios_perform_actions(args: Dict[str, Any]) -> str:
+    steps = args.get("steps")
+    if not isinstance(steps, list) or not steps:
+        return utils_err_payload("missing_steps", "steps must be a non-empty list")
+    if len(steps) > _SCENARIOS_MAX_STEPS:
+        return utils_err_payload("too_many_steps", f"at most {_SCENARIOS_MAX_STEPS} steps per call")
+    results: List[Dict[str, Any]] = []
+    for i, step in enumerate(steps):
+        action = step.get("action") if isinstance(step, dict) else None
+        handler = _SCENARIOS_ACTIONS.get(action) if isinstance(action, str) else None
+        settle = _scenarios_settle_flag(step.get("settle", True)) if isinstance(step, dict) else True
+        if handler is None:
+            out = json.loads(utils_err_payload("invalid_step", f"unknown action: {action!r}"))
+        elif settle is None:
+            out = json.loads(utils_err_payload("invalid_step", f"settle must be true or false, got {step['settle']!r}"))
+        else:
+            # The last step always settles; the screen is observed next.
+            settle = settle or i == len(steps) - 1
+            with profiler_span("step." + action):
+                out = json.loads(handler(step, settle))
+        results.append(dict(out, step=i + 1))
+        if not out["ok"]:
+            return utils_err_payload("step_failed", f"step {i + 1} ({action}) failed; remaining steps skipped",
+                                     {"completed": i, "total": len(steps), "results": results})
+    return utils_ok_payload({"action": "actions_performed", "completed": len(steps), "total": len(steps), "results": results})
+
+
+def _scenarios_compact_plan(plan: str, dump_cfg: Dict[str, Any]) -> str:
+    # The compacted plan also replaces the one in the assistant's tool call (see agent.py),
+    # so the full text does not stay in context twice.
+    dump_cfg["compacted_plan"] = None
+    if not plan or not plancompact_enabled():
+        return plan
+    compacted = plancompact_plan(plan)
+    if compacted is not plan:
+        dump_cfg["compacted_plan"] = compacted
+    return compacted
+
 
 def scenarios_execute_tool(tool_name: str, arg_str: Any, call_id: str, dump_cfg: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
     global _scenarios_screen_dimensions
@@ -271,136 +562,140 @@ def scenarios_execute_tool(tool_name: str, arg_str: Any, call_id: str, dump_cfg:
         if err:
             return {"role": "tool", "tool_call_id": call_id, "name": tool_name, "content": err}, None
         
-        plan = str(args.get("plan", "")).strip()
+        plan = _scenarios_compact_plan(str(args.get("plan", "")).strip(), dump_cfg)
         
-        png_bytes, screen_w, screen_h = winapi_capture_screenshot_png(dump_cfg["target_w"], dump_cfg["target_h"])
+        scale = dump_cfg.get("observe_scale", 1.0)
+        obs_w = max(16, int(dump_cfg["target_w"] * scale))
+        obs_h = max(16, int(dump_cfg["target_h"] * scale))
+        with profiler_span("capture"):
+            frame, reused, screen_w, screen_h = desktop_capture_frame(obs_w, obs_h, dump_cfg.get("image_encoder"))
         _scenarios_screen_dimensions["width"] = screen_w
         _scenarios_screen_dimensions["height"] = screen_h
         
         os.makedirs(dump_cfg["dump_dir"], exist_ok=True)
         fn = os.path.join(dump_cfg["dump_dir"], f"{dump_cfg['dump_prefix']}{dump_cfg['dump_idx']:04d}.png")
-        with open(fn, "wb") as f:
-            f.write(png_bytes)
+        fn = _scenarios_write_dump(frame, fn, reused, dump_cfg)
         dump_cfg["dump_idx"] += 1
         
-        b64 = base64.b64encode(png_bytes).decode("ascii")
+        _scenarios_unchanged_stats["observations"] += 1
+        unchanged = _scenarios_unchanged_parts(frame, dump_cfg)
         
         # OPTIMIZED: Minimal technical confirmation
+        result = {
+            "status": "captured",
+            "resolution": f"{obs_w}x{obs_h}",
+            "saved": fn
+        }
+        if unchanged is not None:
+            result["unchanged"] = True
+            result["diff_pct"] = round(unchanged[1] * 100.0, 2)
         tool_msg = {
             "role": "tool",
             "tool_call_id": call_id,
             "name": tool_name,
-            "content": utils_ok_payload({
-                "status": "captured",
-                "resolution": f"{dump_cfg['target_w']}x{dump_cfg['target_h']}",
-                "saved": fn
-            })
+            "content": utils_ok_payload(result)
         }
         
+        # Low-resolution overviews point the model at zoom_region for detail
+        lowres = " (low-resolution overview; use zoom_region to read small details)" if scale < 1.0 else ""
+        
         # OPTIMIZED: Clearer plan handoff formatting
         content_parts = []
         if plan:
             content_parts.append({
                 "type": "text",
-                "text": f"PREVIOUS AGENT PLAN:\n{plan}\n\n---\nCURRENT SCREEN:"
+                "text": f"PREVIOUS AGENT PLAN:\n{plan}\n\n---\nCURRENT SCREEN{lowres}:"
             })
         else:
             content_parts.append({
                 "type": "text",
-                "text": "CURRENT SCREEN (first observation):"
+                "text": f"CURRENT SCREEN (first observation){lowres}:"
             })
         
-        content_parts.append({
-            "type": "image_url",
-            "image_url": {"url": "data:image/png;base64," + b64}
-        })
+        if unchanged is not None:
+            content_parts.extend(unchanged[0])
+            _scenarios_unchanged_stats["unchanged"] += 1
+            dump_cfg["observation"] = "note"
+        else:
+            content_parts.append({
+                "type": "image_url",
+                "image_url": {"url": frame.image}
+            })
+            dump_cfg["last_seen"] = frame
+            dump_cfg["observation"] = "full"
         
         user_msg = {"role": "user", "content": content_parts}
         
         return tool_msg, user_msg
     
-    if tool_name == "click_element":
+    if tool_name == "zoom_region":
         args, err = utils_parse_args(arg_str)
         if err:
             return {"role": "tool", "tool_call_id": call_id, "name": tool_name, "content": err}, None
-        label = str(args.get("label", "")).strip()
+        plan = _scenarios_compact_plan(str(args.get("plan", "")).strip(), dump_cfg)
         box = args.get("box")
-        if not label:
-            return {"role": "tool", "tool_call_id": call_id, "name": tool_name, "content": utils_err_payload("missing_label", "label required")}, None
         if box is None:
             return {"role": "tool", "tool_call_id": call_id, "name": tool_name, "content": utils_err_payload("missing_box", "box required")}, None
         bbox, box_err = utils_parse_box(box)
         if box_err:
             return {"role": "tool", "tool_call_id": call_id, "name": tool_name, "content": box_err}, None
-        x1, y1, x2, y2 = bbox
-        cx, cy = utils_box_center(x1, y1, x2, y2)
-        px, py = winapi_norm_to_screen_px(cx, cy, _scenarios_screen_dimensions["width"], _scenarios_screen_dimensions["height"])
-        winapi_move_mouse_to_pixel(px, py)
-        time.sleep(0.08)
-        winapi_click_mouse()
-        time.sleep(0.12)
         
-        return {"role": "tool", "tool_call_id": call_id, "name": tool_name,
-                "content": utils_ok_payload({
-                    "action": "click_executed"
-                })}, None
-    
-    if tool_name == "type_text":
-        args, err = utils_parse_args(arg_str)
-        if err:
-            return {"role": "tool", "tool_call_id": call_id, "name": tool_name, "content": err}, None
-        text = str(args.get("text", ""))
-        text_ascii = text.encode("ascii", "ignore").decode("ascii")
-        if not text_ascii:
-            return {"role": "tool", "tool_call_id": call_id, "name": tool_name, "content": utils_err_payload("empty_text", "text empty or no ASCII chars")}, None
-        winapi_type_text(text_ascii)
-        time.sleep(0.08)
+        screen_w, screen_h = desktop_screen_size()
+        rx, ry, rw, rh = utils_norm_box_to_screen_rect(*bbox, screen_w, screen_h, _SCENARIOS_ZOOM_MIN_PX)
+        # Native resolution, scaled down only when the region is larger than the zoom budget
+        fit = min(1.0, dump_cfg.get("zoom_max_w", dump_cfg["target_w"]) / rw, dump_cfg.get("zoom_max_h", dump_cfg["target_h"]) / rh)
+        out_w = max(1, int(rw * fit))
+        out_h = max(1, int(rh * fit))
+        with profiler_span("capture", {"zoom": True}):
+            frame, reused, screen_w, screen_h = desktop_capture_frame(out_w, out_h, dump_cfg.get("image_encoder"), (rx, ry, rw, rh))
+        _scenarios_screen_dimensions["width"] = screen_w
+        _scenarios_screen_dimensions["height"] = screen_h
+        
+        os.makedirs(dump_cfg["dump_dir"], exist_ok=True)
+        fn = os.path.join(dump_cfg["dump_dir"], f"{dump_cfg['dump_prefix']}{dump_cfg['dump_idx']:04d}_zoom.png")
+        fn = _scenarios_write_dump(frame, fn, reused, dump_cfg)
+        dump_cfg["dump_idx"] += 1
+        dump_cfg["observation"] = "zoom"
+        
+        nx1, ny1 = utils_screen_px_to_norm(rx, ry, screen_w, screen_h)
+        nx2, ny2 = utils_screen_px_to_norm(rx + rw - 1, ry + rh - 1, screen_w, screen_h)
+        region = f"({nx1:.1f}, {ny1:.1f}) to ({nx2:.1f}, {ny2:.1f})"
+        detail = "native resolution" if fit >= 1.0 else f"{fit * 100.0:.0f}% of native resolution"
+        mapping = (f"ZOOMED REGION: screen box {region}, {rw}x{rh} screen pixels shown at {detail} ({out_w}x{out_h}). "
+                   f"The image covers exactly this box: a point at fraction (fx, fy) of the image width and height is at "
+                   f"screen coordinate ({nx1:.1f} + fx*{nx2 - nx1:.1f}, {ny1:.1f} + fy*{ny2 - ny1:.1f}). "
+                   f"Keep using full-screen 0-1000 coordinates for click_element.")
         
-        return {"role": "tool", "tool_call_id": call_id, "name": tool_name,
-                "content": utils_ok_payload({
-                    "action": "text_typed"
-                })}, None
+        tool_msg = {
+            "role": "tool",
+            "tool_call_id": call_id,
+            "name": tool_name,
+            "content": utils_ok_payload({
+                "status": "zoomed",
+                "region": [round(nx1, 1), round(ny1, 1), round(nx2, 1), round(ny2, 1)],
+                "resolution": f"{out_w}x{out_h}",
+                "saved": fn
+            })
+        }
+        header = f"PREVIOUS AGENT PLAN:\n{plan}\n\n---\n{mapping}" if plan else mapping
+        user_msg = {"role": "user", "content": [
+            {"type": "text", "text": header},
+            {"type": "image_url", "image_url": {"url": frame.image}},
+        ]}
+        
+        return tool_msg, user_msg
     
-    if tool_name == "press_key":
+    if tool_name in _SCENARIOS_ACTIONS:
         args, err = utils_parse_args(arg_str)
         if err:
             return {"role": "tool", "tool_call_id": call_id, "name": tool_name, "content": err}, None
-        key = str(args.get("key", "")).strip().lower()
-        if not key:
-            return {"role": "tool", "tool_call_id": call_id, "name": tool_name, "content": utils_err_payload("missing_key", "key required")}, None
-        try:
-            winapi_press_key(key)
-            time.sleep(0.08)
-            
-            return {"role": "tool", "tool_call_id": call_id, "name": tool_name,
-                    "content": utils_ok_payload({
-                        "action": "key_pressed"
-                    })}, None
-        except ValueError as e:
-            return {"role": "tool", "tool_call_id": call_id, "name": tool_name, "content": utils_err_payload("invalid_key", str(e))}, None
+        return {"role": "tool", "tool_call_id": call_id, "name": tool_name, "content": _SCENARIOS_ACTIONS[tool_name](args, True)}, None
     
-    if tool_name == "scroll_at_position":
+    if tool_name == "perform_actions":
         args, err = utils_parse_args(arg_str)
         if err:
             return {"role": "tool", "tool_call_id": call_id, "name": tool_name, "content": err}, None
-        box = args.get("box")
-        if box is not None:
-            bbox, box_err = utils_parse_box(box)
-            if box_err:
-                return {"role": "tool", "tool_call_id": call_id, "name": tool_name, "content": box_err}, None
-            cx, cy = utils_box_center(*bbox)
-        else:
-            cx, cy = 500.0, 500.0
-        px, py = winapi_norm_to_screen_px(cx, cy, _scenarios_screen_dimensions["width"], _scenarios_screen_dimensions["height"])
-        winapi_move_mouse_to_pixel(px, py)
-        time.sleep(0.06)
-        winapi_scroll_down()
-        time.sleep(0.08)
-        
-        return {"role": "tool", "tool_call_id": call_id, "name": tool_name,
-                "content": utils_ok_payload({
-                    "action": "scrolled_down"
-                })}, None
+        return {"role": "tool", "tool_call_id": call_id, "name": tool_name, "content": _scenarios_perform_actions(args)}, None
     
     return {"role": "tool", "tool_call_id": call_id, "name": tool_name,
             "content": utils_err_payload("unknown_tool", f"Unknown tool: {tool_name}")}, None
@@ -0,0 +1,329 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from body import ImageRef, StaticJSON
+from desktop import DesktopBackend, desktop_screen_size, desktop_set_frame_hooks
+from framecache import FrameEntry, framecache_key, framecache_lookup, framecache_store
+from tracelog import tracelog_warn
+
+# On-disk layout of a recorded session:
+#   index.jsonl   one JSON object per event, in order: session, model, frame, tool, end
+#   blobs/ab/<sha256>   content-addressed payloads: PNG frames, requests, responses
+# Requests are stored with images replaced by {"$image": sha256} and the run's dump
+# directory replaced by "$DUMP_DIR", so two runs of the same episode hash alike.
+SESSION_VERSION = 1
+
+# Request fields that do not change what the model is asked; left out of the replay key.
+_SESSION_KEY_FIELDS = ("messages", "tools", "tool_choice")
+
+_session_cfg: Dict[str, Any] = {"record_dir": "", "replay_dir": "", "strict": False}
+_session_lock = threading.Lock()
+_session_state: Dict[str, Any] = {"step": 0, "capture": 0, "dump_dir": "", "t0": 0.0, "index": None}
+_session_replay: Dict[str, Any] = {"by_hash": {}, "by_step": {}, "frames": [], "tools": {}, "session": {}}
+_session_stats: Dict[str, Any] = {"model_calls": 0, "frames": 0, "tools": 0, "blobs_written": 0, "bytes_written": 0,
+                                  "replay_hits": 0, "replay_misses": 0, "frame_exact": 0, "frame_fallback": 0,
+                                  "tool_mismatches": 0}
+
+
+def _session_blob_path(root: str, digest: str) -> str:
+    return os.path.join(root, "blobs", digest[:2], digest)
+
+
+def _session_put(data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    path = _session_blob_path(_session_cfg["record_dir"], digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with _session_lock:
+            _session_stats["blobs_written"] += 1
+            _session_stats["bytes_written"] += len(data)
+    return digest
+
+
+def _session_get(digest: str) -> bytes:
+    with open(_session_blob_path(_session_cfg["replay_dir"], digest), "rb") as f:
+        return f.read()
+
+
+def _session_write(event: Dict[str, Any]) -> None:
+    line = json.dumps(event, ensure_ascii=True, separators=(",", ":")) + "\n"
+    with _session_lock:
+        f = _session_state["index"]
+        if f is not None:
+            f.write(line)
+            f.flush()
+
+
+def _session_normalize(obj: Any, store: bool) -> Any:
+    if isinstance(obj, StaticJSON):
+        return _session_normalize(obj.value, store)
+    if isinstance(obj, ImageRef):
+        return {"$image": _session_put(obj.data) if store else obj.sha256, "mime": obj.mime}
+    if isinstance(obj, dict):
+        return {k: _session_normalize(v, store) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_session_normalize(v, store) for v in obj]
+    if isinstance(obj, str) and _session_state["dump_dir"]:
+        return obj.replace(_session_state["dump_dir"], "$DUMP_DIR")
+    return obj
+
+
+def session_request_hash(normalized: Dict[str, Any]) -> str:
+    key = {k: normalized.get(k) for k in _SESSION_KEY_FIELDS}
+    return hashlib.sha256(json.dumps(key, sort_keys=True, ensure_ascii=True, separators=(",", ":")).encode("ascii")).hexdigest()
+
+
+def session_recording() -> bool:
+    return bool(_session_cfg["record_dir"])
+
+
+def session_replaying() -> bool:
+    return bool(_session_cfg["replay_dir"])
+
+
+def session_configure(record_dir: str = "", replay_dir: str = "", strict: bool = False) -> None:
+    """Record this run to `record_dir`, or serve model replies and frames from `replay_dir`.
+
+    In replay, a request whose normalized hash was recorded gets that response; any
+    other request gets the response recorded at the same step (a miss, counted), or
+    raises when `strict`.
+    """
+    if record_dir and replay_dir:
+        raise ValueError("a session cannot be recorded and replayed at the same time")
+    _session_cfg.update({"record_dir": record_dir, "replay_dir": replay_dir, "strict": bool(strict)})
+    if replay_dir:
+        _session_load(replay_dir)
+    desktop_set_frame_hooks(replay=_session_replay_frame if replay_dir else None,
+                            observer=_session_record_frame if record_dir else None)
+
+
+def session_read_index(path: str) -> List[Dict[str, Any]]:
+    """All events of the recording in `path`, in order, after checking its header."""
+    with open(os.path.join(path, "index.jsonl"), "r", encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    if not events or events[0].get("kind") != "session":
+        raise ValueError(f"no session header in {path}/index.jsonl")
+    if events[0].get("version") != SESSION_VERSION:
+        raise ValueError(f"unsupported session version {events[0].get('version')} in {path}")
+    return events
+
+
+def _session_load(path: str) -> None:
+    by_hash: Dict[str, List[Dict[str, Any]]] = {}
+    by_step: Dict[int, Dict[str, Any]] = {}
+    frames: List[Dict[str, Any]] = []
+    tools: Dict[int, Dict[str, Any]] = {}
+    events = session_read_index(path)
+    session = events[0]
+    for ev in events[1:]:
+        kind = ev.get("kind")
+        if kind == "model":
+            by_hash.setdefault(ev["hash"], []).append(ev)
+            by_step[ev["step"]] = ev
+        elif kind == "frame":
+            frames.append(ev)
+        elif kind == "tool":
+            tools[ev["step"]] = ev
+    _session_replay.update({"by_hash": by_hash, "by_step": by_step, "frames": frames, "tools": tools, "session": session})
+
+
+def session_begin(task_prompt: str, cfg: Dict[str, Any]) -> None:
+    _session_state.update({"step": 0, "capture": 0, "dump_dir": cfg.get("dump_dir", ""), "t0": time.perf_counter()})
+    if not session_recording():
+        return
+    os.makedirs(_session_cfg["record_dir"], exist_ok=True)
+    with _session_lock:
+        _session_state["index"] = open(os.path.join(_session_cfg["record_dir"], "index.jsonl"), "w", encoding="utf-8")
+    _session_write({"kind": "session", "version": SESSION_VERSION, "created": time.time(), "task": task_prompt,
+                    "screen": list(desktop_screen_size()), "target": [cfg.get("target_w"), cfg.get("target_h")],
+                    "model_id": cfg.get("model_id"), "max_steps": cfg.get("max_steps")})
+
+
+def session_end(final: str) -> None:
+    if not session_recording():
+        return
+    _session_write({"kind": "end", "steps": _session_state["step"], "final": final,
+                    "wall_s": round(time.perf_counter() - _session_state["t0"], 4)})
+    with _session_lock:
+        f, _session_state["index"] = _session_state["index"], None
+    if f is not None:
+        f.close()
+
+
+def session_model(payload: Dict[str, Any], post: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """One model call: `post()` live (recorded if recording), or the recorded reply in replay."""
+    with _session_lock:
+        _session_state["step"] += 1
+        _session_state["capture"] = 0
+        step = _session_state["step"]
+        _session_stats["model_calls"] += 1
+    if session_replaying():
+        return _session_replay_model(step, payload)
+    if not session_recording():
+        return post()
+    normalized = _session_normalize(payload, True)
+    t0 = time.perf_counter()
+    resp = post()
+    elapsed = time.perf_counter() - t0
+    request = _session_put(json.dumps(normalized, ensure_ascii=True, separators=(",", ":")).encode("ascii"))
+    response = _session_put(json.dumps(resp, ensure_ascii=True, separators=(",", ":")).encode("ascii"))
+    _session_write({"kind": "model", "step": step, "hash": session_request_hash(normalized), "request": request,
+                    "response": response, "elapsed_s": round(elapsed, 4)})
+    return resp
+
+
+def _session_replay_model(step: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+    h = session_request_hash(_session_normalize(payload, False))
+    queue = _session_replay["by_hash"].get(h)
+    hit = bool(queue)
+    with _session_lock:
+        if hit:
+            ev = queue.pop(0)
+            _session_stats["replay_hits"] += 1
+        else:
+            ev = _session_replay["by_step"].get(step)
+            _session_stats["replay_misses"] += 1
+    if not hit:
+        if _session_cfg["strict"] or ev is None:
+            raise RuntimeError(f"replay: no recorded response for step {step} (request hash {h[:12]})")
+        tracelog_warn("replay_miss", {"step": step, "hash": h})
+    return json.loads(_session_get(ev["response"]).decode("ascii"))
+
+
+def session_tool(name: str, arguments: Any, tool_msg: Dict[str, Any], user_msg: Optional[Dict[str, Any]], elapsed: float) -> None:
+    step = _session_state["step"]
+    with _session_lock:
+        _session_stats["tools"] += 1
+    if session_replaying():
+        recorded = _session_replay["tools"].get(step)
+        result = _session_normalize(tool_msg.get("content"), False)
+        if recorded is not None and recorded.get("result") != result:
+            with _session_lock:
+                _session_stats["tool_mismatches"] += 1
+            tracelog_warn("replay_tool_mismatch", {"step": step, "tool": name, "recorded": recorded.get("result"),
+                                                   "replayed": result})
+        return
+    if not session_recording():
+        return
+    _session_write({"kind": "tool", "step": step, "name": name, "arguments": arguments,
+                    "result": _session_normalize(tool_msg.get("content"), True),
+                    "user": _session_normalize(user_msg, True) if user_msg is not None else None,
+                    "elapsed_s": round(elapsed, 4)})
+
+
+def _session_record_frame(entry: FrameEntry, reused: bool, screen_w: int, screen_h: int,
+                          region: Optional[Tuple[int, int, int, int]]) -> None:
+    with _session_lock:
+        seq = _session_state["capture"]
+        _session_state["capture"] += 1
+        _session_stats["frames"] += 1
+    _session_write({"kind": "frame", "step": _session_state["step"], "seq": seq, "w": entry.width, "h": entry.height,
+                    "region": list(region) if region else None, "screen": [screen_w, screen_h],
+                    "digest": entry.key[0].hex(), "tiles": list(entry.tiles), "thumb": entry.thumb.hex(),
+                    "png": _session_put(entry.png)})
+
+
+def _session_pick_frame(step: int, seq: int, w: int, h: int, region: Optional[List[int]]) -> Optional[Dict[str, Any]]:
+    best = None
+    for ev in _session_replay["frames"]:
+        if (ev["w"], ev["h"], ev["region"]) != (w, h, region):
+            continue
+        if (ev["step"], ev["seq"]) == (step, seq):
+            return ev
+        # Otherwise the screen as last seen at or before this point.
+        if (ev["step"], ev["seq"]) <= (step, seq) or best is None:
+            best = ev
+    return best
+
+
+def _session_replay_frame(target_w: int, target_h: int, encoder: Optional[Dict[str, Any]],
+                          region: Optional[Tuple[int, int, int, int]]) -> Tuple[FrameEntry, bool, int, int]:
+    with _session_lock:
+        seq = _session_state["capture"]
+        _session_state["capture"] += 1
+        _session_stats["frames"] += 1
+    step = _session_state["step"]
+    ev = _session_pick_frame(step, seq, target_w, target_h, list(region) if region else None)
+    if ev is None:
+        raise RuntimeError(f"replay: no recorded {target_w}x{target_h} frame for region {region}")
+    with _session_lock:
+        _session_stats["frame_exact" if (ev["step"], ev["seq"]) == (step, seq) else "frame_fallback"] += 1
+    screen_w, screen_h = ev["screen"]
+    key = framecache_key(bytes.fromhex(ev["digest"]), target_w, target_h, encoder)
+    hit = framecache_lookup(key)
+    if hit is not None:
+        return hit, True, screen_w, screen_h
+    entry = FrameEntry(key, tuple(ev["tiles"]), bytes.fromhex(ev["thumb"]), _session_get(ev["png"]), target_w, target_h, 0.0)
+    return framecache_store(entry), False, screen_w, screen_h
+
+
+class ReplayDesktop(DesktopBackend):
+    """Backend for replayed runs: the recorded screen size, no live pixels, inputs only counted.
+
+    Frames come from the recording through the desktop frame hook; probe() is constant,
+    so adaptive settle sees a still screen at once.
+    """
+
+    name = "replay"
+
+    def __init__(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        self.inputs = 0
+
+    def screen_size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    def capture_bgra(self, target_w: int, target_h: int, sink: Callable[[memoryview], Any],
+                     region: Optional[Tuple[int, int, int, int]] = None) -> Tuple[Any, int, int]:
+        raise RuntimeError("replay backend has no live screen")
+
+    def probe(self, target_w: int, target_h: int) -> bytes:
+        return b"replay"
+
+    def probe_bgra(self, target_w: int, target_h: int, sink: Callable[[memoryview], Any]) -> Any:
+        return sink(memoryview(bytes(target_w * target_h * 4)))
+
+    def move_mouse(self, x: int, y: int) -> None:
+        self.inputs += 1
+
+    def click(self) -> None:
+        self.inputs += 1
+
+    def scroll_down(self, amount: int = 120) -> None:
+        self.inputs += 1
+
+    def type_text(self, text: str) -> None:
+        self.inputs += 1
+
+    def press_key(self, key: str) -> None:
+        self.inputs += 1
+
+
+def session_replay_header() -> Dict[str, Any]:
+    """The recording's session line: task, screen size, target size, model id, max_steps."""
+    return dict(_session_replay["session"])
+
+
+def session_replay_desktop() -> ReplayDesktop:
+    w, h = _session_replay["session"].get("screen") or (1920, 1080)
+    return ReplayDesktop(int(w), int(h))
+
+
+def session_stats() -> Dict[str, Any]:
+    with _session_lock:
+        return dict(_session_stats)
+
+
+def session_reset() -> None:
+    with _session_lock:
+        for k in _session_stats:
+            _session_stats[k] = 0
@@ -0,0 +1,126 @@
+from __future__ import annotations
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from desktop import desktop_get
+from profiler import profiler_percentile, profiler_sleep, profiler_span
+
+SETTLE_MODES = ("fixed", "adaptive")
+
+# Probe frames are tiny: the point is to notice that something is still changing, not
+# to see what. 192x108 keeps a GDI StretchBlt + hash around a millisecond.
+_settle_cfg: Dict[str, Any] = {"mode": "fixed", "samples": 3, "interval": 0.025, "min_s": 0.05, "max_s": 3.0,
+                               "react_s": 1.0, "probe_w": 192, "probe_h": 108}
+_settle_lock = threading.Lock()
+_settle_times: Dict[str, List[float]] = {}
+_settle_timeouts: Dict[str, int] = {}
+_settle_no_change: Dict[str, int] = {}
+
+
+def settle_configure(mode: str = "fixed", samples: int = 3, interval: float = 0.025, min_s: float = 0.05,
+                     max_s: float = 3.0, probe_w: int = 192, probe_h: int = 108, react_s: float = 1.0) -> None:
+    """`react_s` bounds how long an adaptive wait looks for the first change from the screen
+    as it was before the input; a UI that has not reacted yet is not "settled"."""
+    mode = (mode or "fixed").strip().lower()
+    if mode not in SETTLE_MODES:
+        raise ValueError(f"unknown settle mode: {mode} (expected {' or '.join(SETTLE_MODES)})")
+    _settle_cfg.update({"mode": mode, "samples": max(2, samples), "interval": max(0.0, interval),
+                        "min_s": max(0.0, min_s), "max_s": max(min_s, max_s), "probe_w": max(8, probe_w),
+                        "probe_h": max(8, probe_h), "react_s": max(0.0, react_s)})
+
+
+def settle_adaptive() -> bool:
+    return _settle_cfg["mode"] == "adaptive"
+
+
+def settle_reset() -> None:
+    with _settle_lock:
+        _settle_times.clear()
+        _settle_timeouts.clear()
+        _settle_no_change.clear()
+
+
+def _settle_record(action: str, seconds: float, timed_out: bool, no_change: bool = False) -> None:
+    with _settle_lock:
+        _settle_times.setdefault(action, []).append(seconds)
+        if timed_out:
+            _settle_timeouts[action] = _settle_timeouts.get(action, 0) + 1
+        if no_change:
+            _settle_no_change[action] = _settle_no_change.get(action, 0) + 1
+
+
+def settle_probe() -> Optional[bytes]:
+    """Signature of the screen before an input action, for settle_after; None in fixed mode."""
+    if not settle_adaptive():
+        return None
+    return desktop_get().probe(_settle_cfg["probe_w"], _settle_cfg["probe_h"])
+
+
+def settle_wait(action: str, max_s: Optional[float] = None, before: Optional[bytes] = None) -> float:
+    """Poll probe frames until `samples` consecutive ones are identical, bounded by min_s/max_s.
+
+    With `before` (a settle_probe() taken before the input), the screen must first differ
+    from it; if it does not within react_s the wait ends there. Returns the time spent.
+    Neither a timeout nor no change is an error (some screens never stop animating, some
+    inputs change nothing); both are counted per action in settle_stats().
+    """
+    cfg = _settle_cfg
+    limit = cfg["max_s"] if max_s is None else max_s
+    backend = desktop_get()
+    with profiler_span("settle." + action):
+        t0 = time.perf_counter()
+        deadline = t0 + limit
+        react_deadline = t0 + min(cfg["react_s"], limit)
+        changed = before is None
+        prev = None
+        stable = 0
+        timed_out = False
+        no_change = False
+        while True:
+            sig = backend.probe(cfg["probe_w"], cfg["probe_h"])
+            if not changed:
+                now = time.perf_counter()
+                changed = sig != before
+                if not changed:
+                    if now >= react_deadline:
+                        no_change = True
+                        break
+                    time.sleep(min(cfg["interval"], react_deadline - now))
+                    continue
+            stable = stable + 1 if sig == prev else 1
+            prev = sig
+            now = time.perf_counter()
+            if stable >= cfg["samples"] and now - t0 >= cfg["min_s"]:
+                break
+            if now >= deadline:
+                timed_out = True
+                break
+            time.sleep(min(cfg["interval"], deadline - now))
+        elapsed = time.perf_counter() - t0
+    _settle_record(action, elapsed, timed_out, no_change)
+    return elapsed
+
+
+def settle_after(action: str, fixed_s: float, before: Optional[bytes] = None) -> float:
+    """Wait for the UI after an input action: the historical fixed sleep, or adaptive settle
+    (waiting for a reaction first when given the settle_probe() from before the input)."""
+    if settle_adaptive():
+        return settle_wait(action, before=before)
+    profiler_sleep("sleep." + action, fixed_s)
+    _settle_record(action, fixed_s, False)
+    return fixed_s
+
+
+def settle_stats() -> Dict[str, Dict[str, Any]]:
+    with _settle_lock:
+        items = {k: sorted(v) for k, v in _settle_times.items()}
+        timeouts = dict(_settle_timeouts)
+        no_change = dict(_settle_no_change)
+    out: Dict[str, Dict[str, Any]] = {}
+    for action, times in items.items():
+        ms = [t * 1000.0 for t in times]
+        out[action] = {"count": len(ms), "mean_ms": round(sum(ms) / len(ms), 1),
+                       "p50_ms": round(profiler_percentile(ms, 0.50), 1), "p95_ms": round(profiler_percentile(ms, 0.95), 1),
+                       "max_ms": round(ms[-1], 1), "timeouts": timeouts.get(action, 0),
+                       "no_change": no_change.get(action, 0)}
+    return out
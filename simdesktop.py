@@ -0,0 +1,199 @@
+from __future__ import annotations
+import threading
+import time
+from array import array
+from operator import itemgetter
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, TypeVar
+from desktop import DesktopBackend, desktop_parse_key
+from keyinput import keyinput_compile_combo, keyinput_compile_text, keyinput_send, keyinput_unpack
+
+T = TypeVar("T")
+
+_SIM_ROW_CACHE_MAX = 4096
+
+
+class SimEvent(NamedTuple):
+    t: float
+    kind: str
+    data: Dict[str, Any]
+
+
+class SimDesktop(DesktopBackend):
+    """Headless desktop: a BGRA framebuffer plus a timestamped log of every input event.
+
+    The default scene is a plain desktop with a taskbar and one window; subclasses draw
+    their own content and react to input through on_click / on_key / on_text.
+    """
+
+    name = "sim"
+
+    def __init__(self, width: int = 1920, height: int = 1080) -> None:
+        self.width = width
+        self.height = height
+        self.fb = bytearray(width * height * 4)
+        self.cursor = (width // 2, height // 2)
+        self.show_cursor = True
+        self.events: List[SimEvent] = []
+        self.version = 0
+        self.t0 = time.perf_counter()
+        self.lock = threading.RLock()
+        self._row_cache: Dict[Tuple[Tuple[int, int, int], bytes], bytes] = {}
+        self._cols: Dict[Tuple[int, int, int], Callable[[Any], Tuple[int, ...]]] = {}
+        self.render()
+
+    # --- scene -----------------------------------------------------------------------
+
+    def render(self) -> None:
+        self.fill_rect(0, 0, self.width, self.height, (0, 99, 177))
+        self.fill_rect(0, self.height - 48, self.width, self.height, (32, 32, 32))
+        self.fill_rect(self.width // 8, self.height // 8, self.width * 7 // 8, self.height * 3 // 4, (243, 243, 243))
+        self.fill_rect(self.width // 8, self.height // 8, self.width * 7 // 8, self.height // 8 + 32, (255, 255, 255))
+
+    def fill_rect(self, x0: int, y0: int, x1: int, y1: int, rgb: Tuple[int, int, int]) -> None:
+        x0, x1 = max(0, x0), min(self.width, x1)
+        y0, y1 = max(0, y0), min(self.height, y1)
+        if x0 >= x1 or y0 >= y1:
+            return
+        row = bytes((rgb[2], rgb[1], rgb[0], 255)) * (x1 - x0)
+        stride = self.width * 4
+        with self.lock:
+            for y in range(y0, y1):
+                self.fb[y * stride + x0 * 4:y * stride + x1 * 4] = row
+            self.version += 1
+
+    def fill_circle(self, cx: int, cy: int, r: int, rgb: Tuple[int, int, int]) -> None:
+        px = bytes((rgb[2], rgb[1], rgb[0], 255))
+        stride = self.width * 4
+        with self.lock:
+            for dy in range(-r, r + 1):
+                y = cy + dy
+                if y < 0 or y >= self.height:
+                    continue
+                half = int((r * r - dy * dy) ** 0.5)
+                x0, x1 = max(0, cx - half), min(self.width, cx + half + 1)
+                if x0 < x1:
+                    self.fb[y * stride + x0 * 4:y * stride + x1 * 4] = px * (x1 - x0)
+            self.version += 1
+
+    def pixel(self, x: int, y: int) -> Tuple[int, int, int]:
+        o = (y * self.width + x) * 4
+        b, g, r = self.fb[o], self.fb[o + 1], self.fb[o + 2]
+        return r, g, b
+
+    # --- input hooks ---------------------------------------------------------------------
+
+    def on_click(self, x: int, y: int) -> None:
+        pass
+
+    def on_key(self, key: str) -> None:
+        pass
+
+    def on_text(self, text: str) -> None:
+        pass
+
+    def record(self, kind: str, **data: Any) -> None:
+        self.events.append(SimEvent(time.perf_counter() - self.t0, kind, data))
+
+    # --- DesktopBackend ------------------------------------------------------------------
+
+    def screen_size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    def _col_getter(self, gkey: Tuple[int, int, int]) -> Callable[[Any], Tuple[int, ...]]:
+        getter = self._cols.get(gkey)
+        if getter is None:
+            target_w, rx, rw = gkey
+            getter = itemgetter(*[rx + (x * rw) // target_w for x in range(target_w)])
+            self._cols[gkey] = getter
+        return getter
+
+    def _grab(self, target_w: int, target_h: int, region: Optional[Tuple[int, int, int, int]]) -> bytearray:
+        # Nearest-neighbour scaling. Synthetic scenes have few distinct rows, so scaled rows
+        # are cached by source row content (per column mapping).
+        rx, ry, rw, rh = region or (0, 0, self.width, self.height)
+        stride = self.width * 4
+        out = bytearray(target_w * target_h * 4)
+        with self.lock:
+            if (target_w, target_h) == (self.width, self.height) and region is None:
+                out[:] = self.fb
+            else:
+                gkey = (target_w, rx, rw)
+                getter = self._col_getter(gkey)
+                fb8 = memoryview(self.fb)
+                fb32 = fb8.cast("I")
+                if len(self._row_cache) > _SIM_ROW_CACHE_MAX:
+                    self._row_cache.clear()
+                ostride = target_w * 4
+                for y in range(target_h):
+                    sy = ry + (y * rh) // target_h
+                    src = fb8[sy * stride:(sy + 1) * stride].tobytes()
+                    scaled = self._row_cache.get((gkey, src))
+                    if scaled is None:
+                        scaled = array("I", getter(fb32[sy * self.width:(sy + 1) * self.width])).tobytes()
+                        self._row_cache[(gkey, src)] = scaled
+                    out[y * ostride:(y + 1) * ostride] = scaled
+                fb32.release()
+                fb8.release()
+            cursor = self.cursor
+        if self.show_cursor:
+            self._draw_cursor(out, target_w, target_h, cursor, (rx, ry, rw, rh))
+        return out
+
+    def capture_bgra(self, target_w: int, target_h: int, sink: Callable[[memoryview], T],
+                     region: Optional[Tuple[int, int, int, int]] = None) -> Tuple[T, int, int]:
+        out = self._grab(target_w, target_h, region)
+        if region is None:
+            self.record("capture", w=target_w, h=target_h)
+        else:
+            self.record("capture", w=target_w, h=target_h, region=list(region))
+        return sink(memoryview(out)), self.width, self.height
+
+    def probe(self, target_w: int, target_h: int) -> bytes:
+        # Not recorded as a "capture" event: probes are not observations.
+        return bytes(self._grab(target_w, target_h, None))
+
+    def probe_bgra(self, target_w: int, target_h: int, sink: Callable[[memoryview], T]) -> T:
+        return sink(memoryview(self._grab(target_w, target_h, None)))
+
+    def _draw_cursor(self, out: bytearray, target_w: int, target_h: int, cursor: Tuple[int, int],
+                     region: Tuple[int, int, int, int]) -> None:
+        rx, ry, rw, rh = region
+        if not (rx <= cursor[0] < rx + rw and ry <= cursor[1] < ry + rh):
+            return
+        cx = ((cursor[0] - rx) * target_w) // rw
+        cy = ((cursor[1] - ry) * target_h) // rh
+        for dy in range(12):
+            y = cy + dy
+            if y >= target_h:
+                break
+            x0, x1 = cx, min(target_w, cx + max(1, 8 - dy // 2))
+            if x0 < x1:
+                out[(y * target_w + x0) * 4:(y * target_w + x1) * 4] = b"\x00\x00\x00\xff" * (x1 - x0)
+
+    def move_mouse(self, x: int, y: int) -> None:
+        self.cursor = (max(0, min(self.width - 1, int(x))), max(0, min(self.height - 1, int(y))))
+        self.record("move", x=self.cursor[0], y=self.cursor[1])
+
+    def click(self) -> None:
+        x, y = self.cursor
+        self.record("click", x=x, y=y)
+        self.on_click(x, y)
+
+    def scroll_down(self, amount: int = 120) -> None:
+        x, y = self.cursor
+        self.record("scroll", x=x, y=y, amount=amount)
+
+    def _record_input(self, buf: bytes, n: int) -> None:
+        # Stands in for SendInput: logs exactly the packed INPUT array the Windows backend would inject.
+        self.record("input", events=keyinput_unpack(buf))
+
+    def type_text(self, text: str) -> None:
+        self.record("type", text=text)
+        keyinput_send(keyinput_compile_text(text), self._record_input)
+        self.on_text(text)
+
+    def press_key(self, key: str) -> None:
+        vks = desktop_parse_key(key)
+        self.record("key", key=key.strip().lower())
+        keyinput_send(keyinput_compile_combo(vks), self._record_input, chunk=0)
+        self.on_key(key.strip().lower())
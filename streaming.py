@@ -0,0 +1,149 @@
+from __future__ import annotations
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+from body import body_build
+from profiler import profiler_span
+from router import RouterNoRetry, router_call
+from transport import TransportCancel, transport_stream
+from utils import utils_log_request, utils_log_response
+
+# on_tool_call(index, tool_call) fires once per tool call, as soon as its arguments form a
+# complete JSON object, while the rest of the completion is still streaming.
+ToolCallHandler = Callable[[int, Dict[str, Any]], None]
+
+
+def _streaming_args_complete(arguments: str) -> bool:
+    s = arguments.rstrip()
+    if not s.endswith("}"):
+        return False
+    try:
+        return isinstance(json.loads(s), dict)
+    except json.JSONDecodeError:
+        return False
+
+
+class StreamAssembler:
+    """Folds chat-completion SSE chunks back into a non-streaming response dict."""
+
+    def __init__(self, on_tool_call: Optional[ToolCallHandler] = None) -> None:
+        self.on_tool_call = on_tool_call
+        self.t_start = time.perf_counter()
+        self.t_first_token: Optional[float] = None
+        self.t_first_action: Optional[float] = None
+        self.content_parts: List[str] = []
+        self.tool_calls: Dict[int, Dict[str, Any]] = {}
+        self.dispatched: set = set()
+        self.finish_reason: Optional[str] = None
+        self.role = "assistant"
+        self.extra: Dict[str, Any] = {}
+
+    def _dispatch(self, index: int) -> None:
+        if self.on_tool_call is None or index in self.dispatched:
+            return
+        self.dispatched.add(index)
+        if self.t_first_action is None:
+            self.t_first_action = time.perf_counter()
+        self.on_tool_call(index, self.tool_calls[index])
+
+    def feed(self, chunk: Dict[str, Any]) -> None:
+        for key in ("id", "model", "created", "usage", "timings"):
+            if chunk.get(key) is not None:
+                self.extra[key] = chunk[key]
+        for choice in chunk.get("choices") or []:
+            delta = choice.get("delta") or {}
+            if delta.get("role"):
+                self.role = delta["role"]
+            if delta.get("content"):
+                if self.t_first_token is None:
+                    self.t_first_token = time.perf_counter()
+                self.content_parts.append(delta["content"])
+            for tcd in delta.get("tool_calls") or []:
+                if self.t_first_token is None:
+                    self.t_first_token = time.perf_counter()
+                index = int(tcd.get("index", len(self.tool_calls)))
+                tc = self.tool_calls.get(index)
+                if tc is None:
+                    tc = {"id": tcd.get("id") or f"call_{index}", "type": tcd.get("type") or "function",
+                          "function": {"name": "", "arguments": ""}}
+                    self.tool_calls[index] = tc
+                    # A new call starting means the previous ones are final.
+                    for prev in sorted(self.tool_calls):
+                        if prev < index:
+                            self._dispatch_if_complete(prev)
+                elif tcd.get("id"):
+                    tc["id"] = tcd["id"]
+                fn = tcd.get("function") or {}
+                if fn.get("name"):
+                    tc["function"]["name"] += fn["name"]
+                if fn.get("arguments"):
+                    tc["function"]["arguments"] += fn["arguments"]
+                self._dispatch_if_complete(index)
+            if choice.get("finish_reason"):
+                self.finish_reason = choice["finish_reason"]
+
+    def _dispatch_if_complete(self, index: int) -> None:
+        tc = self.tool_calls[index]
+        if tc["function"]["name"] and _streaming_args_complete(tc["function"]["arguments"]):
+            self._dispatch(index)
+
+    def finish(self) -> None:
+        for index in sorted(self.tool_calls):
+            self._dispatch_if_complete(index)
+
+    def result(self) -> Dict[str, Any]:
+        msg: Dict[str, Any] = {"role": self.role, "content": "".join(self.content_parts)}
+        if self.tool_calls:
+            msg["tool_calls"] = [self.tool_calls[i] for i in sorted(self.tool_calls)]
+        resp: Dict[str, Any] = dict(self.extra)
+        resp["choices"] = [{"index": 0, "message": msg, "finish_reason": self.finish_reason}]
+        resp["stream_stats"] = self.stats()
+        return resp
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        def rel(t: Optional[float]) -> Optional[float]:
+            return None if t is None else round(t - self.t_start, 4)
+        return {"ttft_s": rel(self.t_first_token), "ttfa_s": rel(self.t_first_action),
+                "total_s": round(time.perf_counter() - self.t_start, 4)}
+
+
+def streaming_post_json(payload: Dict[str, Any], endpoint: str, timeout: int,
+                        on_tool_call: Optional[ToolCallHandler] = None) -> Dict[str, Any]:
+    """POST with "stream": true and assemble the SSE reply into the usual response shape.
+
+    The returned dict carries an extra "stream_stats" entry with time-to-first-token and
+    time-to-first-action (first on_tool_call dispatch), both relative to the request start.
+    """
+    payload = dict(payload)
+    payload["stream"] = True
+    payload.setdefault("stream_options", {"include_usage": True})
+    utils_log_request(payload)
+    with profiler_span("body_build"):
+        data = body_build(payload)
+    headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+
+    def attempt(url: str, cancel: Optional[TransportCancel]) -> StreamAssembler:
+        asm = StreamAssembler(on_tool_call)
+        try:
+            with transport_stream(url, data, headers, timeout) as lines:
+                for raw_line in lines:
+                    line = raw_line.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    body = line[5:].strip()
+                    if body == "[DONE]":
+                        break
+                    asm.feed(json.loads(body))
+        except Exception as e:
+            # A tool call already ran from this stream; repeating the request elsewhere would run it twice.
+            if asm.dispatched:
+                raise RouterNoRetry(f"stream from {url} failed after a tool call was dispatched: {e}") from e
+            raise
+        return asm
+
+    # Never hedged: two live streams would both dispatch tool calls.
+    asm = router_call(attempt, endpoint, hedge=False)
+    asm.finish()
+    response = asm.result()
+    utils_log_response(response)
+    return response
@@ -0,0 +1,118 @@
+from __future__ import annotations
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional
+
+TRACE, DEBUG, INFO, WARN, ERROR, OFF = 5, 10, 20, 30, 40, 100
+TRACELOG_LEVELS = {"trace": TRACE, "debug": DEBUG, "info": INFO, "warn": WARN, "warning": WARN, "error": ERROR, "off": OFF}
+_TRACELOG_NAMES = {TRACE: "trace", DEBUG: "debug", INFO: "info", WARN: "warn", ERROR: "error"}
+
+_tracelog_level = WARN
+_tracelog_console = False
+_tracelog_path = ""
+_tracelog_queue: "queue.SimpleQueue[Optional[Dict[str, Any]]]" = queue.SimpleQueue()
+_tracelog_thread: Optional[threading.Thread] = None
+_tracelog_lock = threading.Lock()
+
+
+def tracelog_parse_level(name: str) -> int:
+    key = (name or "").strip().lower()
+    if key.isdigit():
+        return int(key)
+    if key not in TRACELOG_LEVELS:
+        raise ValueError(f"unknown log level: {name} (expected one of {', '.join(TRACELOG_LEVELS)})")
+    return TRACELOG_LEVELS[key]
+
+
+def tracelog_configure(level: Any = WARN, path: str = "", console: bool = False) -> None:
+    """Set the threshold and sinks. Records go to `path` as JSONL from a background thread;
+    `console` additionally echoes them to stdout. Below the threshold nothing is built."""
+    global _tracelog_level, _tracelog_console, _tracelog_path
+    tracelog_close()
+    _tracelog_level = tracelog_parse_level(level) if isinstance(level, str) else int(level)
+    _tracelog_console = console
+    _tracelog_path = path
+
+
+def tracelog_enabled(level: int) -> bool:
+    return level >= _tracelog_level
+
+
+def tracelog_emit(level: int, event: str, fields: Any = None) -> None:
+    """Queue one record. `fields` is a dict or a zero-arg callable returning one; the callable
+    runs only when the level is enabled, so expensive formatting costs nothing otherwise."""
+    if level < _tracelog_level:
+        return
+    if callable(fields):
+        fields = fields()
+    record: Dict[str, Any] = {"ts": round(time.time(), 6), "level": _TRACELOG_NAMES.get(level, str(level)), "event": event}
+    if fields:
+        record.update(fields)
+    if _tracelog_console:
+        print(f"[{record['level']}] {event}: {json.dumps(fields, ensure_ascii=True, default=str)}")
+    if _tracelog_path:
+        _tracelog_start()
+        _tracelog_queue.put(record)
+
+
+def tracelog_trace(event: str, fields: Any = None) -> None:
+    tracelog_emit(TRACE, event, fields)
+
+
+def tracelog_debug(event: str, fields: Any = None) -> None:
+    tracelog_emit(DEBUG, event, fields)
+
+
+def tracelog_info(event: str, fields: Any = None) -> None:
+    tracelog_emit(INFO, event, fields)
+
+
+def tracelog_warn(event: str, fields: Any = None) -> None:
+    tracelog_emit(WARN, event, fields)
+
+
+def tracelog_error(event: str, fields: Any = None) -> None:
+    tracelog_emit(ERROR, event, fields)
+
+
+def _tracelog_writer(path: str) -> None:
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        while True:
+            record = _tracelog_queue.get()
+            if record is None:
+                break
+            f.write(json.dumps(record, ensure_ascii=True, separators=(",", ":"), default=str))
+            f.write("\n")
+            if _tracelog_queue.empty():
+                f.flush()
+
+
+def _tracelog_start() -> None:
+    global _tracelog_thread
+    if _tracelog_thread is not None:
+        return
+    with _tracelog_lock:
+        if _tracelog_thread is None:
+            _tracelog_thread = threading.Thread(target=_tracelog_writer, args=(_tracelog_path,),
+                                                name="tracelog-writer", daemon=True)
+            _tracelog_thread.start()
+
+
+def tracelog_close() -> None:
+    """Drain queued records and stop the writer thread."""
+    global _tracelog_thread
+    with _tracelog_lock:
+        t, _tracelog_thread = _tracelog_thread, None
+    if t is not None:
+        _tracelog_queue.put(None)
+        t.join(timeout=10)
+
+
+atexit.register(tracelog_close)
@@ -0,0 +1,252 @@
+from __future__ import annotations
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from desktop import desktop_probe_bgra
+from tracelog import tracelog_info
+
+TRAJCACHE_VERSION = 1
+
+# The screen state is a 64x36 grid of mean brightness (all three channels, so a red to
+# black change counts) taken from a fresh 256x144 probe; 4x4 probe pixels per cell, or
+# about 30x30 screen pixels at 1080p. Two states match when every cell is within `tol`
+# levels (the cursor moves a cell by well under 16), apart from at most `max_cells`.
+_TRAJCACHE_PROBE = (256, 144)
+_TRAJCACHE_GRID = (64, 36)
+
+_trajcache_cfg: Dict[str, Any] = {"dir": "", "max_entries": 2000, "max_bytes": 32 << 20, "tol": 16, "max_cells": 0}
+_trajcache_lock = threading.Lock()
+# Entries in least- to most-recently-used order, keyed by entry id.
+_trajcache_entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+# Steps taken this run that go into the cache only if the run succeeds.
+_trajcache_pending: List[Dict[str, Any]] = []
+_trajcache_dirty = False
+_trajcache_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def trajcache_configure(path: str = "", max_entries: int = 2000, max_bytes: int = 32 << 20, tol: int = 16,
+                        max_cells: int = 0) -> None:
+    """Enable the trajectory cache with its index in directory `path` ("" disables it)."""
+    global _trajcache_dirty
+    _trajcache_cfg.update({"dir": path, "max_entries": max(1, max_entries), "max_bytes": max(1 << 16, max_bytes),
+                           "tol": max(0, tol), "max_cells": max(0, max_cells)})
+    with _trajcache_lock:
+        _trajcache_entries.clear()
+        _trajcache_pending.clear()
+        _trajcache_dirty = False
+        if path:
+            for entry in _trajcache_read(path):
+                _trajcache_entries[entry["id"]] = entry
+
+
+def trajcache_enabled() -> bool:
+    return bool(_trajcache_cfg["dir"])
+
+
+def _trajcache_index_path(path: str) -> str:
+    return os.path.join(path, "trajcache.json")
+
+
+def _trajcache_read(path: str) -> List[Dict[str, Any]]:
+    try:
+        with open(_trajcache_index_path(path), "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return []
+    if data.get("version") != TRAJCACHE_VERSION:
+        return []
+    return data.get("entries", [])
+
+
+def trajcache_grid(bgra: memoryview, width: int, height: int) -> bytes:
+    """Mean (B+G+R)/3 per cell of a _TRAJCACHE_GRID over a top-down BGRA frame."""
+    gw, gh = _TRAJCACHE_GRID
+    stride = width * 4
+    xs = [width * i // gw for i in range(gw + 1)]
+    out = bytearray(gw * gh)
+    for cy in range(gh):
+        y0, y1 = height * cy // gh, height * (cy + 1) // gh
+        sums = [0] * gw
+        for y in range(y0, y1):
+            row = bgra[y * stride:(y + 1) * stride]
+            b, g, r = row[0::4], row[1::4], row[2::4]
+            for cx in range(gw):
+                x0, x1 = xs[cx], xs[cx + 1]
+                sums[cx] += sum(b[x0:x1]) + sum(g[x0:x1]) + sum(r[x0:x1])
+        for cx in range(gw):
+            n = 3 * (xs[cx + 1] - xs[cx]) * max(1, y1 - y0)
+            out[cy * gw + cx] = sums[cx] // n
+    return bytes(out)
+
+
+def trajcache_snapshot() -> bytes:
+    w, h = _TRAJCACHE_PROBE
+    return desktop_probe_bgra(w, h, lambda bgra: trajcache_grid(bgra, w, h))
+
+
+def trajcache_grid_match(a: bytes, b: bytes, tol: int, max_cells: int) -> bool:
+    """True if at most `max_cells` cells of two state grids differ by more than `tol` levels."""
+    if len(a) != len(b):
+        return False
+    budget = max_cells
+    for p, q in zip(a, b):
+        if abs(p - q) > tol:
+            budget -= 1
+            if budget < 0:
+                return False
+    return True
+
+
+def _trajcache_match(a: bytes, b: bytes) -> bool:
+    return trajcache_grid_match(a, b, _trajcache_cfg["tol"], _trajcache_cfg["max_cells"])
+
+
+def _trajcache_task_key(task: str) -> str:
+    return hashlib.sha256(task.encode("utf-8")).hexdigest()[:16]
+
+
+def _trajcache_task_stats(task_key: str, task: str = "") -> Dict[str, Any]:
+    st = _trajcache_stats.get(task_key)
+    if st is None:
+        st = _trajcache_stats[task_key] = {"task": task[:80], "lookups": 0, "hits": 0, "verified": 0, "rejected": 0,
+                                           "model_calls": 0, "stored": 0}
+    return st
+
+
+def trajcache_state(task: str, prev_tool: str) -> Dict[str, Any]:
+    """The state the next step starts from: task, the tool that just ran and the screen."""
+    return {"task": _trajcache_task_key(task), "task_text": task, "prev": prev_tool, "grid": trajcache_snapshot()}
+
+
+def trajcache_lookup(state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Most recently used entry recorded from a matching state, or None."""
+    with _trajcache_lock:
+        st = _trajcache_task_stats(state["task"], state["task_text"])
+        st["lookups"] += 1
+        for entry in reversed(_trajcache_entries.values()):
+            if entry["task"] != state["task"] or entry["prev"] != state["prev"]:
+                continue
+            if _trajcache_match(base64.b64decode(entry["grid"]), state["grid"]):
+                st["hits"] += 1
+                entry["used"] = time.time()
+                _trajcache_entries.move_to_end(entry["id"])
+                tracelog_info("trajcache_hit", {"entry": entry["id"], "prev": state["prev"],
+                                                "tool": entry["message"]["tool_calls"][0]["function"]["name"]})
+                return entry
+    return None
+
+
+def trajcache_message(entry: Dict[str, Any], call_id: str) -> Dict[str, Any]:
+    """The cached assistant turn, under a fresh tool call id."""
+    msg = json.loads(json.dumps(entry["message"]))
+    msg["tool_calls"][0]["id"] = call_id
+    return msg
+
+
+def trajcache_verify(entry: Dict[str, Any], post_grid: Optional[bytes]) -> bool:
+    """Check the screen after a cached action against the one recorded; drop the entry if it differs.
+
+    `post_grid` is None when the action itself failed.
+    """
+    global _trajcache_dirty
+    ok = post_grid is not None and _trajcache_match(base64.b64decode(entry["post"]), post_grid)
+    with _trajcache_lock:
+        st = _trajcache_task_stats(entry["task"])
+        if ok:
+            st["verified"] += 1
+            entry["verified"] = entry.get("verified", 0) + 1
+        else:
+            st["rejected"] += 1
+            _trajcache_entries.pop(entry["id"], None)
+        _trajcache_dirty = True
+    if not ok:
+        tracelog_info("trajcache_reject", {"entry": entry["id"], "action_failed": post_grid is None})
+    return ok
+
+
+def trajcache_note(state: Dict[str, Any], msg: Dict[str, Any], post_grid: bytes) -> None:
+    """Remember a model-chosen step and the screen it led to, pending trajcache_commit."""
+    if not msg.get("tool_calls"):
+        return
+    now = time.time()
+    entry = {"id": hashlib.sha256(state["grid"] + post_grid + json.dumps(msg, sort_keys=True).encode("utf-8")).hexdigest()[:20],
+             "task": state["task"], "prev": state["prev"], "grid": base64.b64encode(state["grid"]).decode("ascii"),
+             "post": base64.b64encode(post_grid).decode("ascii"), "message": msg, "created": now, "used": now, "verified": 0}
+    with _trajcache_lock:
+        _trajcache_pending.append(entry)
+
+
+def trajcache_count_model_call(task: str) -> None:
+    with _trajcache_lock:
+        _trajcache_task_stats(_trajcache_task_key(task), task)["model_calls"] += 1
+
+
+def trajcache_commit() -> None:
+    """The run succeeded: its pending steps become cache entries, replacing any entry for the same state."""
+    global _trajcache_dirty
+    with _trajcache_lock:
+        for entry in _trajcache_pending:
+            grid = base64.b64decode(entry["grid"])
+            for old in [e for e in _trajcache_entries.values() if e["task"] == entry["task"] and e["prev"] == entry["prev"]]:
+                if _trajcache_match(base64.b64decode(old["grid"]), grid):
+                    del _trajcache_entries[old["id"]]
+            _trajcache_entries[entry["id"]] = entry
+            _trajcache_entries.move_to_end(entry["id"])
+            _trajcache_task_stats(entry["task"])["stored"] += 1
+        _trajcache_dirty = _trajcache_dirty or bool(_trajcache_pending)
+        _trajcache_pending.clear()
+        _trajcache_evict()
+
+
+def _trajcache_evict() -> None:
+    sizes = {k: len(json.dumps(e)) for k, e in _trajcache_entries.items()}
+    total = sum(sizes.values())
+    while _trajcache_entries and (len(_trajcache_entries) > _trajcache_cfg["max_entries"] or total > _trajcache_cfg["max_bytes"]):
+        k, _ = _trajcache_entries.popitem(last=False)
+        total -= sizes[k]
+
+
+def trajcache_flush() -> None:
+    """Drop uncommitted steps and write the index if it changed (atomic replace; last writer wins)."""
+    global _trajcache_dirty
+    path = _trajcache_cfg["dir"]
+    with _trajcache_lock:
+        _trajcache_pending.clear()
+        if not path or not _trajcache_dirty:
+            return
+        data = json.dumps({"version": TRAJCACHE_VERSION, "entries": list(_trajcache_entries.values())},
+                          ensure_ascii=True, separators=(",", ":"))
+        _trajcache_dirty = False
+    os.makedirs(path, exist_ok=True)
+    tmp = _trajcache_index_path(path) + f".{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp, _trajcache_index_path(path))
+
+
+def trajcache_stats() -> Dict[str, Any]:
+    """Totals plus per-task lookups, hits, verified/rejected hits, model calls made and saved.
+
+    Only verified hits count as saved calls: a rejected hit sent the next step to the model anyway.
+    """
+    with _trajcache_lock:
+        per_task = {k: dict(v) for k, v in _trajcache_stats.items()}
+        entries = len(_trajcache_entries)
+    total: Dict[str, Any] = {"entries": entries}
+    for key in ("lookups", "hits", "verified", "rejected", "model_calls", "stored"):
+        total[key] = sum(v[key] for v in per_task.values())
+    for st in [total] + list(per_task.values()):
+        st["hit_rate"] = st["hits"] / st["lookups"] if st["lookups"] else 0.0
+        st["model_calls_saved"] = st["verified"]
+    total["per_task"] = per_task
+    return total
+
+
+def trajcache_reset() -> None:
+    with _trajcache_lock:
+        _trajcache_stats.clear()
@@ -0,0 +1,259 @@
+from __future__ import annotations
+import http.client
+import socket
+import threading
+import urllib.parse
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sized, Tuple, Union
+
+# Errors that mean a pooled keep-alive socket was closed by the server while idle.
+# A request that fails with one of these on a reused connection is retried once on a
+# fresh connection; nothing from the response has been consumed at that point.
+_TRANSPORT_STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError,
+                           ConnectionAbortedError, BrokenPipeError)
+
+# A request body is either bytes or a re-iterable of byte chunks with an exact len()
+# (see body.RequestBody); the latter is streamed to the socket without being joined.
+Body = Union[bytes, Sized]
+
+_transport_defaults: Dict[str, Any] = {"pool_size": 2, "connect_timeout": 10.0, "read_timeout": None}
+_transport_overrides: Dict[str, Dict[str, Any]] = {}
+_transport_pools: Dict[str, "ConnectionPool"] = {}
+_transport_lock = threading.Lock()
+_transport_stats: Dict[str, int] = {"requests": 0, "connections_opened": 0, "connections_reused": 0,
+                                    "stale_retries": 0, "bytes_sent": 0, "bytes_received": 0}
+
+
+class TransportHTTPError(RuntimeError):
+    """Non-2xx reply; `status` lets callers tell server faults (5xx) from bad requests."""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class TransportCancelled(Exception):
+    pass
+
+
+class TransportCancel:
+    """Lets another thread abort an in-flight request by shutting down its socket.
+
+    The blocked read wakes up with an error, the connection is dropped instead of being
+    returned to the pool, and a cancelled request never retries.
+    """
+
+    def __init__(self) -> None:
+        self.cancelled = False
+        self._conn: Optional[http.client.HTTPConnection] = None
+        self._lock = threading.Lock()
+
+    def attach(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            if self.cancelled:
+                raise TransportCancelled("request cancelled")
+            self._conn = conn
+
+    def detach(self) -> bool:
+        """Forget the connection; True if the request was not cancelled."""
+        with self._lock:
+            self._conn = None
+            return not self.cancelled
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            conn, self._conn = self._conn, None
+        if conn is not None and conn.sock is not None:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def _transport_count(key: str, n: int = 1) -> None:
+    with _transport_lock:
+        _transport_stats[key] += n
+
+
+class ConnectionPool:
+    """Idle keep-alive connections to one scheme://host:port, up to `size` kept around."""
+
+    def __init__(self, endpoint: str, size: int, connect_timeout: float) -> None:
+        u = urllib.parse.urlsplit(endpoint)
+        if u.scheme not in ("http", "https"):
+            raise ValueError(f"unsupported endpoint scheme: {endpoint}")
+        self.scheme = u.scheme
+        self.host = u.hostname or "localhost"
+        self.port = u.port or (443 if u.scheme == "https" else 80)
+        self.size = max(1, size)
+        self.connect_timeout = connect_timeout
+        self._idle: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        conn = cls(self.host, self.port, timeout=self.connect_timeout)
+        return conn, False
+
+    def release(self, conn: http.client.HTTPConnection, reusable: bool) -> None:
+        if reusable:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(conn)
+                    return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def transport_configure(endpoint: Optional[str] = None, pool_size: Optional[int] = None,
+                        connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None) -> None:
+    """Set pool size and timeouts globally, or for one endpoint when `endpoint` is given.
+
+    read_timeout=None keeps the per-call timeout passed by the caller (LMSTUDIO_TIMEOUT).
+    """
+    settings = {k: v for k, v in (("pool_size", pool_size), ("connect_timeout", connect_timeout),
+                                  ("read_timeout", read_timeout)) if v is not None}
+    with _transport_lock:
+        if endpoint is None:
+            _transport_defaults.update(settings)
+        else:
+            _transport_overrides.setdefault(endpoint, {}).update(settings)
+        for pool in _transport_pools.values():
+            pool.close()
+        _transport_pools.clear()
+
+
+def _transport_settings(endpoint: str) -> Dict[str, Any]:
+    s = dict(_transport_defaults)
+    s.update(_transport_overrides.get(endpoint, {}))
+    return s
+
+
+def _transport_pool(endpoint: str) -> ConnectionPool:
+    u = urllib.parse.urlsplit(endpoint)
+    key = f"{u.scheme}://{u.netloc}"
+    with _transport_lock:
+        pool = _transport_pools.get(key)
+        if pool is None:
+            s = _transport_settings(endpoint)
+            pool = ConnectionPool(endpoint, int(s["pool_size"]), float(s["connect_timeout"]))
+            _transport_pools[key] = pool
+        return pool
+
+
+def _transport_path(endpoint: str) -> str:
+    u = urllib.parse.urlsplit(endpoint)
+    return (u.path or "/") + (f"?{u.query}" if u.query else "")
+
+
+def _transport_send(endpoint: str, body: Body, headers: Dict[str, str], timeout: Optional[float],
+                    cancel: Optional[TransportCancel] = None) -> Tuple[ConnectionPool, http.client.HTTPConnection, http.client.HTTPResponse]:
+    pool = _transport_pool(endpoint)
+    read_timeout = _transport_settings(endpoint)["read_timeout"] or timeout
+    path = _transport_path(endpoint)
+    hdrs = {"Connection": "keep-alive", "Content-Length": str(len(body))}
+    hdrs.update(headers)
+    for attempt in range(2):
+        conn, reused = pool.acquire()
+        try:
+            if conn.sock is None:
+                conn.connect()
+                _transport_count("connections_opened")
+            else:
+                _transport_count("connections_reused")
+            if cancel is not None:
+                cancel.attach(conn)
+            conn.sock.settimeout(read_timeout)
+            conn.request("POST", path, body=body, headers=hdrs)
+            resp = conn.getresponse()
+        except _TRANSPORT_STALE_ERRORS:
+            conn.close()
+            if reused and attempt == 0 and not (cancel is not None and cancel.cancelled):
+                _transport_count("stale_retries")
+                continue
+            raise
+        except Exception:
+            conn.close()
+            raise
+        _transport_count("requests")
+        _transport_count("bytes_sent", len(body))
+        return pool, conn, resp
+    raise RuntimeError("unreachable")
+
+
+def _transport_check_status(endpoint: str, resp: http.client.HTTPResponse, data: bytes) -> None:
+    if resp.status >= 400:
+        raise TransportHTTPError(resp.status, f"HTTP {resp.status} {resp.reason} from {endpoint}: {data[:500].decode('utf-8', 'replace')}")
+
+
+def transport_post(endpoint: str, body: Body, headers: Dict[str, str], timeout: Optional[float] = None,
+                   cancel: Optional[TransportCancel] = None) -> bytes:
+    """POST `body` on a pooled keep-alive connection and return the full response body.
+
+    `cancel`, if given, can abort the request from another thread (see TransportCancel).
+    """
+    pool, conn, resp = _transport_send(endpoint, body, headers, timeout, cancel)
+    try:
+        data = resp.read()
+    except Exception:
+        conn.close()
+        raise
+    _transport_count("bytes_received", len(data))
+    pool.release(conn, not resp.will_close and (cancel is None or cancel.detach()))
+    _transport_check_status(endpoint, resp, data)
+    return data
+
+
+@contextmanager
+def transport_stream(endpoint: str, body: Body, headers: Dict[str, str],
+                     timeout: Optional[float] = None) -> Iterator[Iterable[bytes]]:
+    """POST and yield an iterator over the raw response lines (e.g. SSE).
+
+    The connection goes back to the pool only if the body was read to the end without error.
+    """
+    pool, conn, resp = _transport_send(endpoint, body, headers, timeout)
+    if resp.status >= 400:
+        data = resp.read()
+        pool.release(conn, not resp.will_close)
+        _transport_check_status(endpoint, resp, data)
+
+    def lines() -> Iterator[bytes]:
+        for line in resp:
+            _transport_count("bytes_received", len(line))
+            yield line
+
+    ok = False
+    try:
+        yield lines()
+        ok = True
+    finally:
+        if ok and not resp.isclosed():
+            try:
+                _transport_count("bytes_received", len(resp.read()))
+            except (OSError, http.client.HTTPException):
+                ok = False
+        if not ok:
+            conn.close()
+        pool.release(conn, ok and not resp.will_close)
+
+
+def transport_stats() -> Dict[str, int]:
+    with _transport_lock:
+        return dict(_transport_stats)
+
+
+def transport_close_all() -> None:
+    with _transport_lock:
+        pools = list(_transport_pools.values())
+        _transport_pools.clear()
+    for pool in pools:
+        pool.close()
@@ -3,32 +3,17 @@ import hashlib
 import json
 import os
 import re
-import urllib.request
 from typing import Any, Dict, List, Optional, Tuple
+from body import ImageRef, StaticJSON, body_build
+from profiler import profiler_span
+from router import router_call
+from tracelog import tracelog_debug, tracelog_info
+from transport import transport_post
 
 _UTILS_THINK_RE = re.compile(r"<think>.*?</think>", re.DOTALL)
 
-
-def print_nested_dict(data, indent_level=0):
-    spaces = "  " * indent_level
-    if isinstance(data, dict):
-        for key, value in data.items():
-            if key == "image_url" and isinstance(value, dict) and len(value) == 1 and "url" in value:
-                print(f"{spaces}{key}: {{url: {value['url']}}}")
-            elif isinstance(value, (dict, list)):
-                print(f"{spaces}{key}:")
-                print_nested_dict(value, indent_level + 1)
-            else:
-                print(f"{spaces}{key}: {value}")
-    elif isinstance(data, list):
-        for index, item in enumerate(data):
-            if isinstance(item, (dict, list)):
-                print(f"{spaces}[{index}]:")
-                print_nested_dict(item, indent_level + 1)
-            else:
-                print(f"{spaces}[{index}]: {item}")
-    else:
-        print(f"{spaces}{data}")
+# (prompt_tokens, cached_tokens, prompt_ms) per model response, for utils_prompt_cache_stats.
+_utils_prompt_cache: List[Tuple[Optional[int], Optional[int], Optional[float]]] = []
 
 
 def utils_ok_payload(extra: Optional[Dict[str, Any]] = None) -> str:
@@ -38,8 +23,11 @@ def utils_ok_payload(extra: Optional[Dict[str, Any]] = None) -> str:
     return json.dumps(d, ensure_ascii=True, separators=(",", ":"))
 
 
-def utils_err_payload(error_type: str, message: str) -> str:
-    return json.dumps({"ok": False, "error": {"type": error_type, "message": message}}, ensure_ascii=True, separators=(",", ":"))
+def utils_err_payload(error_type: str, message: str, extra: Optional[Dict[str, Any]] = None) -> str:
+    d: Dict[str, Any] = {"ok": False, "error": {"type": error_type, "message": message}}
+    if extra:
+        d.update(extra)
+    return json.dumps(d, ensure_ascii=True, separators=(",", ":"))
 
 
 def utils_parse_args(arg_str: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
@@ -94,6 +82,30 @@ def utils_box_center(x1: float, y1: float, x2: float, y2: float) -> Tuple[float,
     return (x1 + x2) / 2.0, (y1 + y2) / 2.0
 
 
+def utils_norm_to_screen_px(xn: float, yn: float, screen_w: int, screen_h: int) -> Tuple[int, int]:
+    xn = max(0.0, min(1000.0, xn))
+    yn = max(0.0, min(1000.0, yn))
+    x = int(round((xn / 1000.0) * (screen_w - 1)))
+    y = int(round((yn / 1000.0) * (screen_h - 1)))
+    return x, y
+
+
+def utils_norm_box_to_screen_rect(x1: float, y1: float, x2: float, y2: float, screen_w: int, screen_h: int,
+                                  min_px: int = 1) -> Tuple[int, int, int, int]:
+    """Normalized box -> (x, y, w, h) screen rectangle, grown about its centre to at least min_px a side."""
+    left, top = utils_norm_to_screen_px(x1, y1, screen_w, screen_h)
+    right, bottom = utils_norm_to_screen_px(x2, y2, screen_w, screen_h)
+    w = min(screen_w, max(min_px, right - left + 1))
+    h = min(screen_h, max(min_px, bottom - top + 1))
+    x = max(0, min(screen_w - w, (left + right) // 2 - (w - 1) // 2))
+    y = max(0, min(screen_h - h, (top + bottom) // 2 - (h - 1) // 2))
+    return x, y, w, h
+
+
+def utils_screen_px_to_norm(x: int, y: int, screen_w: int, screen_h: int) -> Tuple[float, float]:
+    return x * 1000.0 / max(1, screen_w - 1), y * 1000.0 / max(1, screen_h - 1)
+
+
 def utils_strip_think(text: str) -> str:
     if not isinstance(text, str) or not text:
         return ""
@@ -127,24 +139,100 @@ def utils_truncate_base64_images(obj: Any) -> Any:
     return obj
 
 
-def utils_post_json(payload: Dict[str, Any], endpoint: str, timeout: int) -> Dict[str, Any]:
-    logged_payload = utils_truncate_base64_images(json.loads(json.dumps(payload)))
+def utils_log_copy(obj: Any) -> Any:
+    """Structural copy of a payload for logging, with images replaced by short summaries."""
+    if isinstance(obj, dict):
+        return {k: utils_log_copy(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [utils_log_copy(v) for v in obj]
+    if isinstance(obj, ImageRef):
+        return obj.summary()
+    if isinstance(obj, StaticJSON):
+        return utils_log_copy(obj.value)
+    if isinstance(obj, str) and obj.startswith("data:image/"):
+        return utils_summarize_data_image_url(obj)
+    return obj
+
+
+def _utils_request_log_view(payload: Dict[str, Any]) -> Dict[str, Any]:
+    logged_payload = utils_log_copy(payload)
     logged_payload["tools"] = "[TOOLS DEFINITIONS TRUNCATED FOR READABILITY]"
     logged_payload["messages"][0]["content"] = "[SYSTEM PROMPT TRUNCATED FOR READABILITY]"
     logged_payload["messages"][1]["content"] = "[INITIAL USER TASK PROMPT TRUNCATED FOR READABILITY]"
-    print("REQUEST TO MODEL:")
-    print_nested_dict(logged_payload)
-    print()
-    data = json.dumps(payload, ensure_ascii=True).encode("utf-8")
-    req = urllib.request.Request(endpoint, data=data, headers={"Content-Type": "application/json"}, method="POST")
-    with urllib.request.urlopen(req, timeout=timeout) as resp:
-        response = json.loads(resp.read().decode("utf-8"))
-    print("RESPONSE FROM MODEL:")
-    print_nested_dict(response)
-    print("\n")
+    return logged_payload
+
+
+def utils_log_request(payload: Dict[str, Any]) -> None:
+    # The copy and image summarization happen only if a debug record is actually emitted.
+    tracelog_debug("model_request", lambda: {"payload": _utils_request_log_view(payload)})
+
+
+def utils_log_response(response: Dict[str, Any]) -> None:
+    tracelog_debug("model_response", lambda: {"response": response})
+
+
+def utils_post_json(payload: Dict[str, Any], endpoint: str, timeout: int) -> Dict[str, Any]:
+    utils_log_request(payload)
+    with profiler_span("body_build"):
+        data = body_build(payload)
+    with profiler_span("http_post"):
+        body = router_call(lambda url, cancel: transport_post(url, data, {"Content-Type": "application/json"}, timeout, cancel),
+                           endpoint)
+    with profiler_span("json_decode"):
+        response = json.loads(body.decode("utf-8"))
+    utils_log_response(response)
     return response
 
 
+def utils_cached_tokens(response: Dict[str, Any]) -> Optional[int]:
+    """Prompt tokens the server served from its KV cache, if it says.
+
+    OpenAI-style servers report usage.prompt_tokens_details.cached_tokens; llama.cpp
+    reports timings.cache_n. None when neither is present.
+    """
+    details = (response.get("usage") or {}).get("prompt_tokens_details") or {}
+    if details.get("cached_tokens") is not None:
+        return int(details["cached_tokens"])
+    timings = response.get("timings") or {}
+    if timings.get("cache_n") is not None:
+        return int(timings["cache_n"])
+    return None
+
+
+def utils_record_prompt_cache(response: Dict[str, Any]) -> None:
+    usage = response.get("usage") or {}
+    timings = response.get("timings") or {}
+    prompt = usage.get("prompt_tokens")
+    cached = utils_cached_tokens(response)
+    if prompt is None and timings.get("prompt_n") is not None:
+        prompt = int(timings["prompt_n"]) + (cached or 0)
+    prompt_ms = timings.get("prompt_ms")
+    _utils_prompt_cache.append((prompt, cached, prompt_ms))
+    tracelog_info("prompt_cache", {"step": len(_utils_prompt_cache), "prompt_tokens": prompt, "cached_tokens": cached,
+                                   "prompt_ms": prompt_ms})
+
+
+def utils_prompt_cache_stats() -> Dict[str, Any]:
+    """Cache hit rate (cached / prompt tokens) and prefill time, first step vs the rest.
+
+    With a byte-stable prefix the first request pays the full prefill and later ones
+    should hit for at least the system prompt, tools and task.
+    """
+    def summarize(rows: List[Tuple[Optional[int], Optional[int], Optional[float]]]) -> Dict[str, Any]:
+        known = [(p, c) for p, c, _ in rows if p and c is not None]
+        ms = [m for _, _, m in rows if m is not None]
+        return {"responses": len(rows), "reported": len(known),
+                "cached_tokens": sum(c for _, c in known), "prompt_tokens": sum(p for p, _ in known),
+                "hit_rate": sum(c for _, c in known) / sum(p for p, _ in known) if known else None,
+                "prompt_ms_mean": sum(ms) / len(ms) if ms else None}
+    rows = list(_utils_prompt_cache)
+    return {"first": summarize(rows[:1]), "later": summarize(rows[1:])}
+
+
+def utils_prompt_cache_reset() -> None:
+    _utils_prompt_cache.clear()
+
+
 def utils_get_env_str(name: str, default: str) -> str:
     v = os.environ.get(name, "").strip()
     return v if v else default
@@ -158,3 +246,8 @@ def utils_get_env_int(name: str, default: int) -> int:
 def utils_get_env_float(name: str, default: float) -> float:
     v = os.environ.get(name, "").strip()
     return default if not v else float(v)
+
+
+def utils_get_env_bool(name: str, default: bool) -> bool:
+    v = os.environ.get(name, "").strip().lower()
+    return default if not v else v in ("1", "true", "yes", "on")
@@ -1,10 +1,12 @@
 from __future__ import annotations
 import ctypes
-import struct
-import time
-import zlib
 from ctypes import wintypes
-from typing import Tuple
+from typing import Callable, Optional, Tuple, TypeVar
+from desktop import desktop_parse_key
+from keyinput import KEYINPUT_LAYOUTS, keyinput_compile_combo, keyinput_compile_text, keyinput_send
+from profiler import profiler_span
+
+T = TypeVar("T")
 
 if not hasattr(wintypes, "HCURSOR"):
     wintypes.HCURSOR = wintypes.HANDLE
@@ -75,6 +77,9 @@ class INPUT_I(ctypes.Union):
 class INPUT(ctypes.Structure):
     _fields_ = [("type", wintypes.DWORD), ("ii", INPUT_I)]
 
+if ctypes.sizeof(INPUT) != KEYINPUT_LAYOUTS[ctypes.sizeof(ctypes.c_void_p)][0]:
+    raise RuntimeError(f"unexpected INPUT size {ctypes.sizeof(INPUT)}")
+
 user32.GetSystemMetrics.argtypes = [wintypes.INT]
 user32.GetSystemMetrics.restype = wintypes.INT
 user32.GetCursorInfo.argtypes = [ctypes.POINTER(CURSORINFO)]
@@ -121,17 +126,10 @@ def winapi_get_screen_size() -> Tuple[int, int]:
     h = int(user32.GetSystemMetrics(SM_CYSCREEN))
     return (w if w > 0 else 1920, h if h > 0 else 1080)
 
-def winapi_norm_to_screen_px(xn: float, yn: float, screen_w: int, screen_h: int) -> Tuple[int, int]:
-    xn = max(0.0, min(1000.0, xn))
-    yn = max(0.0, min(1000.0, yn))
-    x = int(round((xn / 1000.0) * (screen_w - 1)))
-    y = int(round((yn / 1000.0) * (screen_h - 1)))
-    return x, y
-
 def winapi_move_mouse_to_pixel(x: int, y: int) -> None:
     user32.SetCursorPos(int(x), int(y))
 
-def _winapi_draw_cursor_on_dc(hdc_mem: int, screen_w: int, screen_h: int, dst_w: int, dst_h: int) -> None:
+def _winapi_draw_cursor_on_dc(hdc_mem: int, src_x: int, src_y: int, src_w: int, src_h: int, dst_w: int, dst_h: int) -> None:
     ci = CURSORINFO()
     ci.cbSize = ctypes.sizeof(CURSORINFO)
     if not user32.GetCursorInfo(ctypes.byref(ci)):
@@ -144,8 +142,8 @@ def _winapi_draw_cursor_on_dc(hdc_mem: int, screen_w: int, screen_h: int, dst_w:
     try:
         cur_x = int(ci.ptScreenPos.x) - int(ii.xHotspot)
         cur_y = int(ci.ptScreenPos.y) - int(ii.yHotspot)
-        dx = int(round(cur_x * (dst_w / float(screen_w))))
-        dy = int(round(cur_y * (dst_h / float(screen_h))))
+        dx = int(round((cur_x - src_x) * (dst_w / float(src_w))))
+        dy = int(round((cur_y - src_y) * (dst_h / float(src_h))))
         user32.DrawIconEx(hdc_mem, dx, dy, ci.hCursor, 0, 0, 0, None, DI_NORMAL)
     finally:
         if ii.hbmMask:
@@ -153,29 +151,11 @@ def _winapi_draw_cursor_on_dc(hdc_mem: int, screen_w: int, screen_h: int, dst_w:
         if ii.hbmColor:
             gdi32.DeleteObject(ii.hbmColor)
 
-def _winapi_png_pack(tag: bytes, data: bytes) -> bytes:
-    chunk_head = tag + data
-    return struct.pack("!I", len(data)) + chunk_head + struct.pack("!I", zlib.crc32(chunk_head) & 0xFFFFFFFF)
-
-def _winapi_rgb_to_png_bytes(rgb: bytes, width: int, height: int) -> bytes:
-    raw = bytearray()
-    stride = width * 3
-    for y in range(height):
-        raw.append(0)
-        start = y * stride
-        raw.extend(rgb[start:start + stride])
-    compressor = zlib.compressobj(level=6)
-    compressed = compressor.compress(bytes(raw)) + compressor.flush()
-    png = bytearray()
-    png.extend(b"\x89PNG\r\n\x1a\n")
-    ihdr = struct.pack("!IIBBBBB", width, height, 8, 2, 0, 0, 0)
-    png.extend(_winapi_png_pack(b"IHDR", ihdr))
-    png.extend(_winapi_png_pack(b"IDAT", compressed))
-    png.extend(_winapi_png_pack(b"IEND", b""))
-    return bytes(png)
-
-def winapi_capture_screenshot_png(target_w: int, target_h: int) -> Tuple[bytes, int, int]:
+def winapi_capture_bgra(target_w: int, target_h: int, sink: Callable[[memoryview], T],
+                        region: Optional[Tuple[int, int, int, int]] = None) -> Tuple[T, int, int]:
+    """StretchBlt the screen (or the (x, y, w, h) `region` of it) into a DIB section and pass its bits to `sink` without copying."""
     screen_w, screen_h = winapi_get_screen_size()
+    src_x, src_y, src_w, src_h = region or (0, 0, screen_w, screen_h)
     hdc_screen = user32.GetDC(None)
     if not hdc_screen:
         raise RuntimeError("GetDC failed")
@@ -200,31 +180,27 @@ def winapi_capture_screenshot_png(target_w: int, target_h: int) -> Tuple[bytes,
     old = gdi32.SelectObject(hdc_mem, hbm)
     gdi32.SetStretchBltMode(hdc_mem, HALFTONE)
     gdi32.SetBrushOrgEx(hdc_mem, 0, 0, None)
-    ok = gdi32.StretchBlt(hdc_mem, 0, 0, target_w, target_h, hdc_screen, 0, 0, screen_w, screen_h, SRCCOPY)
+    with profiler_span("gdi_blit"):
+        ok = gdi32.StretchBlt(hdc_mem, 0, 0, target_w, target_h, hdc_screen, src_x, src_y, src_w, src_h, SRCCOPY)
     if not ok:
         gdi32.SelectObject(hdc_mem, old)
         gdi32.DeleteObject(hbm)
         gdi32.DeleteDC(hdc_mem)
         user32.ReleaseDC(None, hdc_screen)
         raise RuntimeError("StretchBlt failed")
-    _winapi_draw_cursor_on_dc(hdc_mem, screen_w, screen_h, target_w, target_h)
+    _winapi_draw_cursor_on_dc(hdc_mem, src_x, src_y, src_w, src_h, target_w, target_h)
     buf_size = target_w * target_h * 4
     raw = (ctypes.c_ubyte * buf_size).from_address(bits_ptr.value)
-    raw_bytes = bytes(raw)
-    gdi32.SelectObject(hdc_mem, old)
-    gdi32.DeleteObject(hbm)
-    gdi32.DeleteDC(hdc_mem)
-    user32.ReleaseDC(None, hdc_screen)
-    rgb = bytearray(target_w * target_h * 3)
-    for i in range(target_w * target_h):
-        b = raw_bytes[i * 4 + 0]
-        g = raw_bytes[i * 4 + 1]
-        r = raw_bytes[i * 4 + 2]
-        rgb[i * 3 + 0] = r
-        rgb[i * 3 + 1] = g
-        rgb[i * 3 + 2] = b
-    png_bytes = _winapi_rgb_to_png_bytes(bytes(rgb), target_w, target_h)
-    return png_bytes, screen_w, screen_h
+    view = memoryview(raw).cast("B")
+    try:
+        result = sink(view)
+    finally:
+        view.release()
+        gdi32.SelectObject(hdc_mem, old)
+        gdi32.DeleteObject(hbm)
+        gdi32.DeleteDC(hdc_mem)
+        user32.ReleaseDC(None, hdc_screen)
+    return result, screen_w, screen_h
 
 def _winapi_send_input(inputs) -> None:
     n = len(inputs)
@@ -244,38 +220,15 @@ def winapi_scroll_down(amount: int = 120) -> None:
     inputs = [INPUT(type=INPUT_MOUSE, ii=INPUT_I(mi=MOUSEINPUT(dx=0, dy=0, mouseData=amount, dwFlags=MOUSEEVENTF_WHEEL, time=0, dwExtraInfo=0)))]
     _winapi_send_input(inputs)
 
-def winapi_type_text(text: str) -> None:
-    for ch in text:
-        code = ord(ch)
-        down = INPUT(type=INPUT_KEYBOARD, ii=INPUT_I(ki=KEYBDINPUT(wVk=0, wScan=code, dwFlags=KEYEVENTF_UNICODE, time=0, dwExtraInfo=0)))
-        up = INPUT(type=INPUT_KEYBOARD, ii=INPUT_I(ki=KEYBDINPUT(wVk=0, wScan=code, dwFlags=KEYEVENTF_UNICODE | KEYEVENTF_KEYUP, time=0, dwExtraInfo=0)))
-        _winapi_send_input([down, up])
-        time.sleep(0.005)
-
-_WINAPI_VK = {
-    "enter": 0x0D, "tab": 0x09, "escape": 0x1B, "esc": 0x1B, "windows": 0x5B, "win": 0x5B,
-    "ctrl": 0x11, "alt": 0x12, "shift": 0x10, "f4": 0x73, "c": 0x43, "v": 0x56,
-    "t": 0x54, "w": 0x57, "f": 0x46, "l": 0x4C,
-}
-
-def _winapi_key_down(vk: int) -> INPUT:
-    return INPUT(type=INPUT_KEYBOARD, ii=INPUT_I(ki=KEYBDINPUT(wVk=vk, wScan=0, dwFlags=0, time=0, dwExtraInfo=0)))
+def _winapi_send_packed(buf: bytes, n: int) -> None:
+    # `buf` is a packed INPUT array (keyinput_pack); one copy into ctypes memory, one syscall.
+    arr = (INPUT * n).from_buffer_copy(buf)
+    sent = user32.SendInput(n, arr, ctypes.sizeof(INPUT))
+    if sent != n:
+        raise RuntimeError(f"SendInput failed: {sent}/{n} events injected")
 
-def _winapi_key_up(vk: int) -> INPUT:
-    return INPUT(type=INPUT_KEYBOARD, ii=INPUT_I(ki=KEYBDINPUT(wVk=vk, wScan=0, dwFlags=KEYEVENTF_KEYUP, time=0, dwExtraInfo=0)))
+def winapi_type_text(text: str) -> None:
+    keyinput_send(keyinput_compile_text(text), _winapi_send_packed)
 
 def winapi_press_key(key: str) -> None:
-    key = key.strip().lower()
-    if not key:
-        raise ValueError("empty key")
-    parts = [p.strip() for p in key.split("+") if p.strip()]
-    if not parts:
-        raise ValueError("empty key parts")
-    vks = []
-    for p in parts:
-        if p not in _WINAPI_VK:
-            raise ValueError(f"unsupported key: {p}")
-        vks.append(_WINAPI_VK[p])
-    downs = [_winapi_key_down(vk) for vk in vks]
-    ups = [_winapi_key_up(vk) for vk in reversed(vks)]
-    _winapi_send_input(downs + ups)
+    keyinput_send(keyinput_compile_combo(desktop_parse_key(key)), _winapi_send_packed, chunk=0)